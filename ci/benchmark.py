@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Compares the call overhead of the ``Aspect`` wrappers to a handwritten wrapper that drives the same advising function.
+
+Only prints the timings (it's not a test, the numbers depend too much on the machine). Run it with::
+
+    PYTHONPATH=src python ci/benchmark.py
+"""
+
+import sys
+import timeit
+
+import aspectlib
+
+NUMBER = 20000
+REPEAT = 15
+
+
+def advising_function(*args, **kwargs):
+    yield
+
+
+def proceeding_advising_function(*args, **kwargs):
+    yield aspectlib.Proceed
+
+
+def cutpoint_function(a, b):
+    return a
+
+
+def handwritten_wrapper(*args, **kwargs):
+    advisor = advising_function(*args, **kwargs)
+    try:
+        advice = next(advisor)
+        while True:
+            if advice is None:
+                try:
+                    result = cutpoint_function(*args, **kwargs)
+                except Exception:
+                    advice = advisor.throw(*sys.exc_info())
+                else:
+                    try:
+                        advice = advisor.send(result)
+                    except StopIteration:
+                        return result
+    finally:
+        advisor.close()
+
+
+def measure(func):
+    assert func(1, 2) == 1
+    return min(timeit.repeat(lambda: func(1, 2), number=NUMBER, repeat=REPEAT)) / NUMBER
+
+
+def main():
+    candidates = [
+        ('plain call', cutpoint_function),
+        ('handwritten wrapper', handwritten_wrapper),
+        ('generic wrapper', aspectlib.Aspect(proceeding_advising_function)(cutpoint_function)),
+        ('inlined wrapper', aspectlib.Aspect(advising_function)(cutpoint_function)),
+        ('specialized wrapper', aspectlib.Aspect(proceeding_advising_function, specialize=True)(cutpoint_function)),
+    ]
+    baseline = None
+    for name, func in candidates:
+        timing = measure(func)
+        if name == 'handwritten wrapper':
+            baseline = timing
+        ratio = f'{timing / baseline:.2f}x handwritten' if baseline else ''
+        print(f'{name:<20} {timing * 1e9:8.1f} ns/call  {ratio:<17} ({func.__code__.co_name})')
+
+
+if __name__ == '__main__':
+    main()
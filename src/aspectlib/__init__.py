@@ -1,9 +1,19 @@
+import __future__
+
+import ast
 import builtins
+import json
+import os
 import re
 import sys
 import warnings
 from collections import deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import partial
+from inspect import Parameter
+from inspect import getsource
 from inspect import isclass
 from inspect import isfunction
 from inspect import isgenerator
@@ -12,12 +22,29 @@ from inspect import ismethod
 from inspect import ismethoddescriptor
 from inspect import ismodule
 from inspect import isroutine
+from inspect import signature
+from itertools import groupby
 from logging import getLogger
-
+from pathlib import Path
+from textwrap import dedent
+from threading import Lock
+from threading import RLock
+from threading import local
+from time import perf_counter
+from time import time
+from types import CodeType
+from types import FunctionType
+from types import MappingProxyType
+from weakref import WeakKeyDictionary
+from weakref import WeakSet
+from weakref import WeakValueDictionary
+from weakref import ref
+
+from .utils import DEBUG
 from .utils import PY3
+from .utils import IdentityMap
 from .utils import Sentinel
 from .utils import basestring
-from .utils import force_bind
 from .utils import logf
 from .utils import make_method_matcher
 from .utils import mimic
@@ -38,6 +65,11 @@ try:
 except ImportError:
     isasyncgenfunction = None
 
+try:
+    from inspect import isasyncgen
+except ImportError:
+    isasyncgen = None
+
 try:
     from inspect import iscoroutinefunction
 
@@ -50,7 +82,33 @@ try:
 except ImportError:
     isasyncfunction = None
 
-__all__ = 'weave', 'Aspect', 'Proceed', 'Return', 'ALL_METHODS', 'NORMAL_METHODS', 'ABSOLUTELY_ALL_METHODS'
+
+def _isasyncadvisingfunction(advising_function):
+    return isasyncgenfunction is not None and isasyncgenfunction(advising_function)
+
+
+__all__ = (
+    'weave',
+    'Aspect',
+    'AspectChain',
+    'Concern',
+    'Hooks',
+    'Items',
+    'Pointcut',
+    'Proceed',
+    'ProceedAll',
+    'ProceedIn',
+    'Return',
+    'Scoped',
+    'Switch',
+    'active',
+    'layers',
+    'weaves',
+    'dump_weaves',
+    'ALL_METHODS',
+    'NORMAL_METHODS',
+    'ABSOLUTELY_ALL_METHODS',
+)
 __version__ = '2.0.0'
 
 logger = getLogger(__name__)
@@ -58,11 +116,13 @@ logdebug = logf(logger.debug)
 logexception = logf(logger.exception)
 
 UNSPECIFIED = Sentinel('UNSPECIFIED')
+ABSENT = Sentinel('ABSENT')
 ABSOLUTELLY_ALL_METHODS = re.compile('.*')
 ABSOLUTELY_ALL_METHODS = ABSOLUTELLY_ALL_METHODS
 ALL_METHODS = re.compile('(?!__getattribute__$)')
 NORMAL_METHODS = re.compile('(?!__.*__$)')
 VALID_IDENTIFIER = re.compile(r'^[^\W\d]\w*$', re.UNICODE if PY3 else 0)
+VALID_PATTERN = re.compile(r'^[\w*?]+$')
 
 
 class UnacceptableAdvice(RuntimeError):
@@ -85,6 +145,10 @@ class UnsupportedType(TypeError):
     pass
 
 
+class WeaveConflict(RuntimeError):
+    pass
+
+
 class Proceed:
     """
     Instruction for calling the decorated function. Can be used multiple times.
@@ -112,14 +176,269 @@ class Return:
         self.value = value
 
 
+class Items:
+    """
+    Instruction for calling the decorated function (like :obj:`Proceed`) and passing every item it produces to
+    `callback`. Only applies to generator (and async generator) cutpoints. The items are not collected anywhere: they
+    are passed to `callback` as they are produced.
+
+    Args:
+        callback (function): Called with each item.
+        proceed: A :obj:`Proceed` instance with the arguments for the decorated function. If not given then the
+            current args and kwargs are used.
+        stride (int): Only pass every `stride`-th item (starting with the first one) to `callback`.
+        batch (int): If given, `callback` gets lists of (at most) `batch` items instead of single items. The last batch
+            is passed when the cutpoint stops (even if it raised an exception).
+    """
+
+    __slots__ = 'callback', 'proceed', 'stride', 'batch'
+
+    def __init__(self, callback, proceed=Proceed, stride=1, batch=None):
+        if stride < 1:
+            raise ValueError(f'stride must be a positive integer (got {stride!r}).')
+        if batch is not None and batch < 1:
+            raise ValueError(f'batch must be a positive integer (got {batch!r}).')
+        self.callback = callback
+        self.proceed = proceed
+        self.stride = stride
+        self.batch = batch
+
+    def _observer(self):
+        """
+        Returns a ``(stride, observe, flush)`` tuple for a single run of the cutpoint.
+        """
+        callback = self.callback
+        size = self.batch
+        if size is None:
+            return self.stride, callback, None
+        batch = []
+
+        def observe(item):
+            nonlocal batch
+            batch.append(item)
+            if len(batch) >= size:
+                full, batch = batch, []
+                callback(full)
+
+        def flush():
+            nonlocal batch
+            if batch:
+                full, batch = batch, []
+                callback(full)
+
+        return self.stride, observe, flush
+
+
+class ProceedIn:
+    """
+    Instruction for calling the decorated function (like :obj:`Proceed`) in a :mod:`concurrent.futures` executor.
+    The advising function gets the result (or exception) back as usual.
+
+    For normal functions the wrapper waits for the result (``executor.submit(...).result()``). For coroutine functions
+    the coroutine is run (with its own event loop) in the executor and the wrapper awaits it with
+    :meth:`~asyncio.loop.run_in_executor`, so the event loop isn't blocked. Generators cannot be used.
+
+    With a :class:`~concurrent.futures.ProcessPoolExecutor` the worker gets the cutpoint by module and qualname and
+    unwraps it (the name points to the wrapper by now). Thus only module-level functions and methods of module-level
+    classes weaved with :func:`weave` can be used (:exc:`UnacceptableAdvice` is raised for decorated functions, as the
+    worker would run the advice again), the arguments and results must be picklable, and other aspects weaved under
+    this one don't run in the worker.
+
+    Args:
+        executor: A :class:`concurrent.futures.Executor` instance.
+        proceed: A :obj:`Proceed` instance with the arguments for the decorated function. If not given then the
+            current args and kwargs are used.
+    """
+
+    __slots__ = 'executor', 'proceed'
+
+    def __init__(self, executor, proceed=Proceed):
+        self.executor = executor
+        self.proceed = proceed
+
+    def _call(self, cutpoint_function, /, *args, **kwargs):
+        return self.executor.submit(_portable(self.executor, cutpoint_function), *args, **kwargs).result()
+
+    def _call_async(self, cutpoint_function, /, *args, **kwargs):
+        return _proceed_in_executor(self.executor, _portable(self.executor, cutpoint_function), *args, **kwargs)
+
+
+class ProceedAll:
+    """
+    Instruction for calling the decorated function concurrently, once for every given :obj:`Proceed`. The advising
+    function gets the list of results (in the same order). If any of the calls raises then the exception is raised in
+    the advising function (the first one, in the given order).
+
+    Coroutine functions are run as concurrent tasks (the tasks that are still running when the exception is raised get
+    cancelled). Normal functions are run in `executor`, or in a shared thread pool if `executor` isn't given (don't use
+    the shared pool for cutpoints that use ``ProceedAll`` themselves). Generators cannot be used. Process pools have
+    the same limits as in :obj:`ProceedIn`.
+
+    Args:
+        proceeds (list): :obj:`Proceed` instances. The bare :obj:`Proceed` means the current args and kwargs.
+        executor: A :class:`concurrent.futures.Executor` instance. For coroutine functions it's optional: if given,
+            each coroutine is run (with its own event loop) in the executor.
+    """
+
+    __slots__ = 'proceeds', 'executor'
+
+    proceed = Proceed
+
+    def __init__(self, proceeds, executor=None):
+        self.proceeds = list(proceeds)
+        for proceed in self.proceeds:
+            if proceed is not Proceed and not isinstance(proceed, Proceed):
+                raise ExpectedAdvice(f'{proceed} must be a `Proceed` instance.')
+        self.executor = executor
+
+    def _arguments(self, args, kwargs):
+        for proceed in self.proceeds:
+            if proceed is Proceed:
+                yield args, kwargs
+            else:
+                yield proceed.args, proceed.kwargs
+
+    def _call(self, cutpoint_function, /, *args, **kwargs):
+        executor = self.executor or _get_default_executor()
+        cutpoint_function = _portable(executor, cutpoint_function)
+        futures = [executor.submit(cutpoint_function, *args, **kwargs) for args, kwargs in self._arguments(args, kwargs)]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def _call_async(self, cutpoint_function, /, *args, **kwargs):
+        from asyncio import ensure_future
+
+        if self.executor is None:
+            calls = [cutpoint_function(*args, **kwargs) for args, kwargs in self._arguments(args, kwargs)]
+        else:
+            cutpoint_function = _portable(self.executor, cutpoint_function)
+            calls = [
+                _proceed_in_executor(self.executor, cutpoint_function, *args, **kwargs) for args, kwargs in self._arguments(args, kwargs)
+            ]
+        tasks = [ensure_future(call) for call in calls]
+        try:
+            return [await task for task in tasks]
+        finally:
+            for task in tasks:
+                if not task.cancel() and not task.cancelled():
+                    task.exception()  # the failures after the first one are not raised, just mark them as retrieved
+
+
+_default_executor = None
+_default_executor_lock = Lock()
+
+
+def _get_default_executor():
+    global _default_executor
+    if _default_executor is None:
+        with _default_executor_lock:
+            if _default_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                _default_executor = ThreadPoolExecutor(thread_name_prefix='aspectlib')
+    return _default_executor
+
+
+class _CutpointReference:
+    """
+    Picklable stand-in for a cutpoint that is sent to a process pool. Pickling the function itself doesn't work as it's
+    pickled by name and the name points to the wrapper.
+    """
+
+    __slots__ = 'module', 'qualname'
+
+    def __init__(self, module, qualname):
+        self.module = module
+        self.qualname = qualname
+
+    def __call__(self, /, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def resolve(self):
+        target = _import_module(self.module)
+        for name in self.qualname.split('.'):
+            target = getattr(target, name)
+        return getattr(target, '__woven__', (target,))[0]
+
+
+def _portable(executor, cutpoint_function):
+    process = sys.modules.get('concurrent.futures.process')
+    if process is None or not isinstance(executor, process.ProcessPoolExecutor):
+        return cutpoint_function
+    module = getattr(cutpoint_function, '__module__', None)
+    qualname = getattr(cutpoint_function, '__qualname__', None)
+    if not isinstance(module, str) or not isinstance(qualname, str):
+        return cutpoint_function  # not a function, up to the executor to pickle it
+    reference = _CutpointReference(module, qualname)
+    try:
+        resolved = reference.resolve()
+    except (ImportError, AttributeError):
+        resolved = None
+    if resolved is not cutpoint_function:
+        raise UnacceptableAdvice(
+            f"Can't call {cutpoint_function!r} in a process pool: {module}.{qualname} is not that function or a weave of it. "
+            'Only module-level functions (or methods of module-level classes) that are weaved with aspectlib.weave (not '
+            'decorated) can be used.'
+        )
+    return reference
+
+
+async def _proceed_in_executor(executor, cutpoint_function, /, *args, **kwargs):
+    from asyncio import get_running_loop
+
+    return await get_running_loop().run_in_executor(executor, partial(_run_coroutine, cutpoint_function, args, kwargs))
+
+
+def _run_coroutine(cutpoint_function, args, kwargs):
+    from asyncio import run
+
+    return run(cutpoint_function(*args, **kwargs))
+
+
+def _observed(gen, stride, observe, flush):
+    """
+    Forwards everything to and from `gen` (like ``yield from`` would) and passes every `stride`-th item to `observe`.
+    """
+    countdown = 1
+    try:
+        item = next(gen)
+        while True:
+            countdown -= 1
+            if not countdown:
+                countdown = stride
+                observe(item)
+            try:
+                value = yield item
+            except GeneratorExit:
+                gen.close()
+                raise
+            except BaseException as exc:
+                item = gen.throw(exc)
+            else:
+                item = gen.send(value)
+    except StopIteration as exc:
+        return exc.value
+    finally:
+        if flush is not None:
+            flush()
+
+
 class Aspect:
     """
     Container for the advice yielding generator. Can be used as a decorator on other function to change behavior
     according to the advices yielded from the generator.
 
     Args:
-        advising_function (generator function): A generator function that yields :ref:`advices`.
+        advising_function (generator function): A generator function that yields :ref:`advices`. For coroutine
+            cutpoints it can also be an async generator function (so the advice can ``await`` things).
         bind (bool): A convenience flag so you can access the cutpoint function (you'll get it as an argument).
+        specialize (bool): If ``True`` the wrapper is compiled with the exact signature of the cutpoint function instead
+            of ``*args, **kwargs``. The advising function then gets the arguments normalized: positional-or-keyword
+            arguments are always passed positionally and the defaults are filled in. Falls back to the generic wrapper
+            if the signature cannot be determined.
 
     Usage::
 
@@ -155,42 +474,177 @@ class Aspect:
 
     """
 
-    __slots__ = 'advising_function', 'bind'
+    __slots__ = 'advising_function', 'bind', 'specialize'
 
-    def __new__(cls, advising_function=UNSPECIFIED, bind=False):
+    def __new__(cls, advising_function=UNSPECIFIED, bind=False, **options):
         if advising_function is UNSPECIFIED:
-            return partial(cls, bind=bind)
+            return partial(cls, bind=bind, **options)
         else:
             self = super().__new__(cls)
-            self.__init__(advising_function, bind)
+            self.__init__(advising_function, bind, **options)
             return self
 
-    def __init__(self, advising_function, bind=False):
-        if not isgeneratorfunction(advising_function):
+    def __init__(self, advising_function, bind=False, specialize=False):
+        if not isgeneratorfunction(advising_function) and not _isasyncadvisingfunction(advising_function):
             raise ExpectedGeneratorFunction(f'advising_function {advising_function} must be a generator function.')
         self.advising_function = advising_function
         self.bind = bind
+        self.specialize = specialize
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.advising_function == other.advising_function and self.bind == other.bind and self.specialize == other.specialize
+
+    def __hash__(self):
+        return hash((type(self), self.advising_function, self.bind, self.specialize))
 
     def __call__(self, cutpoint_function):
-        if isasyncfunction is not None and isasyncfunction(cutpoint_function):
-            assert isasyncgenfunction(cutpoint_function) or iscoroutinefunction(cutpoint_function)
+        advising_function = _logged_advising_function(self.advising_function) if DEBUG else self.advising_function
+        if _isasyncadvisingfunction(self.advising_function):
+            if not iscoroutinefunction(cutpoint_function):
+                raise ExpectedGeneratorFunction(
+                    f'advising_function {self.advising_function} is an async generator function, '
+                    f'it can only be used on coroutine functions (not {cutpoint_function}).'
+                )
 
-            async def advising_asyncgenerator_wrapper_py35(*args, **kwargs):
+            async def advising_coroutine_wrapper(*args, **kwargs):
+                if self.bind:
+                    advisor = advising_function(cutpoint_function, *args, **kwargs)
+                else:
+                    advisor = advising_function(*args, **kwargs)
+                if not isasyncgen(advisor):
+                    raise ExpectedGenerator(f'advising_function {self.advising_function} did not return an async generator.')
+                try:
+                    advice = await advisor.__anext__()
+                    while True:
+                        if advice is Proceed or advice is None or isinstance(advice, (Proceed, ProceedIn, ProceedAll)):
+                            runner = None
+                            if isinstance(advice, (ProceedIn, ProceedAll)):
+                                runner = advice
+                                advice = advice.proceed
+                            if isinstance(advice, Proceed):
+                                args = advice.args
+                                kwargs = advice.kwargs
+                            if runner is None:
+                                gen = cutpoint_function(*args, **kwargs)
+                            else:
+                                gen = runner._call_async(cutpoint_function, *args, **kwargs)
+                            try:
+                                result = await gen
+                            except BaseException as exc:
+                                advice = await advisor.athrow(exc)
+                            else:
+                                try:
+                                    advice = await advisor.asend(result)
+                                except StopAsyncIteration:
+                                    return result
+                            finally:
+                                gen.close()
+                        elif advice is Return:
+                            return
+                        elif isinstance(advice, Return):
+                            return advice.value
+                        else:
+                            raise UnacceptableAdvice(f'Unknown advice {advice}')
+                finally:
+                    await advisor.aclose()
+
+            return mimic(advising_coroutine_wrapper, cutpoint_function)
+        if self.specialize:
+            wrapper = _specialized_wrapper(advising_function, cutpoint_function, self.bind)
+            if wrapper is not None:
+                return wrapper
+        elif not DEBUG:
+            wrapper = _inlined_wrapper(advising_function, cutpoint_function, self.bind)
+            if wrapper is not None:
+                return wrapper
+        if isasyncgenfunction is not None and isasyncgenfunction(cutpoint_function):
+
+            async def advising_asyncgenerator_wrapper(*args, **kwargs):
                 if self.bind:
-                    advisor = self.advising_function(cutpoint_function, *args, **kwargs)
+                    advisor = advising_function(cutpoint_function, *args, **kwargs)
                 else:
-                    advisor = self.advising_function(*args, **kwargs)
+                    advisor = advising_function(*args, **kwargs)
                 if not isgenerator(advisor):
                     raise ExpectedGenerator(f'advising_function {self.advising_function} did not return a generator.')
                 try:
                     advice = next(advisor)
                     while True:
-                        logdebug('Got advice %r from %s', advice, self.advising_function)
-                        if advice is Proceed or advice is None or isinstance(advice, Proceed):
+                        if advice is Proceed or advice is None or isinstance(advice, (Proceed, Items)):
+                            observe = flush = None
+                            if isinstance(advice, Items):
+                                stride, observe, flush = advice._observer()
+                                countdown = 1
+                                advice = advice.proceed
                             if isinstance(advice, Proceed):
                                 args = advice.args
                                 kwargs = advice.kwargs
                             gen = cutpoint_function(*args, **kwargs)
+                            try:
+                                item = await gen.__anext__()
+                                while True:
+                                    if observe is not None:
+                                        countdown -= 1
+                                        if not countdown:
+                                            countdown = stride
+                                            observe(item)
+                                    try:
+                                        value = yield item
+                                    except GeneratorExit:
+                                        raise
+                                    except BaseException as exc:
+                                        item = await gen.athrow(exc)
+                                    else:
+                                        item = await gen.asend(value)
+                            except StopAsyncIteration:
+                                try:
+                                    advice = advisor.send(None)
+                                except StopIteration:
+                                    return
+                            except BaseException as exc:
+                                advice = advisor.throw(exc)
+                            finally:
+                                await gen.aclose()
+                                if flush is not None:
+                                    flush()
+                        elif advice is Return:
+                            return
+                        elif isinstance(advice, Return):
+                            if advice.value is not None:
+                                raise UnacceptableAdvice(f'Async generators cannot return a value (got {advice.value!r}).')
+                            return
+                        else:
+                            raise UnacceptableAdvice(f'Unknown advice {advice}')
+                finally:
+                    advisor.close()
+
+            return mimic(advising_asyncgenerator_wrapper, cutpoint_function)
+        elif isasyncfunction is not None and isasyncfunction(cutpoint_function):
+            assert iscoroutinefunction(cutpoint_function)
+
+            async def advising_asyncgenerator_wrapper_py35(*args, **kwargs):
+                if self.bind:
+                    advisor = advising_function(cutpoint_function, *args, **kwargs)
+                else:
+                    advisor = advising_function(*args, **kwargs)
+                if not isgenerator(advisor):
+                    raise ExpectedGenerator(f'advising_function {self.advising_function} did not return a generator.')
+                try:
+                    advice = next(advisor)
+                    while True:
+                        if advice is Proceed or advice is None or isinstance(advice, (Proceed, ProceedIn, ProceedAll)):
+                            runner = None
+                            if isinstance(advice, (ProceedIn, ProceedAll)):
+                                runner = advice
+                                advice = advice.proceed
+                            if isinstance(advice, Proceed):
+                                args = advice.args
+                                kwargs = advice.kwargs
+                            if runner is None:
+                                gen = cutpoint_function(*args, **kwargs)
+                            else:
+                                gen = runner._call_async(cutpoint_function, *args, **kwargs)
                             try:
                                 result = await gen
                             except BaseException:
@@ -217,22 +671,28 @@ class Aspect:
 
             def advising_generator_wrapper_py35(*args, **kwargs):
                 if self.bind:
-                    advisor = self.advising_function(cutpoint_function, *args, **kwargs)
+                    advisor = advising_function(cutpoint_function, *args, **kwargs)
                 else:
-                    advisor = self.advising_function(*args, **kwargs)
+                    advisor = advising_function(*args, **kwargs)
                 if not isgenerator(advisor):
                     raise ExpectedGenerator(f'advising_function {self.advising_function} did not return a generator.')
                 try:
                     advice = next(advisor)
                     while True:
-                        logdebug('Got advice %r from %s', advice, self.advising_function)
-                        if advice is Proceed or advice is None or isinstance(advice, Proceed):
+                        if advice is Proceed or advice is None or isinstance(advice, (Proceed, Items)):
+                            observer = None
+                            if isinstance(advice, Items):
+                                observer = advice._observer()
+                                advice = advice.proceed
                             if isinstance(advice, Proceed):
                                 args = advice.args
                                 kwargs = advice.kwargs
                             gen = cutpoint_function(*args, **kwargs)
                             try:
-                                result = yield from gen
+                                if observer is None:
+                                    result = yield from gen
+                                else:
+                                    result = yield from _observed(gen, *observer)
                             except BaseException:
                                 advice = advisor.throw(*sys.exc_info())
                             else:
@@ -256,21 +716,27 @@ class Aspect:
 
             def advising_function_wrapper(*args, **kwargs):
                 if self.bind:
-                    advisor = self.advising_function(cutpoint_function, *args, **kwargs)
+                    advisor = advising_function(cutpoint_function, *args, **kwargs)
                 else:
-                    advisor = self.advising_function(*args, **kwargs)
+                    advisor = advising_function(*args, **kwargs)
                 if not isgenerator(advisor):
                     raise ExpectedGenerator(f'advising_function {self.advising_function} did not return a generator.')
                 try:
                     advice = next(advisor)
                     while True:
-                        logdebug('Got advice %r from %s', advice, self.advising_function)
-                        if advice is Proceed or advice is None or isinstance(advice, Proceed):
+                        if advice is Proceed or advice is None or isinstance(advice, (Proceed, ProceedIn, ProceedAll)):
+                            runner = None
+                            if isinstance(advice, (ProceedIn, ProceedAll)):
+                                runner = advice
+                                advice = advice.proceed
                             if isinstance(advice, Proceed):
                                 args = advice.args
                                 kwargs = advice.kwargs
                             try:
-                                result = cutpoint_function(*args, **kwargs)
+                                if runner is None:
+                                    result = cutpoint_function(*args, **kwargs)
+                                else:
+                                    result = runner._call(cutpoint_function, *args, **kwargs)
                             except Exception:
                                 advice = advisor.throw(*sys.exc_info())
                             else:
@@ -290,153 +756,2566 @@ class Aspect:
             return mimic(advising_function_wrapper, cutpoint_function)
 
 
-class Fabric:
-    pass
-
-
-class Rollback:
+def _logged_advising_function(advising_function):
     """
-    When called, rollbacks all the patches and changes the :func:`weave` has done.
+    Debug variant of `advising_function`: all the advices yielded by the advisor are logged.
     """
 
-    __slots__ = ('_rollbacks',)
-
-    def __init__(self, rollback=None):
-        if rollback is None:
-            self._rollbacks = []
-        elif isinstance(rollback, (list, tuple)):
-            self._rollbacks = rollback
+    def logged_advising_function(*args, **kwargs):
+        advisor = advising_function(*args, **kwargs)
+        if isgenerator(advisor):
+            return _logged_advisor(advisor, advising_function)
+        elif isasyncgen(advisor):
+            return _logged_async_advisor(advisor, advising_function)
         else:
-            self._rollbacks = [rollback]
+            return advisor
 
-    def merge(self, *others):
-        self._rollbacks.extend(others)
+    return logged_advising_function
 
-    def __enter__(self):
-        return self
 
-    def __exit__(self, *_):
-        for rollback in self._rollbacks:
-            rollback()
-        del self._rollbacks[:]
+def _logged_advisor(advisor, advising_function):
+    try:
+        advice = next(advisor)
+        while True:
+            logdebug('Got advice %r from %s', advice, advising_function)
+            try:
+                value = yield advice
+            except GeneratorExit:
+                raise
+            except BaseException:
+                advice = advisor.throw(*sys.exc_info())
+            else:
+                advice = advisor.send(value)
+    except StopIteration as exc:
+        return exc.value
+    finally:
+        advisor.close()
 
-    rollback = __call__ = __exit__
 
+async def _logged_async_advisor(advisor, advising_function):
+    try:
+        advice = await advisor.__anext__()
+        while True:
+            logdebug('Got advice %r from %s', advice, advising_function)
+            try:
+                value = yield advice
+            except GeneratorExit:
+                raise
+            except BaseException as exc:
+                advice = await advisor.athrow(exc)
+            else:
+                advice = await advisor.asend(value)
+    except StopAsyncIteration:
+        return
+    finally:
+        await advisor.aclose()
+
+
+_specialized_factories = {}
+_SPECIALIZED_RESERVED = frozenset(
+    ('Proceed', 'ProceedIn', 'ProceedAll', 'Return', 'Items', 'UnacceptableAdvice', 'BaseException', 'Exception', 'StopIteration')
+)
+
+_SPECIALIZED_CALL = {
+    'function': """
+                        try:
+                            if _aspectlib_runner is None:
+                                _aspectlib_result = _aspectlib_cutpoint({call})
+                            else:
+                                _aspectlib_result = _aspectlib_runner._call(_aspectlib_cutpoint, {call})
+                        except Exception:
+                            _aspectlib_advice = _aspectlib_advisor.throw(*_aspectlib_sys.exc_info())
+                        else:
+                            try:
+                                _aspectlib_advice = _aspectlib_advisor.send(_aspectlib_result)
+                            except StopIteration:
+                                return _aspectlib_result""",
+    'generator': """
+                        _aspectlib_gen = _aspectlib_cutpoint({call})
+                        try:
+                            if _aspectlib_observer is None:
+                                _aspectlib_result = yield from _aspectlib_gen
+                            else:
+                                _aspectlib_result = yield from _aspectlib_observed(_aspectlib_gen, *_aspectlib_observer)
+                        except BaseException:
+                            _aspectlib_advice = _aspectlib_advisor.throw(*_aspectlib_sys.exc_info())
+                        else:
+                            try:
+                                _aspectlib_advice = _aspectlib_advisor.send(_aspectlib_result)
+                            except StopIteration:
+                                return _aspectlib_result
+                        finally:
+                            _aspectlib_gen.close()""",
+    'coroutine': """
+                        if _aspectlib_runner is None:
+                            _aspectlib_gen = _aspectlib_cutpoint({call})
+                        else:
+                            _aspectlib_gen = _aspectlib_runner._call_async(_aspectlib_cutpoint, {call})
+                        try:
+                            _aspectlib_result = await _aspectlib_gen
+                        except BaseException:
+                            _aspectlib_advice = _aspectlib_advisor.throw(*_aspectlib_sys.exc_info())
+                        else:
+                            try:
+                                _aspectlib_advice = _aspectlib_advisor.send(_aspectlib_result)
+                            except StopIteration:
+                                return _aspectlib_result
+                        finally:
+                            _aspectlib_gen.close()""",
+}
+
+_SPECIALIZED_RUNNER = """
+                    _aspectlib_runner = None
+                    if _aspectlib_isinstance(_aspectlib_advice, (ProceedIn, ProceedAll)):
+                        _aspectlib_runner = _aspectlib_advice
+                        _aspectlib_advice = _aspectlib_advice.proceed"""
+
+_SPECIALIZED_UNWRAP = {
+    'function': ('(Proceed, ProceedIn, ProceedAll)', _SPECIALIZED_RUNNER),
+    'generator': (
+        '(Proceed, Items)',
+        """
+                    _aspectlib_observer = None
+                    if _aspectlib_isinstance(_aspectlib_advice, Items):
+                        _aspectlib_observer = _aspectlib_advice._observer()
+                        _aspectlib_advice = _aspectlib_advice.proceed""",
+    ),
+    'coroutine': ('(Proceed, ProceedIn, ProceedAll)', _SPECIALIZED_RUNNER),
+}
+
+_SPECIALIZED_TEMPLATE = """
+def make(_aspectlib_advising_function, _aspectlib_cutpoint, _aspectlib_sys, _aspectlib_observed,
+         _aspectlib_next, _aspectlib_isinstance, Proceed, ProceedIn, ProceedAll, Return, Items, UnacceptableAdvice):
+    {prefix}def {name}({parameters}):
+        _aspectlib_advisor = _aspectlib_advising_function({bind}{call})
+        try:
+            _aspectlib_advice = _aspectlib_next(_aspectlib_advisor)
+            _aspectlib_proceed = None
+            while True:
+                if _aspectlib_advice is Proceed or _aspectlib_advice is None or _aspectlib_isinstance(_aspectlib_advice, {proceed_types}):{unwrap}
+                    if _aspectlib_isinstance(_aspectlib_advice, Proceed):
+                        _aspectlib_proceed = _aspectlib_advice
+                    if _aspectlib_proceed is None:{direct}
+                    else:{proceed}
+                elif _aspectlib_advice is Return:
+                    return
+                elif _aspectlib_isinstance(_aspectlib_advice, Return):
+                    return _aspectlib_advice.value
+                else:
+                    raise UnacceptableAdvice(f'Unknown advice {{_aspectlib_advice}}')
+        finally:
+            _aspectlib_advisor.close()
+    return {name}
+"""
 
-class ObjectBag:
-    def __init__(self):
-        self._objects = {}
 
-    def has(self, obj):
-        if id(obj) in self._objects:
-            logdebug('  --- ObjectBag ALREADY HAS %r', obj)
-            return True
+def _specialized_wrapper(advising_function, cutpoint_function, bind):
+    """
+    Makes a wrapper that has the exact signature of `cutpoint_function` (so it doesn't need to pack the arguments in
+    ``*args, **kwargs``). Returns ``None`` if the signature can't be reproduced.
+    """
+    kind = _cutpoint_kind(cutpoint_function)
+    if kind == 'asyncgenerator':
+        return
+    try:
+        cutpoint_signature = signature(cutpoint_function, follow_wrapped=False)
+    except (TypeError, ValueError):
+        return
+    parameters = tuple((parameter.name, parameter.kind) for parameter in cutpoint_signature.parameters.values())
+    for name, _ in parameters:
+        if name.startswith('_aspectlib_') or name in _SPECIALIZED_RESERVED:
+            return
+
+    key = parameters, bool(bind), kind
+    factory = _specialized_factories.get(key)
+    if factory is None:
+        factory = _specialized_factories[key] = _compile_specialized_factory(*key)
+    wrapper = factory(
+        advising_function,
+        cutpoint_function,
+        sys,
+        _observed,
+        next,
+        isinstance,
+        Proceed,
+        ProceedIn,
+        ProceedAll,
+        Return,
+        Items,
+        UnacceptableAdvice,
+    )
+
+    defaults = []
+    kwdefaults = {}
+    annotations = {}
+    for parameter in cutpoint_signature.parameters.values():
+        if parameter.default is not parameter.empty:
+            if parameter.kind is parameter.KEYWORD_ONLY:
+                kwdefaults[parameter.name] = parameter.default
+            else:
+                defaults.append(parameter.default)
+        if parameter.annotation is not parameter.empty:
+            annotations[parameter.name] = parameter.annotation
+    if cutpoint_signature.return_annotation is not cutpoint_signature.empty:
+        annotations['return'] = cutpoint_signature.return_annotation
+    wrapper.__defaults__ = tuple(defaults) or None
+    wrapper.__kwdefaults__ = kwdefaults or None
+    wrapper.__annotations__ = annotations
+    return mimic(wrapper, cutpoint_function)
+
+
+def _compile_specialized_factory(parameters, bind, kind):
+    definition = []
+    call = []
+    positional_only = keyword_only = False
+    for name, kind_ in parameters:
+        if kind_ is Parameter.POSITIONAL_ONLY:
+            positional_only = True
+        elif positional_only:
+            definition.append('/')
+            positional_only = False
+        if kind_ is Parameter.VAR_POSITIONAL:
+            definition.append(f'*{name}')
+            call.append(f'*{name}')
+            keyword_only = True
+        elif kind_ is Parameter.VAR_KEYWORD:
+            definition.append(f'**{name}')
+            call.append(f'**{name}')
+        elif kind_ is Parameter.KEYWORD_ONLY:
+            if not keyword_only:
+                definition.append('*')
+                keyword_only = True
+            definition.append(name)
+            call.append(f'{name}={name}')
         else:
-            self._objects[id(obj)] = obj
-            return False
+            definition.append(name)
+            call.append(name)
+    if positional_only:
+        definition.append('/')
+    call = ', '.join(call)
+
+    source = _SPECIALIZED_TEMPLATE.format(
+        prefix='async ' if kind == 'coroutine' else '',
+        name='advising_specialized_wrapper',
+        parameters=', '.join(definition),
+        bind='_aspectlib_cutpoint, ' if bind and call else '_aspectlib_cutpoint' if bind else '',
+        call=call,
+        proceed_types=_SPECIALIZED_UNWRAP[kind][0],
+        unwrap=_SPECIALIZED_UNWRAP[kind][1],
+        direct=_SPECIALIZED_CALL[kind].format(call=call),
+        proceed=_SPECIALIZED_CALL[kind].format(call='*_aspectlib_proceed.args, **_aspectlib_proceed.kwargs'),
+    )
+    namespace = {}
+    exec(compile(source, f'<aspectlib specialized {kind} wrapper>', 'exec'), namespace)  # noqa: S102 - generated from the cutpoint's signature
+    return namespace['make']
+
+
+def _cutpoint_kind(cutpoint_function):
+    if isasyncgenfunction is not None and isasyncgenfunction(cutpoint_function):
+        return 'asyncgenerator'
+    elif isasyncfunction is not None and iscoroutinefunction(cutpoint_function):
+        return 'coroutine'
+    elif isgeneratorfunction(cutpoint_function):
+        return 'generator'
+    else:
+        return 'function'
 
 
-BrokenBag = type('BrokenBag', (), {'has': lambda self, obj: False})()
+_inlined_advising_functions = WeakKeyDictionary()
 
+_FUTURE_FLAGS = 0
+for _feature in __future__.all_feature_names:
+    _FUTURE_FLAGS |= getattr(__future__, _feature).compiler_flag
+del _feature
 
-class EmptyRollback:
-    def __enter__(self):
-        return self
 
-    def __exit__(self, *_):
-        pass
+def _inlined_wrapper(advising_function, cutpoint_function, bind):
+    """
+    Makes a wrapper that runs the advising function's code directly (without the generator protocol) if it's a simple
+    "before; yield; after" advising function. Returns ``None`` if that can't be done.
+    """
+    kind = _cutpoint_kind(cutpoint_function)
+    if kind == 'asyncgenerator' or not isfunction(advising_function) or not isgeneratorfunction(advising_function):
+        return
+    cache = _inlined_advising_functions.get(advising_function)
+    if cache is None:
+        cache = _inlined_advising_functions[advising_function] = {}
+    key = kind, bool(bind)
+    if key in cache:
+        inlined = cache[key]
+    else:
+        try:
+            inlined = _compile_inlined(advising_function, *key)
+        except (OSError, TypeError, SyntaxError, ValueError):
+            inlined = None
+        cache[key] = inlined
+    if inlined is None:
+        return
 
-    rollback = __call__ = __exit__
+    if kind == 'coroutine':
 
+        async def advising_inlined_coroutine_wrapper(*args, **kwargs):
+            return await inlined(cutpoint_function, args, kwargs, *args, **kwargs)
 
-Nothing = EmptyRollback()
+        return mimic(advising_inlined_coroutine_wrapper, cutpoint_function)
+    elif kind == 'generator':
 
+        def advising_inlined_generator_wrapper(*args, **kwargs):
+            return (yield from inlined(cutpoint_function, args, kwargs, *args, **kwargs))
 
-def _checked_apply(aspects, function, module=None):
-    logdebug('  applying aspects %s to function %s.', aspects, function)
-    if callable(aspects):
-        wrapper = aspects(function)
-        assert callable(wrapper), f'Aspect {aspects} did not return a callable (it return {wrapper}).'
+        return mimic(advising_inlined_generator_wrapper, cutpoint_function)
     else:
-        wrapper = function
-        for aspect in aspects:
-            wrapper = aspect(wrapper)
-            assert callable(wrapper), f'Aspect {aspect} did not return a callable (it return {wrapper}).'
-    return mimic(wrapper, function, module=module)
 
+        def advising_inlined_function_wrapper(*args, **kwargs):
+            return inlined(cutpoint_function, args, kwargs, *args, **kwargs)
 
-def _check_name(name):
-    if not VALID_IDENTIFIER.match(name):
-        raise SyntaxError(
-            f'Could not match {name!r} to {VALID_IDENTIFIER.pattern!r}. It should be a string of '
-            'letters, numbers and underscore that starts with a letter or underscore.'
+        return mimic(advising_inlined_function_wrapper, cutpoint_function)
+
+
+def _compile_inlined(advising_function, kind, bind):
+    """
+    Rewrites an advising function that has a single bare ``yield`` (or ``name = yield``) at the top level of its body
+    into a plain function that calls the cutpoint instead of yielding. The result takes the cutpoint, the args and the
+    kwargs before the advising function's own arguments.
+    """
+    code = advising_function.__code__
+    if '__class__' in code.co_freevars or any(name.startswith('_aspectlib_') for name in code.co_varnames):
+        return
+    tree = ast.parse(dedent(getsource(advising_function)))
+    node = tree.body[0] if len(tree.body) == 1 else None
+    if not isinstance(node, ast.FunctionDef) or node.name != code.co_name:
+        return
+    ast.increment_lineno(tree, code.co_firstlineno - 1)
+    node.decorator_list = []
+
+    # Make sure the source is what got compiled (it could have changed since the module was imported).
+    original = _compile_in_factory(node, code, advising_function.__globals__)
+    if (original.co_code, original.co_names, original.co_varnames, original.co_freevars) != (
+        code.co_code,
+        code.co_names,
+        code.co_varnames,
+        code.co_freevars,
+    ):
+        return
+
+    position = None
+    for index, statement in enumerate(node.body):
+        if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Yield):
+            target = None
+        elif (
+            isinstance(statement, ast.Assign)
+            and isinstance(statement.value, ast.Yield)
+            and len(statement.targets) == 1
+            and isinstance(statement.targets[0], ast.Name)
+        ):
+            target = statement.targets[0].id
+        else:
+            continue
+        if statement.value.value is not None:
+            return
+        position = index
+        break
+    if position is None or _count_suspensions(node) != 1:
+        return
+
+    call = ast.Call(
+        func=ast.Name('_aspectlib_cutpoint', ast.Load()),
+        args=[ast.Starred(ast.Name('_aspectlib_args', ast.Load()), ast.Load())],
+        keywords=[ast.keyword(None, ast.Name('_aspectlib_kwargs', ast.Load()))],
+    )
+    if kind == 'generator':
+        call = ast.YieldFrom(call)
+    elif kind == 'coroutine':
+        call = ast.Await(call)
+    body = [ast.Assign([ast.Name('_aspectlib_result', ast.Store())], call)]
+    if target is not None:
+        body.append(ast.Assign([ast.Name(target, ast.Store())], ast.Name('_aspectlib_result', ast.Load())))
+    for statement in body:
+        ast.copy_location(statement, node.body[position])
+    returns = ast.copy_location(ast.Return(ast.Name('_aspectlib_result', ast.Load())), node.body[-1])
+    node.body = node.body[:position] + body + node.body[position + 1 :] + [returns]
+
+    positional = node.args.posonlyargs or node.args.args
+    if bind:
+        if not positional or len(node.args.posonlyargs) + len(node.args.args) == len(node.args.defaults):
+            return
+        # The cutpoint argument is taken from the wrapper's first argument, not from the caller.
+        argument = positional.pop(0)
+        node.body.insert(
+            0,
+            ast.copy_location(ast.Assign([ast.Name(argument.arg, ast.Store())], ast.Name('_aspectlib_cutpoint', ast.Load())), node),
         )
+    positional[:0] = [ast.arg('_aspectlib_cutpoint'), ast.arg('_aspectlib_args'), ast.arg('_aspectlib_kwargs')]
+    if kind == 'coroutine':
+        node = ast.AsyncFunctionDef(**{field: getattr(node, field) for field in node._fields})
+        tree.body[0] = ast.copy_location(node, tree.body[0])
+    ast.fix_missing_locations(tree)
+
+    inlined_code = _compile_in_factory(node, code, advising_function.__globals__)
+    closure = advising_function.__closure__ or ()
+    inlined = FunctionType(
+        inlined_code,
+        advising_function.__globals__,
+        code.co_name,
+        advising_function.__defaults__,
+        tuple(closure[code.co_freevars.index(name)] for name in inlined_code.co_freevars) or None,
+    )
+    inlined.__kwdefaults__ = advising_function.__kwdefaults__
+    return inlined
 
 
-def weave(target, aspects, **options):
+def _compile_in_factory(node, code, globals):
     """
-    Send a message to a recipient
+    Compiles the function definition `node` inside a factory function that has the free variables of `code` as locals
+    (so they end up as free variables again) and returns the code object of the function.
+    """
+    factory = ast.FunctionDef(
+        name='_aspectlib_factory',
+        args=ast.arguments(posonlyargs=[], args=[], vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]),
+        body=[
+            ast.Assign([ast.Name(name, ast.Store()) for name in code.co_freevars], ast.Constant(None)),
+            node,
+        ]
+        if code.co_freevars
+        else [node],
+        decorator_list=[],
+        returns=None,
+        type_comment=None,
+    )
+    module = ast.fix_missing_locations(ast.Module([ast.copy_location(factory, node)], []))
+    compiled = compile(module, code.co_filename, 'exec', flags=code.co_flags & _FUTURE_FLAGS, dont_inherit=True)
+    (factory_code,) = (const for const in compiled.co_consts if isinstance(const, CodeType))
+    (function_code,) = (const for const in factory_code.co_consts if isinstance(const, CodeType))
+    return function_code
 
-    Args:
-        target (string, class, instance, function or builtin):
-            The object to weave.
-        aspects (:py:obj:`aspectlib.Aspect`, function decorator or list of):
-            The aspects to apply to the object.
-        subclasses (bool):
-            If ``True``, subclasses of target are weaved. *Only available for classes*
-        aliases (bool):
-            If ``True``, aliases of target are replaced.
-        lazy (bool):
-            If ``True`` only target's ``__init__`` method is patched, the rest of the methods are patched after
-            ``__init__`` is called. *Only available for classes*.
-        methods (list or regex or string):
-            Methods from target to patch. *Only available for classes*
 
-    Returns:
-        aspectlib.Rollback: An object that can rollback the patches.
+def _count_suspensions(node):
+    """
+    Counts the ``yield``, ``yield from``, ``await`` and ``return`` in the function `node` (not in nested scopes).
+    """
+    count = 0
+    pending = list(ast.iter_child_nodes(node))
+    while pending:
+        child = pending.pop()
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            continue
+        if isinstance(child, (ast.Yield, ast.YieldFrom, ast.Await, ast.Return)):
+            count += 1
+        pending.extend(ast.iter_child_nodes(child))
+    return count
+
+
+class Hooks:
+    """
+    Generator-free alternative to :obj:`Aspect`. Instead of an advising generator you give plain callbacks that are
+    called around the cutpoint. The wrappers made from these don't create any generator, so they are cheaper to call.
 
-    Raises:
-        TypeError: If target is a unacceptable object, or the specified options are not available for that type of
-            object.
+    Args:
+        before (function): Called with the cutpoint's arguments, before the cutpoint is called.
+        after_returning (function): Called with the result and the cutpoint's arguments, after the cutpoint returned.
+        after_raising (function): Called with the exception and the cutpoint's arguments, after the cutpoint raised. The
+            exception is reraised afterwards.
+        around (function): Called with the cutpoint and its arguments, instead of the cutpoint. It must call the cutpoint
+            itself. For generator, coroutine or async generator cutpoints it must be a generator function, a coroutine
+            function or an async generator function (matching the cutpoint).
+        bind (bool): If ``True`` the cutpoint is also passed as the first argument to `before`, `after_returning` and
+            `after_raising`.
+
+    The return values of `before` and `after_returning` are ignored. Only :class:`Exception` subclasses are passed to
+    `after_raising`.
 
-    .. versionchanged:: 0.4.0
+    Usage::
 
-        Replaced `only_methods`, `skip_methods`, `skip_magicmethods` options with `methods`.
-        Renamed `on_init` option to `lazy`.
-        Added `aliases` option.
-        Replaced `skip_subclasses` option with `subclasses`.
+        >>> def show_call(*args, **kwargs):
+        ...     print("Got called with args: %s kwargs: %s" % (args, kwargs))
+        >>> def show_result(result, *args, **kwargs):
+        ...     print(" ... and the result is: %s" % (result,))
+        >>> @Hooks(before=show_call, after_returning=show_result)
+        ... def foo(a, b, c=1):
+        ...     return a + b + c
+        >>> foo(1, 2, c=3)
+        Got called with args: (1, 2) kwargs: {'c': 3}
+         ... and the result is: 6
+        6
+
+    The hooks can also be methods of a subclass::
+
+        >>> class ShowErrors(Hooks):
+        ...     def after_raising(self, exception, *args, **kwargs):
+        ...         print("Raised %r" % (exception,))
+        >>> @ShowErrors()
+        ... def bar():
+        ...     raise RuntimeError('BOOM!')
+        >>> try:
+        ...     bar()
+        ... except RuntimeError:
+        ...     pass
+        Raised RuntimeError('BOOM!')
     """
-    if not callable(aspects):
-        if not hasattr(aspects, '__iter__'):
-            raise ExpectedAdvice(f'{aspects} must be an `Aspect` instance, a callable or an iterable of.')
-        for obj in aspects:
-            if not callable(obj):
-                raise ExpectedAdvice(f'{obj} must be an `Aspect` instance or a callable.')
-    assert target, f"Can't weave falsy value {target!r}."
-    logdebug('weave (target=%s, aspects=%s, **options=%s)', target, aspects, options)
 
-    bag = options.setdefault('bag', ObjectBag())
+    before = after_returning = after_raising = around = None
+    bind = False
+
+    def __init__(self, before=None, after_returning=None, after_raising=None, around=None, bind=None):
+        if before is not None:
+            self.before = before
+        if after_returning is not None:
+            self.after_returning = after_returning
+        if after_raising is not None:
+            self.after_raising = after_raising
+        if around is not None:
+            self.around = around
+        if bind is not None:
+            self.bind = bind
 
-    if isinstance(target, (list, tuple)):
-        return Rollback([weave(item, aspects, **options) for item in target])
-    elif isinstance(target, basestring):
-        parts = target.split('.')
-        for part in parts:
-            _check_name(part)
+    def __call__(self, cutpoint_function):
+        before = self.before
+        after_returning = self.after_returning
+        after_raising = self.after_raising
+        if self.bind:
+            before = before and partial(before, cutpoint_function)
+            after_returning = after_returning and partial(after_returning, cutpoint_function)
+            after_raising = after_raising and partial(after_raising, cutpoint_function)
+        call = cutpoint_function if self.around is None else partial(self.around, cutpoint_function)
+
+        if isasyncgenfunction is not None and isasyncgenfunction(cutpoint_function):
+
+            async def hooks_asyncgenerator_wrapper(*args, **kwargs):
+                if before is not None:
+                    before(*args, **kwargs)
+                gen = call(*args, **kwargs)
+                try:
+                    item = await gen.__anext__()
+                    while True:
+                        try:
+                            value = yield item
+                        except GeneratorExit:
+                            raise
+                        except BaseException as exc:
+                            item = await gen.athrow(exc)
+                        else:
+                            item = await gen.asend(value)
+                except StopAsyncIteration:
+                    pass
+                except Exception as exc:
+                    if after_raising is not None:
+                        after_raising(exc, *args, **kwargs)
+                    raise
+                finally:
+                    await gen.aclose()
+                if after_returning is not None:
+                    after_returning(None, *args, **kwargs)
 
-        if len(parts) == 1:
-            return weave_module(_import_module(part), aspects, **options)
+            return mimic(hooks_asyncgenerator_wrapper, cutpoint_function)
+        elif iscoroutinefunction(cutpoint_function):
 
-        for pos in reversed(range(1, len(parts))):
-            owner, name = '.'.join(parts[:pos]), '.'.join(parts[pos:])
-            try:
-                owner = _import_module(owner)
-            except ImportError:
-                continue
-            else:
-                break
+            async def hooks_coroutine_wrapper(*args, **kwargs):
+                if before is not None:
+                    before(*args, **kwargs)
+                try:
+                    result = await call(*args, **kwargs)
+                except Exception as exc:
+                    if after_raising is not None:
+                        after_raising(exc, *args, **kwargs)
+                    raise
+                if after_returning is not None:
+                    after_returning(result, *args, **kwargs)
+                return result
+
+            return mimic(hooks_coroutine_wrapper, cutpoint_function)
+        elif isgeneratorfunction(cutpoint_function):
+
+            def hooks_generator_wrapper(*args, **kwargs):
+                if before is not None:
+                    before(*args, **kwargs)
+                try:
+                    result = yield from call(*args, **kwargs)
+                except Exception as exc:
+                    if after_raising is not None:
+                        after_raising(exc, *args, **kwargs)
+                    raise
+                if after_returning is not None:
+                    after_returning(result, *args, **kwargs)
+                return result
+
+            return mimic(hooks_generator_wrapper, cutpoint_function)
         else:
-            raise ImportError(f'Could not import {target!r}. Last try was for {owner}')
+
+            def hooks_function_wrapper(*args, **kwargs):
+                if before is not None:
+                    before(*args, **kwargs)
+                try:
+                    result = call(*args, **kwargs)
+                except Exception as exc:
+                    if after_raising is not None:
+                        after_raising(exc, *args, **kwargs)
+                    raise
+                if after_returning is not None:
+                    after_returning(result, *args, **kwargs)
+                return result
+
+            return mimic(hooks_function_wrapper, cutpoint_function)
+
+
+class Switch:
+    """
+    Aspects that can be disabled, enabled again or swapped for other aspects at runtime, without weaving again.
+
+    The functions decorated (or weaved) with a switch get a dispatcher that checks the switch on every call: when it's
+    disabled the original function is called directly, otherwise the function decorated with the current aspects (made
+    on the first call after a change and then reused).
+
+    Args:
+        aspects (:py:obj:`aspectlib.Aspect`, function decorator or list of): The aspects to apply.
+        enabled (bool): The initial state.
+
+    Usage::
+
+        >>> tracing = Switch(Hooks(before=lambda *args: print("Got called with args: %s" % (args,))), enabled=False)
+        >>> @tracing
+        ... def foo(a, b):
+        ...     return a + b
+        >>> foo(1, 2)
+        3
+        >>> tracing.enable()
+        >>> foo(1, 2)
+        Got called with args: (1, 2)
+        3
+    """
+
+    __slots__ = '_aspects', '_state'
+    _active = None
+
+    def __init__(self, aspects, enabled=True):
+        _check_aspects(aspects)
+        self._aspects = (aspects,)
+        self._state = self._aspects if enabled else None
+
+    @property
+    def aspects(self):
+        return self._aspects[0]
+
+    @property
+    def enabled(self):
+        return self._state is not None
+
+    def enable(self):
+        self._state = self._aspects
+
+    def disable(self):
+        self._state = None
+
+    def swap(self, aspects):
+        """
+        Replaces the aspects (the switch stays enabled or disabled). Returns the previous aspects.
+        """
+        _check_aspects(aspects)
+        previous = self._aspects[0]
+        self._aspects = (aspects,)
+        if self._state is not None:
+            self._state = self._aspects
+        return previous
+
+    def __call__(self, cutpoint_function):
+        switch = self
+        active = self._active
+        cache = [(None, None)]
+
+        def select(state):
+            cached_state, wrapper = cache[0]
+            if cached_state is not state:
+                wrapper = _checked_apply(state[0], cutpoint_function)
+                cache[0] = state, wrapper
+            return wrapper
+
+        kind = _cutpoint_kind(cutpoint_function)
+        if kind == 'asyncgenerator':
+
+            async def switch_asyncgenerator_wrapper(*args, **kwargs):
+                state = switch._state
+                if state is None or active is not None and active.get() is None:
+                    gen = cutpoint_function(*args, **kwargs)
+                else:
+                    gen = select(state)(*args, **kwargs)
+                try:
+                    item = await gen.__anext__()
+                    while True:
+                        try:
+                            value = yield item
+                        except GeneratorExit:
+                            raise
+                        except BaseException as exc:
+                            item = await gen.athrow(exc)
+                        else:
+                            item = await gen.asend(value)
+                except StopAsyncIteration:
+                    pass
+                finally:
+                    await gen.aclose()
+
+            return mimic(switch_asyncgenerator_wrapper, cutpoint_function)
+        elif kind == 'coroutine':
+
+            async def switch_coroutine_wrapper(*args, **kwargs):
+                state = switch._state
+                if state is None or active is not None and active.get() is None:
+                    return await cutpoint_function(*args, **kwargs)
+                return await select(state)(*args, **kwargs)
+
+            return mimic(switch_coroutine_wrapper, cutpoint_function)
+        elif kind == 'generator':
+
+            def switch_generator_wrapper(*args, **kwargs):
+                state = switch._state
+                if state is None or active is not None and active.get() is None:
+                    return (yield from cutpoint_function(*args, **kwargs))
+                return (yield from select(state)(*args, **kwargs))
+
+            return mimic(switch_generator_wrapper, cutpoint_function)
+        else:
+
+            def switch_function_wrapper(*args, **kwargs):
+                state = switch._state
+                if state is None or active is not None and active.get() is None:
+                    return cutpoint_function(*args, **kwargs)
+                cached_state, wrapper = cache[0]
+                if cached_state is not state:
+                    wrapper = select(state)
+                return wrapper(*args, **kwargs)
+
+            return mimic(switch_function_wrapper, cutpoint_function)
+
+
+class Scoped(Switch):
+    """
+    A :obj:`Switch` that is only on inside :func:`active` blocks (for the current thread or asyncio task). Everywhere
+    else the original function is called directly.
+
+    Args:
+        aspects (:py:obj:`aspectlib.Aspect`, function decorator or list of): The aspects to apply.
+        enabled (bool): The initial state (a disabled scope doesn't run the aspects inside :func:`active` blocks either).
+
+    Usage::
+
+        >>> tracing = Scoped(Hooks(before=lambda *args: print("Got called with args: %s" % (args,))))
+        >>> @tracing
+        ... def foo(a, b):
+        ...     return a + b
+        >>> foo(1, 2)
+        3
+        >>> with active(tracing):
+        ...     foo(1, 2)
+        Got called with args: (1, 2)
+        3
+    """
+
+    __slots__ = ('_active',)
+
+    def __init__(self, aspects, enabled=True):
+        super().__init__(aspects, enabled)
+        self._active = ContextVar(f'aspectlib.Scoped@{id(self):x}', default=None)
+
+
+@contextmanager
+def active(*scopes):
+    """
+    Turns on the given :obj:`Scoped` aspects for the current thread or asyncio task (and the tasks it creates) until the
+    block ends.
+    """
+    for scope in scopes:
+        if not isinstance(scope, Scoped):
+            raise TypeError(f'{scope!r} must be a `Scoped` instance.')
+    tokens = [scope._active.set(True) for scope in scopes]
+    try:
+        yield
+    finally:
+        for scope, token in zip(reversed(scopes), reversed(tokens)):
+            scope._active.reset(token)
+
+
+class Concern:
+    """
+    A bundle of aspects for the methods of a class: subclass it and define aspects (or other decorators) named like the
+    methods they should be applied on (magic methods excluded). The name to aspect table is made once, when the subclass
+    is created (inherited entries included).
+
+    Weaving a class with a concern (``weave(klass, MyConcern)``) applies every aspect on the method with the same name.
+    The subclasses of the weaved class are weaved too, including the ones defined after weaving (the class gets an
+    ``__init_subclass__`` hook until rollback), so there's no need to weave again.
+
+    Usage::
+
+        >>> class Processor:
+        ...     def process(self, data):
+        ...         return data
+        >>> class Validation(Concern):
+        ...     @Aspect
+        ...     def process(self, data):
+        ...         if not data:
+        ...             raise ValueError("Empty data!")
+        ...         yield
+        >>> with weave(Processor, Validation):
+        ...     class MyProcessor(Processor):
+        ...         def process(self, data):
+        ...             return data.upper()
+        ...     MyProcessor().process('')
+        Traceback (most recent call last):
+          ...
+        ValueError: Empty data!
+    """
+
+    __concern__ = MappingProxyType({})
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        table = {}
+        for base in reversed(cls.__mro__):
+            if issubclass(base, Concern) and base is not Concern:
+                for name, value in vars(base).items():
+                    if NORMAL_METHODS.match(name) and callable(value):
+                        table[name] = value
+        cls.__concern__ = MappingProxyType(table)
+
+
+def _concern_table(aspect):
+    return aspect.__concern__ if isclass(aspect) and issubclass(aspect, Concern) else None
+
+
+def _hook_subclasses(klass, concern, methods, duplicates):
+    """
+    Makes ``klass`` weave the subclasses defined later with ``concern``.
+    """
+    rollback = Rollback()
+    original = klass.__dict__.get('__init_subclass__', ABSENT)
+
+    def __init_subclass__(cls, **kwargs):
+        if original is ABSENT:
+            super(klass, cls).__init_subclass__(**kwargs)
+        else:
+            original.__get__(None, cls)(**kwargs)
+        logdebug('~ weaving new subclass %s (of %s) with %s', cls, klass, concern)
+        rollback.merge(weave_class(cls, concern, methods=methods, subclasses=False, bases=False, duplicates=duplicates))
+
+    _setattr(klass, '__init_subclass__', classmethod(__init_subclass__), _current(klass, '__init_subclass__'))
+    entanglement = Rollback()
+    entanglement.record(klass, '__init_subclass__', original)
+    entanglement.merge(rollback.rollback)
+    return entanglement
+
+
+class AspectChain:
+    """
+    Runs the advisors of several :obj:`Aspect` instances inside a single wrapper. It behaves exactly like decorating
+    the cutpoint with each aspect in turn but the calls don't go through a wrapper for every aspect.
+
+    Args:
+        aspects (list): The :obj:`Aspect` instances, outermost first (in the same order you would stack them as
+            decorators).
+
+    Usage::
+
+        >>> @Aspect
+        ... def add_one(arg):
+        ...     yield Proceed(arg + 1)
+        >>> @Aspect
+        ... def double(arg):
+        ...     yield Proceed(arg * 2)
+        >>> @AspectChain([add_one, double])  # same as @add_one @double
+        ... def func(arg):
+        ...     return arg
+        >>> func(1)
+        4
+
+    The :func:`weave` automatically uses a chain when it is given a list of aspects.
+
+    .. note::
+
+        With ``bind=True`` the advising function gets the part of the chain that follows it (just like it would get the
+        inner wrapper when the aspects are stacked).
+    """
+
+    __slots__ = ('aspects',)
+
+    def __init__(self, aspects):
+        self.aspects = tuple(aspects)
+        for aspect in self.aspects:
+            if not isinstance(aspect, Aspect):
+                raise ExpectedAdvice(f'{aspect} must be an `Aspect` instance.')
+
+    def __call__(self, cutpoint_function):
+        if (isasyncgenfunction is not None and isasyncgenfunction(cutpoint_function)) or any(
+            _isasyncadvisingfunction(aspect.advising_function) for aspect in self.aspects
+        ):
+            wrapper = cutpoint_function
+            for aspect in reversed(self.aspects):
+                wrapper = aspect(wrapper)
+            return wrapper
+
+        inners = {}
+
+        def inner(position):
+            wrapper = inners.get(position)
+            if wrapper is None:
+                rest = self.aspects[position + 1 :]
+                if rest:
+                    wrapper = mimic(AspectChain(rest)(cutpoint_function), cutpoint_function)
+                else:
+                    wrapper = cutpoint_function
+                inners[position] = wrapper
+            return wrapper
+
+        factories = []
+        for position, aspect in enumerate(self.aspects):
+            advising_function = _logged_advising_function(aspect.advising_function) if DEBUG else aspect.advising_function
+            if aspect.bind:
+                advising_function = partial(advising_function, inner(position))
+            factories.append((advising_function, aspect.advising_function))
+        factories = tuple(factories)
+
+        if isasyncfunction is not None and isasyncfunction(cutpoint_function):
+
+            async def advising_chain_coroutine_wrapper(*args, **kwargs):
+                advisors = []
+                try:
+                    for advising_function, original in factories:
+                        try:
+                            advisor = advising_function(*args, **kwargs)
+                            if not isgenerator(advisor):
+                                raise ExpectedGenerator(f'advising_function {original} did not return a generator.')
+                        except BaseException as exc:
+                            chain = _AspectChainCoroutineCall(factories, inner, advisors, args, kwargs)
+                            state = chain.throw(exc)
+                            break
+                        advisors.append(advisor)
+                        try:
+                            advice = next(advisor)
+                        except BaseException as exc:
+                            chain = _AspectChainCoroutineCall(factories, inner, advisors, args, kwargs)
+                            state = chain.fail(exc)
+                            break
+                        if advice is not None and advice is not Proceed:
+                            chain = _AspectChainCoroutineCall(factories, inner, advisors, args, kwargs)
+                            state = chain.advise(advice)
+                            break
+                    else:
+                        try:
+                            gen = cutpoint_function(*args, **kwargs)
+                        except BaseException as exc:
+                            chain = _AspectChainCoroutineCall(factories, inner, advisors, args, kwargs)
+                            state = chain.fail(exc)
+                        else:
+                            try:
+                                result = await gen
+                            except BaseException as exc:
+                                chain = _AspectChainCoroutineCall(factories, inner, advisors, args, kwargs)
+                                state = chain.throw(exc)
+                            else:
+                                while advisors:
+                                    try:
+                                        advice = advisors[-1].send(result)
+                                    except StopIteration:
+                                        advisors.pop()
+                                        continue
+                                    except BaseException as exc:
+                                        chain = _AspectChainCoroutineCall(factories, inner, advisors, args, kwargs, result)
+                                        state = chain.fail(exc)
+                                    else:
+                                        chain = _AspectChainCoroutineCall(factories, inner, advisors, args, kwargs, result)
+                                        state = chain.advise(advice)
+                                    break
+                                else:
+                                    return result
+                            finally:
+                                gen.close()
+                    while state is _PROCEED:
+                        args, kwargs = chain.arguments[-1]
+                        try:
+                            if chain.runner is None:
+                                gen = cutpoint_function(*args, **kwargs)
+                            else:
+                                gen = chain.run(args, kwargs)
+                        except BaseException as exc:
+                            state = chain.fail(exc)
+                            continue
+                        try:
+                            result = await gen
+                        except BaseException as exc:
+                            state = chain.throw(exc)
+                        else:
+                            state = chain.send(result)
+                        finally:
+                            gen.close()
+                    return chain.result
+                finally:
+                    while advisors:
+                        advisors.pop().close()
+
+            return mimic(advising_chain_coroutine_wrapper, cutpoint_function)
+        elif isgeneratorfunction(cutpoint_function):
+
+            def advising_chain_generator_wrapper(*args, **kwargs):
+                advisors = []
+                try:
+                    for advising_function, original in factories:
+                        try:
+                            advisor = advising_function(*args, **kwargs)
+                            if not isgenerator(advisor):
+                                raise ExpectedGenerator(f'advising_function {original} did not return a generator.')
+                        except BaseException as exc:
+                            chain = _AspectChainGeneratorCall(factories, inner, advisors, args, kwargs)
+                            state = chain.throw(exc)
+                            break
+                        advisors.append(advisor)
+                        try:
+                            advice = next(advisor)
+                        except BaseException as exc:
+                            chain = _AspectChainGeneratorCall(factories, inner, advisors, args, kwargs)
+                            state = chain.fail(exc)
+                            break
+                        if advice is not None and advice is not Proceed:
+                            chain = _AspectChainGeneratorCall(factories, inner, advisors, args, kwargs)
+                            state = chain.advise(advice)
+                            break
+                    else:
+                        try:
+                            gen = cutpoint_function(*args, **kwargs)
+                        except BaseException as exc:
+                            chain = _AspectChainGeneratorCall(factories, inner, advisors, args, kwargs)
+                            state = chain.fail(exc)
+                        else:
+                            try:
+                                result = yield from gen
+                            except BaseException as exc:
+                                chain = _AspectChainGeneratorCall(factories, inner, advisors, args, kwargs)
+                                state = chain.throw(exc)
+                            else:
+                                while advisors:
+                                    try:
+                                        advice = advisors[-1].send(result)
+                                    except StopIteration:
+                                        advisors.pop()
+                                        continue
+                                    except BaseException as exc:
+                                        chain = _AspectChainGeneratorCall(factories, inner, advisors, args, kwargs, result)
+                                        state = chain.fail(exc)
+                                    else:
+                                        chain = _AspectChainGeneratorCall(factories, inner, advisors, args, kwargs, result)
+                                        state = chain.advise(advice)
+                                    break
+                                else:
+                                    return result
+                            finally:
+                                gen.close()
+                    while state is _PROCEED:
+                        args, kwargs = chain.arguments[-1]
+                        try:
+                            gen = cutpoint_function(*args, **kwargs)
+                        except BaseException as exc:
+                            state = chain.fail(exc)
+                            continue
+                        try:
+                            result = yield from chain.observed(gen)
+                        except BaseException as exc:
+                            state = chain.throw(exc)
+                        else:
+                            state = chain.send(result)
+                        finally:
+                            gen.close()
+                    return chain.result
+                finally:
+                    while advisors:
+                        advisors.pop().close()
+
+            return mimic(advising_chain_generator_wrapper, cutpoint_function)
+        else:
+
+            def advising_chain_function_wrapper(*args, **kwargs):
+                advisors = []
+                try:
+                    for advising_function, original in factories:
+                        try:
+                            advisor = advising_function(*args, **kwargs)
+                            if not isgenerator(advisor):
+                                raise ExpectedGenerator(f'advising_function {original} did not return a generator.')
+                        except BaseException as exc:
+                            chain = _AspectChainCall(factories, inner, advisors, args, kwargs)
+                            state = chain.throw(exc)
+                            break
+                        advisors.append(advisor)
+                        try:
+                            advice = next(advisor)
+                        except BaseException as exc:
+                            chain = _AspectChainCall(factories, inner, advisors, args, kwargs)
+                            state = chain.fail(exc)
+                            break
+                        if advice is not None and advice is not Proceed:
+                            chain = _AspectChainCall(factories, inner, advisors, args, kwargs)
+                            state = chain.advise(advice)
+                            break
+                    else:
+                        try:
+                            result = cutpoint_function(*args, **kwargs)
+                        except Exception as exc:
+                            chain = _AspectChainCall(factories, inner, advisors, args, kwargs)
+                            state = chain.throw(exc)
+                        else:
+                            while advisors:
+                                try:
+                                    advice = advisors[-1].send(result)
+                                except StopIteration:
+                                    advisors.pop()
+                                    continue
+                                except BaseException as exc:
+                                    chain = _AspectChainCall(factories, inner, advisors, args, kwargs, result)
+                                    state = chain.fail(exc)
+                                else:
+                                    chain = _AspectChainCall(factories, inner, advisors, args, kwargs, result)
+                                    state = chain.advise(advice)
+                                break
+                            else:
+                                return result
+                    while state is _PROCEED:
+                        args, kwargs = chain.arguments[-1]
+                        try:
+                            if chain.runner is None:
+                                result = cutpoint_function(*args, **kwargs)
+                            else:
+                                result = chain.run(args, kwargs)
+                        except Exception as exc:
+                            state = chain.throw(exc)
+                        else:
+                            state = chain.send(result)
+                    return chain.result
+                finally:
+                    while advisors:
+                        advisors.pop().close()
+
+            return mimic(advising_chain_function_wrapper, cutpoint_function)
+
+
+_PROCEED = Sentinel('PROCEED', 'The innermost advisor wants the cutpoint called.')
+_DONE = Sentinel('DONE', 'The outermost advisor finished.')
+_ENTER = Sentinel('ENTER')
+_ADVICE = Sentinel('ADVICE')
+_SEND = Sentinel('SEND')
+_THROW = Sentinel('THROW')
+
+
+class _AspectChainCall:
+    """
+    State of a single call through an :obj:`AspectChain`, created by the wrapper as soon as the call stops being a
+    plain sequence of bare ``yield`` advices. Keeps a stack with an advisor for every aspect that was entered and moves
+    between them like the nested wrappers would.
+    """
+
+    __slots__ = 'advisors', 'arguments', 'factories', 'inner', 'observers', 'result', 'results', 'runner', 'target'
+
+    catch = Exception
+    observable = False
+    executable = True
+
+    def __init__(self, factories, inner, advisors, args, kwargs, result=None):
+        self.factories = factories
+        self.inner = inner
+        self.runner = self.target = None
+        self.advisors = advisors
+        self.arguments = [(args, kwargs)] * len(advisors)
+        self.results = [None] * len(advisors)
+        self.observers = [None] * len(advisors)
+        if advisors:
+            self.results[-1] = result
+        self.result = None
+
+    def advise(self, advice):
+        return self._run(_ADVICE, advice)
+
+    def send(self, result):
+        return self._run(_SEND, result)
+
+    def throw(self, exception):
+        return self._run(*self._deliver(exception))
+
+    def fail(self, exception):
+        self._pop()
+        return self._run(*self._deliver(exception))
+
+    def run(self, args, kwargs):
+        runner, self.runner = self.runner, None
+        return runner._call(self.target, *args, **kwargs)
+
+    def observed(self, gen):
+        for observer in reversed(self.observers):
+            if observer is not None:
+                stride, observe, _ = observer
+                gen = _observed(gen, stride, observe, None)
+        return gen
+
+    def _unobserve(self):
+        _, _, flush = self.observers[-1]
+        self.observers[-1] = None
+        if flush is not None:
+            flush()
+
+    def _pop(self):
+        if self.observers[-1] is not None:
+            self._unobserve()
+        self.observers.pop()
+        self.arguments.pop()
+        self.results.pop()
+        self.advisors.pop().close()
+
+    def _deliver(self, exception):
+        while self.advisors:
+            if isinstance(exception, self.catch):
+                return _THROW, exception
+            self._pop()
+        raise exception
+
+    def _run(self, operation, value):
+        advisors = self.advisors
+        while True:
+            if operation is _ADVICE:
+                advice = value
+            else:
+                if operation is _ENTER:
+                    advising_function, original = self.factories[len(advisors)]
+                    args, kwargs = value
+                    try:
+                        advisor = advising_function(*args, **kwargs)
+                        if not isgenerator(advisor):
+                            raise ExpectedGenerator(f'advising_function {original} did not return a generator.')
+                    except BaseException as exc:
+                        operation, value = self._deliver(exc)
+                        continue
+                    advisors.append(advisor)
+                    self.arguments.append(value)
+                    self.results.append(None)
+                    self.observers.append(None)
+                elif self.observers[-1] is not None:
+                    self._unobserve()
+                try:
+                    if operation is _ENTER:
+                        advice = next(advisors[-1])
+                    elif operation is _SEND:
+                        self.results[-1] = value
+                        advice = advisors[-1].send(value)
+                    else:
+                        advice = advisors[-1].throw(value)
+                except StopIteration as exc:
+                    if operation is not _SEND:
+                        self._pop()
+                        operation, value = self._deliver(exc)
+                        continue
+                    value = self.results[-1]
+                    self._pop()
+                    if not advisors:
+                        self.result = value
+                        return _DONE
+                    operation = _SEND
+                    continue
+                except BaseException as exc:
+                    self._pop()
+                    operation, value = self._deliver(exc)
+                    continue
+
+            if self.observable and isinstance(advice, Items):
+                self.observers[-1] = advice._observer()
+                advice = advice.proceed
+            elif self.executable and isinstance(advice, (ProceedIn, ProceedAll)):
+                self.runner = advice
+                self.target = self.inner(len(advisors) - 1)
+                advice = advice.proceed
+            if advice is Proceed or advice is None or isinstance(advice, Proceed):
+                if isinstance(advice, Proceed):
+                    self.arguments[-1] = advice.args, advice.kwargs
+                if self.runner is not None or len(advisors) == len(self.factories):
+                    return _PROCEED
+                operation, value = _ENTER, self.arguments[-1]
+            elif advice is Return or isinstance(advice, Return):
+                value = None if advice is Return else advice.value
+                self._pop()
+                if not advisors:
+                    self.result = value
+                    return _DONE
+                operation = _SEND
+            else:
+                self._pop()
+                operation, value = self._deliver(UnacceptableAdvice(f'Unknown advice {advice}'))
+
+
+class _AspectChainGeneratorCall(_AspectChainCall):
+    __slots__ = ()
+
+    catch = BaseException
+    observable = True
+    executable = False
+
+
+class _AspectChainCoroutineCall(_AspectChainCall):
+    __slots__ = ()
+
+    catch = BaseException
+
+    def run(self, args, kwargs):
+        runner, self.runner = self.runner, None
+        return runner._call_async(self.target, *args, **kwargs)
+
+
+_KINDS = frozenset(('function', 'generator', 'coroutine', 'asyncgenerator'))
+
+
+class Pointcut:
+    """
+    A compiled selector for the methods (or functions) to weave, to be used as the ``methods`` option of :func:`weave`.
+    All the given conditions must match.
+
+    Args:
+        names (list, regex or string): The names (a list or set of names, a regex or a regex string). By default
+            everything but magic methods.
+        markers (str or list of): Attributes that the function must have (any of them, with a true value), like the ones
+            set by your decorators.
+        module (str): The module where the function was defined (submodules included).
+        kind (str or list of): ``'function'``, ``'generator'``, ``'coroutine'`` or ``'asyncgenerator'``.
+        inherited (bool): If ``True`` only the methods inherited from a base class are matched, if ``False`` only the
+            methods defined in the class itself.
+
+    Pointcuts can be combined with ``&``, ``|`` and ``~``. The results are cached for every class and attribute. An
+    inverted pointcut doesn't select magic methods (use ``|`` to add them back).
+
+    Usage::
+
+        >>> class Handler:
+        ...     async def get(self):
+        ...         pass
+        ...     async def post(self):
+        ...         pass
+        ...     def helper(self):
+        ...         pass
+        >>> pointcut = Pointcut(kind='coroutine') & ~Pointcut(names=['post'])
+        >>> with weave(Handler, Hooks(), methods=pointcut):
+        ...     len(layers(Handler.get)), len(layers(Handler.post)), len(layers(Handler.helper))
+        (1, 0, 0)
+    """
+
+    __slots__ = 'match_name', '_match', '_cache', '_inverse', '_description'
+
+    def __init__(self, names=None, markers=(), module=None, kind=None, inherited=None):
+        match_name = NORMAL_METHODS.match if names is None else make_method_matcher(names)
+        conditions = {'names': sorted(names) if isinstance(names, (set, frozenset)) else names, 'markers': markers}
+        conditions.update(module=module, kind=kind, inherited=inherited)
+        description = ', '.join(f'{name}={value!r}' for name, value in conditions.items() if value not in (None, ()))
+        checks = []
+        if markers:
+            markers = (markers,) if isinstance(markers, basestring) else tuple(markers)
+            checks.append(lambda function, _: any(getattr(function, marker, None) for marker in markers))
+        if module is not None:
+            prefix = f'{module}.'
+
+            def module_matches(function, _):
+                defined_in = getattr(function, '__module__', None) or ''
+                return defined_in == module or defined_in.startswith(prefix)
+
+            checks.append(module_matches)
+        if kind is not None:
+            kinds = frozenset((kind,) if isinstance(kind, basestring) else kind)
+            if not kinds <= _KINDS:
+                raise TypeError(f'Unacceptable kind={kind!r}. Must be one or more of: {", ".join(sorted(_KINDS))}.')
+            checks.append(lambda function, _: _cutpoint_kind(function) in kinds)
+        if inherited is not None:
+            inherited = bool(inherited)
+            checks.append(lambda _, is_inherited: is_inherited is inherited)
+
+        def match(name, function, is_inherited):
+            if not match_name(name):
+                return False
+            for check in checks:
+                if not check(function, is_inherited):
+                    return False
+            return True
+
+        self._setup(match_name, match, f'Pointcut({description})')
+
+    def _setup(self, match_name, match, description):
+        self.match_name = match_name
+        self._match = match
+        self._cache = WeakKeyDictionary()
+        self._inverse = None
+        self._description = description
+
+    @classmethod
+    def _combine(cls, match_name, match, description):
+        pointcut = cls.__new__(cls)
+        pointcut._setup(match_name, match, description)
+        return pointcut
+
+    def __repr__(self):
+        return self._description
+
+    def __and__(self, other):
+        if not isinstance(other, Pointcut):
+            return NotImplemented
+        left_name, right_name, left, right = self.match_name, other.match_name, self._match, other._match
+        return self._combine(
+            lambda name: left_name(name) and right_name(name), lambda *args: left(*args) and right(*args), f'({self!r} & {other!r})'
+        )
+
+    def __or__(self, other):
+        if not isinstance(other, Pointcut):
+            return NotImplemented
+        left_name, right_name, left, right = self.match_name, other.match_name, self._match, other._match
+        return self._combine(
+            lambda name: left_name(name) or right_name(name), lambda *args: left(*args) or right(*args), f'({self!r} | {other!r})'
+        )
+
+    def __invert__(self):
+        if self._inverse is None:
+            match = self._match
+            self._inverse = self._combine(
+                NORMAL_METHODS.match,
+                lambda name, *args: NORMAL_METHODS.match(name) is not None and not match(name, *args),
+                f'~{self!r}',
+            )
+            self._inverse._inverse = self
+        return self._inverse
+
+    def matches(self, owner, name, function, inherited=False):
+        """
+        Returns ``True`` if ``function`` (the ``name`` attribute of ``owner``) is selected.
+        """
+        try:
+            entries = self._cache.setdefault(owner, {})
+        except TypeError:
+            entries = {}
+        key = name, inherited
+        entry = entries.get(key)
+        if entry is None or entry[0] is not function:
+            target = function.__func__ if isinstance(function, (classmethod, staticmethod)) else function
+            target = getattr(target, '__woven__', (target,))[0]
+            entry = entries[key] = function, self._match(name, target, inherited)
+        return entry[1]
+
+
+def _method_matcher(methods):
+    """
+    Returns a ``(name matcher, pointcut or None)`` pair for the ``methods`` option.
+    """
+    if isinstance(methods, Pointcut):
+        return methods.match_name, methods
+    return make_method_matcher(methods), None
+
+
+class Fabric:
+    __slots__ = ()
+
+
+class Rollback:
+    """
+    When called, rollbacks all the patches and changes the :func:`weave` has done.
+
+    The changes are kept in a journal of ``(owner, name, original)`` records (and plain callables for anything else)
+    that is undone in reverse order.
+    """
+
+    __slots__ = '_journal', '_threadsafe'
+
+    def __init__(self, rollback=None):
+        self._journal = []
+        self._threadsafe = False
+        if rollback is None:
+            pass
+        elif isinstance(rollback, (list, tuple)):
+            self.merge(*rollback)
+        else:
+            self.merge(rollback)
+
+    def record(self, owner, name, original=ABSENT):
+        """
+        Records that ``owner.name`` was patched: the rollback sets it back to ``original`` (or deletes it if it wasn't
+        there before).
+        """
+        self._journal.append((owner, name, original))
+
+    def merge(self, *others):
+        journal = self._journal
+        for other in others:
+            if isinstance(other, Rollback):
+                journal.extend(other._journal)
+                other._journal = []
+                self._threadsafe |= other._threadsafe
+            elif not isinstance(other, EmptyRollback):
+                journal.append(other)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        journal = self._journal
+        self._journal = []
+        if getattr(_staging, 'patches', None) is not None:
+            # the patches were only staged (a threadsafe weave is being prepared), nothing to undo for them
+            journal = [entry for entry in journal if type(entry) is not tuple]
+        if self._threadsafe:
+            _undo_locked(journal)
+        else:
+            _undo(journal)
+
+    rollback = __call__ = __exit__
+
+
+def _undo(journal):
+    for entry in reversed(journal):
+        if type(entry) is tuple:
+            _restore(*entry)
+        else:
+            entry()
+
+
+def _undo_locked(journal):
+    """
+    Like :func:`_undo` but the records are restored while holding the weaving lock. The callables run outside of it
+    (they can be anything, eg: cancelling import hooks or user callbacks merged in the rollback).
+    """
+    for is_record, entries in groupby(reversed(journal), key=lambda entry: type(entry) is tuple):
+        if is_record:
+            with _weaving_lock:
+                for entry in entries:
+                    _restore(*entry)
+        else:
+            for entry in entries:
+                entry()
+
+
+def _restore(owner, name, original):
+    if original is ABSENT:
+        delattr(owner, name)
+    else:
+        setattr(owner, name, original)
+
+
+_weaving_lock = RLock()
+_staging = local()
+_THREADSAFE_ATTEMPTS = 3
+
+
+def _current(owner, name):
+    if name == '__class__':
+        return type(owner)
+    try:
+        namespace = vars(owner)
+    except TypeError:
+        return getattr(owner, name, ABSENT)
+    else:
+        return namespace.get(name, ABSENT)
+
+
+def _setattr(owner, name, value, expected=UNSPECIFIED):
+    """
+    Patches an attribute, or only stages the change if a threadsafe weave is being prepared in this thread. The
+    ``expected`` value (what :func:`_current` returned when the replacement was made) is checked before publishing.
+    """
+    patches = getattr(_staging, 'patches', None)
+    if patches is None:
+        setattr(owner, name, value)
+    else:
+        key = id(owner), name
+        if key in patches:
+            raise WeaveConflict(f"Can't patch {owner}.{name} twice in the same threadsafe weave (overlapping targets).")
+        patches[key] = owner, name, _current(owner, name) if expected is UNSPECIFIED else expected, value
+
+
+def _publish(patches):
+    """
+    Applies the staged patches if none of the attributes were changed since they were staged. Must run while holding
+    the weaving lock.
+    """
+    for owner, name, expected, _ in patches.values():
+        if _current(owner, name) is not expected:
+            logdebug('  --- %s.%s was changed (it is not %r anymore).', owner, name, expected)
+            return False
+    done = []
+    try:
+        for owner, name, expected, value in patches.values():
+            setattr(owner, name, value)
+            done.append((owner, name, expected))
+    except BaseException:
+        _undo(done)
+        raise
+    return True
+
+
+@contextmanager
+def _atomic(rollback):
+    """
+    Undoes the changes already recorded in ``rollback`` if the block raises.
+    """
+    try:
+        yield rollback
+    except BaseException:
+        rollback.rollback()
+        raise
+
+
+class ObjectBag:
+    def __init__(self):
+        self._objects = IdentityMap()
+
+    def has(self, obj):
+        if id(obj) in self._objects:
+            logdebug('  --- ObjectBag ALREADY HAS %r', obj)
+            return True
+        else:
+            self._objects.add(obj, True)
+            return False
+
+
+BrokenBag = type('BrokenBag', (), {'has': lambda self, obj: False})()
+
+
+class _AliasIndex:
+    """
+    Maps the attribute values of the patched objects (by identity) to their names. Each owner is scanned (``dir`` and
+    ``getattr``) only once and :func:`patch_module` keeps the index updated, so weaving many attributes of the same
+    object doesn't scan it again for every patched attribute.
+    """
+
+    __slots__ = ('_owners',)
+
+    def __init__(self):
+        self._owners = {}
+
+    def _scan(self, owner):
+        key = id(owner)
+        if key not in self._owners:
+            values = {}
+            names = {}
+            for alias in dir(owner):
+                if hasattr(owner, alias):
+                    obj = values[alias] = getattr(owner, alias)
+                    names.setdefault(id(obj), []).append(alias)
+            self._owners[key] = owner, values, names
+        return self._owners[key]
+
+    def aliases(self, owner, obj):
+        return list(self._scan(owner)[2].get(id(obj), ()))
+
+    def get(self, owner, name, default=None):
+        return self._scan(owner)[1].get(name, default)
+
+    def update(self, owner, name, obj):
+        _, values, names = self._scan(owner)
+        if name in values:
+            names[id(values[name])].remove(name)
+        values[name] = obj
+        names.setdefault(id(obj), []).append(name)
+
+    def forget(self, owner):
+        self._owners.pop(id(owner), None)
+
+
+class EmptyRollback:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+    rollback = __call__ = __exit__
+
+
+Nothing = EmptyRollback()
+
+
+class _ImportHookLoader:
+    """
+    Wraps the loader of a module that some hook waits for: the hooks are run after the module is executed.
+    """
+
+    __slots__ = 'loader', 'finder'
+
+    def __init__(self, loader, finder):
+        self.loader = loader
+        self.finder = finder
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        create_module = getattr(self.loader, 'create_module', None)
+        return None if create_module is None else create_module(spec)
+
+    def exec_module(self, module):
+        spec = getattr(module, '__spec__', None)
+        if spec is not None and spec.loader is self:
+            spec.loader = self.loader
+        if getattr(module, '__loader__', None) is self:
+            module.__loader__ = self.loader
+        self.loader.exec_module(module)
+        self.finder.run(sys.modules.get(module.__name__, module))
+
+
+class _ImportHooks:
+    """
+    A :data:`sys.meta_path` finder that runs hooks after the matching modules are imported. Only installed while there
+    are hooks and only the loaders of the matching modules are wrapped.
+
+    A hook is a callable (that gets the imported module) with a ``matches(fullname)`` method.
+    """
+
+    def __init__(self):
+        self.hooks = []
+        self.lock = Lock()
+
+    def add(self, hook):
+        with self.lock:
+            self.hooks.append(hook)
+            if self not in sys.meta_path:
+                sys.meta_path.insert(0, self)
+
+    def remove(self, hook):
+        with self.lock:
+            if hook in self.hooks:
+                self.hooks.remove(hook)
+            if not self.hooks and self in sys.meta_path:
+                sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if not any(hook.matches(fullname) for hook in list(self.hooks)):
+            return None
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, 'find_spec', None)
+            if finder is self or find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if hasattr(spec.loader, 'exec_module'):
+            logdebug('@ hooking import of %s (loader: %r).', fullname, spec.loader)
+            spec.loader = _ImportHookLoader(spec.loader, self)
+        return spec
+
+    def run(self, module):
+        patches = getattr(_staging, 'patches', None)
+        _staging.patches = None  # the hooks apply their patches right away, even if this import is part of a threadsafe weave
+        try:
+            for hook in list(self.hooks):
+                if hook.matches(module.__name__):
+                    hook(module)
+        finally:
+            _staging.patches = patches
+
+
+_import_hooks = _ImportHooks()
+
+
+class _DeferredWeave:
+    """
+    A weave for a dotted name that is applied (once) when its module gets imported.
+    """
+
+    __slots__ = 'target', 'aspects', 'options', 'rollback'
+
+    def __init__(self, target, aspects, options):
+        self.target = target
+        self.aspects = aspects
+        self.options = options
+        self.rollback = Rollback()
+
+    def matches(self, fullname):
+        return self.target == fullname or self.target.startswith(fullname + '.')
+
+    def __call__(self, module=None):
+        resolved = _resolve_imported(self.target)
+        if resolved is None:
+            logdebug('  --- %s is not available yet.', self.target)
+            return
+        _import_hooks.remove(self)
+        owner, name, obj = resolved
+        options = dict(self.options, bag=ObjectBag(), index=_AliasIndex())
+        logdebug('@ applying deferred weave of %s ...', self.target)
+        if owner is None:
+            self.rollback.merge(weave_module(obj, self.aspects, **options))
+        else:
+            self.rollback.merge(_weave_attribute(owner, name, obj, self.aspects, **options))
+
+    def cancel(self):
+        _import_hooks.remove(self)
+        self.rollback()
+
+
+class _PatternWeave:
+    """
+    A weave for the modules matching a pattern like ``'pkg.*.mod:*Handler.handle_*'`` (and for the attributes matching
+    the part after the colon). All the modules share a bag so objects reachable from several modules (eg: re-exported
+    classes) are weaved only once.
+    """
+
+    __slots__ = 'matches', 'path', 'aspects', 'options', 'bag', 'rollback'
+
+    def __init__(self, pattern, aspects, options):
+        module_pattern, _, path = pattern.partition(':')
+        for part in module_pattern.split('.') + (path.split('.') if path else []):
+            if not VALID_PATTERN.match(part):
+                raise SyntaxError(
+                    f'Could not match {part!r} (from {pattern!r}) to {VALID_PATTERN.pattern!r}. It should be a string of '
+                    'letters, numbers, underscore and wildcards.'
+                )
+        if path and 'methods' in options:
+            raise TypeError(f"Can't use methods={options['methods']!r} with a pattern that selects attributes ({pattern!r}).")
+        self.matches = re.compile(_glob_regex(module_pattern)).match
+        self.path = (
+            [re.compile(_glob_regex(part) if part.startswith('__') else f'(?!__.*__$){_glob_regex(part)}') for part in path.split('.')]
+            if path
+            else []
+        )
+        self.aspects = aspects
+        self.options = options
+        self.bag = ObjectBag()
+        self.rollback = Rollback()
+
+    def __call__(self, module):
+        logdebug('@ applying pattern weave on %s ...', module)
+        with _atomic(Rollback()) as entanglement:
+            self._apply(module, entanglement)
+        self.rollback.merge(entanglement)
+
+    def _apply(self, module, entanglement):
+        options = dict(self.options, bag=self.bag, index=_AliasIndex())
+        if not self.path:
+            entanglement.merge(weave_module(module, self.aspects, **options))
+            return
+        owners = [(None, None, module)]
+        for regex in self.path[:-1]:
+            owners = [
+                (owner, name, getattr(owner, name))
+                for _, _, owner in owners
+                for name in dir(owner)
+                if regex.match(name) and isclass(getattr(owner, name, None))
+            ]
+        regex = self.path[-1]
+        for parent, name, owner in owners:
+            if isclass(owner):
+                options.setdefault('subclasses', False)
+                options.setdefault('bases', False)
+                entanglement.merge(weave_class(owner, self.aspects, methods=regex, owner=parent, name=name, **options))
+            else:
+                for name in dir(owner):
+                    if regex.match(name):
+                        obj = getattr(owner, name)
+                        if isroutine(obj) or isclass(obj):
+                            entanglement.merge(_weave_attribute(owner, name, obj, self.aspects, **options))
+
+    def cancel(self):
+        _import_hooks.remove(self)
+        self.rollback()
+
+
+def _glob_regex(pattern):
+    """
+    Translates a glob to a regex: ``*`` and ``?`` don't match dots, ``**`` matches anything.
+    """
+    regex = []
+    for part in re.split(r'(\*\*|\*|\?)', pattern):
+        if part == '**':
+            regex.append('.*')
+        elif part == '*':
+            regex.append(r'[^.]*')
+        elif part == '?':
+            regex.append(r'[^.]')
+        else:
+            regex.append(re.escape(part))
+    return ''.join(regex) + '$'
+
+
+def _resolve_imported(target):
+    """
+    Resolves a dotted name using only what's already in :data:`sys.modules`. Returns ``None`` if that's not possible
+    yet, otherwise a ``(owner, name, obj)`` tuple (the owner and name are ``None`` for modules).
+    """
+    parts = target.split('.')
+    for pos in reversed(range(1, len(parts) + 1)):
+        owner = sys.modules.get('.'.join(parts[:pos]))
+        if owner is not None:
+            break
+    else:
+        return None
+    if pos == len(parts):
+        return None, None, owner
+    try:
+        for part in parts[pos:-1]:
+            owner = getattr(owner, part)
+        return owner, parts[-1], getattr(owner, parts[-1])
+    except AttributeError:
+        return None
+
+
+def _checked_apply(aspects, function, module=None, duplicates='stack'):
+    logdebug('  applying aspects %s to function %s.', aspects, function)
+    if _concern_table(aspects) is not None:
+        raise TypeError(f"Can't apply {aspects!r} on {function!r}. Concerns can only be weaved on classes.")
+    applied = (aspects,) if callable(aspects) else tuple(aspects)
+    original, woven = getattr(function, '__woven__', (function, ()))
+    if duplicates == 'skip':
+        applied = tuple(aspect for aspect in applied if aspect not in woven)
+        if not applied:
+            logdebug('  --- %s already has the aspects %s.', function, aspects)
+            return function
+    elif duplicates == 'replace':
+        applied = tuple(aspect for aspect in woven if aspect not in applied) + applied
+        function, woven = original, ()
+    elif duplicates != 'stack':
+        raise TypeError(f"Unacceptable duplicates={duplicates!r} option. Must be 'stack', 'skip' or 'replace'.")
+
+    wrapper = function
+    for aspect in _fuse_aspects(applied):
+        wrapper = aspect(wrapper)
+        assert callable(wrapper), f'Aspect {aspect} did not return a callable (it return {wrapper}).'
+    wrapper = mimic(wrapper, function, module=module)
+    try:
+        wrapper.__woven__ = original, woven + applied
+    except (TypeError, AttributeError):
+        pass
+    return wrapper
+
+
+def layers(function):
+    """
+    Returns the aspects weaved on the given function (innermost first), or an empty tuple if it's not weaved.
+
+    Usage::
+
+        >>> @Aspect
+        ... def passthrough(*args):
+        ...     yield
+        >>> class Foo:
+        ...     def bar(self):
+        ...         pass
+        >>> layers(Foo.bar)
+        ()
+        >>> with weave(Foo, passthrough):
+        ...     with weave(Foo, passthrough, duplicates='skip'):
+        ...         layers(Foo.bar) == (passthrough,)
+        True
+    """
+    function = getattr(function, '__func__', function)
+    return getattr(function, '__woven__', (None, ()))[1]
+
+
+class _Counter:
+    __slots__ = 'wrapper', 'calls', 'exceptions', 'time'
+
+    def __init__(self):
+        self.wrapper = None
+        self.calls = self.exceptions = 0
+        self.time = 0.0
+
+    def as_dict(self):
+        # the original function is only known after the wrapper got through _checked_apply
+        function = getattr(self.wrapper, '__woven__', (self.wrapper,))[0]
+        return {'name': _describe(function), 'calls': self.calls, 'exceptions': self.exceptions, 'time': self.time}
+
+
+class _Counters:
+    """
+    An aspect that counts the calls, exceptions and cumulative time (in seconds) of every function it's applied on. The
+    time of generators is measured until they are exhausted or closed.
+
+    The counts are not synchronized (concurrent calls may get lost), they are only meant to give an idea of the costs.
+    """
+
+    __slots__ = ('counters',)
+
+    def __init__(self):
+        self.counters = []
+
+    def __call__(self, cutpoint_function):
+        counter = _Counter()
+        self.counters.append(counter)
+
+        kind = _cutpoint_kind(cutpoint_function)
+        if kind == 'asyncgenerator':
+
+            async def counted_asyncgenerator_wrapper(*args, **kwargs):
+                start = perf_counter()
+                gen = cutpoint_function(*args, **kwargs)
+                try:
+                    item = await gen.__anext__()
+                    while True:
+                        try:
+                            value = yield item
+                        except GeneratorExit:
+                            raise
+                        except BaseException as exc:
+                            item = await gen.athrow(exc)
+                        else:
+                            item = await gen.asend(value)
+                except StopAsyncIteration:
+                    pass
+                except BaseException:
+                    counter.exceptions += 1
+                    raise
+                finally:
+                    try:
+                        await gen.aclose()
+                    finally:
+                        counter.calls += 1
+                        counter.time += perf_counter() - start
+
+            counter.wrapper = counted_asyncgenerator_wrapper
+            return mimic(counted_asyncgenerator_wrapper, cutpoint_function)
+        elif kind == 'coroutine':
+
+            async def counted_coroutine_wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return await cutpoint_function(*args, **kwargs)
+                except BaseException:
+                    counter.exceptions += 1
+                    raise
+                finally:
+                    counter.calls += 1
+                    counter.time += perf_counter() - start
+
+            counter.wrapper = counted_coroutine_wrapper
+            return mimic(counted_coroutine_wrapper, cutpoint_function)
+        elif kind == 'generator':
+
+            def counted_generator_wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return (yield from cutpoint_function(*args, **kwargs))
+                except GeneratorExit:
+                    raise
+                except BaseException:
+                    counter.exceptions += 1
+                    raise
+                finally:
+                    counter.calls += 1
+                    counter.time += perf_counter() - start
+
+            counter.wrapper = counted_generator_wrapper
+            return mimic(counted_generator_wrapper, cutpoint_function)
+        else:
+
+            def counted_function_wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return cutpoint_function(*args, **kwargs)
+                except BaseException:
+                    counter.exceptions += 1
+                    raise
+                finally:
+                    counter.calls += 1
+                    counter.time += perf_counter() - start
+
+            counter.wrapper = counted_function_wrapper
+            return mimic(counted_function_wrapper, cutpoint_function)
+
+
+_registry = {}
+_registry_lock = Lock()
+_registry_ids = iter(range(1, sys.maxsize))
+
+
+def _describe(obj):
+    """
+    Describes a target or aspect for the registry. Instances are only described by their type (their ``repr`` could
+    run arbitrary code).
+    """
+    if isinstance(obj, basestring):
+        return obj
+    if isinstance(obj, Aspect):
+        return f'Aspect({_describe(obj.advising_function)})'
+    if ismodule(obj):
+        return obj.__name__
+    if not isclass(obj) and not isroutine(obj):
+        klass = type(obj)
+        return f'{klass.__module__}.{klass.__qualname__} instance'
+    name = getattr(obj, '__qualname__', None)
+    if not isinstance(name, str):
+        return _describe(type(obj))
+    module = getattr(obj, '__module__', None)
+    return f'{module}.{name}' if isinstance(module, str) else name
+
+
+def _describe_option(value):
+    try:
+        return repr(value)
+    except Exception:
+        return _describe(value)
+
+
+def _counted(aspects, counters):
+    """
+    Adds the ``counters`` aspect (outermost) to the given aspects. For a :obj:`Concern` it makes a subclass that has
+    ``counters`` added to the aspects of every method.
+    """
+    table = _concern_table(aspects)
+    if table is not None:
+        counted = type(aspects.__name__, (aspects,), {'__module__': aspects.__module__, '__qualname__': aspects.__qualname__})
+        counted.__concern__ = MappingProxyType({name: [aspect, counters] for name, aspect in table.items()})
+        return counted
+    return [aspects, counters] if callable(aspects) else [*aspects, counters]
+
+
+def _register(entanglement, targets, options, duration, counters):
+    entry = {
+        'id': next(_registry_ids),
+        'targets': [
+            {
+                'target': _describe(target),
+                'aspects': [_describe(aspects)] if callable(aspects) else [_describe(aspect) for aspect in aspects],
+            }
+            for target, aspects in targets
+        ],
+        'options': {name: _describe_option(value) for name, value in options.items() if name not in ('bag', 'index')},
+        'patched': sum(type(record) is tuple for record in entanglement._journal),
+        'duration': duration,
+        'timestamp': time(),
+        'counters': counters,
+    }
+    key = entry['id']
+    with _registry_lock:
+        _registry[key] = entry
+    entanglement.merge(partial(_unregister, key))
+
+
+def _unregister(key):
+    with _registry_lock:
+        _registry.pop(key, None)
+
+
+def weaves():
+    """
+    Returns the weaves that are active (not rolled back yet), oldest first, as a list of dicts with:
+
+    * ``id`` - an unique number.
+    * ``targets`` - a list of dicts with the ``target`` and the ``aspects`` (as strings).
+    * ``options`` - the options given to :func:`weave` (values as strings).
+    * ``patched`` - how many attributes got patched (deferred weaves that were not applied yet have ``0``).
+    * ``duration`` - how long the weaving took (in seconds).
+    * ``timestamp`` - when the weave was made (as given by :func:`time.time`).
+    * ``counters`` - ``None``, or if the weave was made with ``counters=True`` a list of dicts with the ``name`` of the
+      weaved function and its number of ``calls``, ``exceptions`` and cumulative ``time`` (in seconds).
+    """
+    with _registry_lock:
+        entries = list(_registry.values())
+    return [
+        dict(entry, counters=None if entry['counters'] is None else [counter.as_dict() for counter in entry['counters'].counters])
+        for entry in entries
+    ]
+
+
+def dump_weaves(file=None, **kwargs):
+    """
+    Dumps :func:`weaves` as JSON to the given file (the extra arguments are passed to :func:`json.dump`). If no file is
+    given the JSON is returned as a string.
+    """
+    if file is None:
+        return json.dumps(weaves(), **kwargs)
+    json.dump(weaves(), file, **kwargs)
+
+
+def _fuse_aspects(aspects):
+    """
+    Replaces consecutive :obj:`Aspect` instances (applied innermost first) with a single :obj:`AspectChain`.
+    """
+    run = []
+    for aspect in aspects:
+        if type(aspect) is Aspect and not aspect.specialize and not _isasyncadvisingfunction(aspect.advising_function):
+            run.append(aspect)
+            continue
+        if run:
+            yield AspectChain(reversed(run)) if len(run) > 1 else run[0]
+            run = []
+        yield aspect
+    if run:
+        yield AspectChain(reversed(run)) if len(run) > 1 else run[0]
+
+
+def _check_name(name):
+    if not VALID_IDENTIFIER.match(name):
+        raise SyntaxError(
+            f'Could not match {name!r} to {VALID_IDENTIFIER.pattern!r}. It should be a string of '
+            'letters, numbers and underscore that starts with a letter or underscore.'
+        )
+
+
+def weave(target, aspects=None, **options):
+    """
+    Send a message to a recipient
+
+    Args:
+        target (string, class, instance, function, builtin or a dict of):
+            The object to weave. Can be a dict mapping targets to their aspects (in which case ``aspects`` must not
+            be given): everything is weaved in one go and the returned rollback undoes all of it.
+
+            String targets can be patterns like ``'pkg.*.handlers:*Handler.handle_*'``: the modules matching the part
+            before the colon are taken from :data:`sys.modules` (nothing is imported) and the attributes matching the
+            dotted part after the colon are weaved (everything if empty). ``*`` and ``?`` don't match dots, ``**``
+            matches anything. Magic names are only matched by parts that start with ``__``.
+        aspects (:py:obj:`aspectlib.Aspect`, function decorator or list of, or a :obj:`Concern`):
+            The aspects to apply to the object.
+        subclasses (bool):
+            If ``True``, subclasses of target are weaved. With a :obj:`Concern` the subclasses defined later are weaved
+            too. *Only available for classes*
+        aliases (bool):
+            If ``True``, aliases of target are replaced.
+        lazy (bool):
+            If ``True`` only target's ``__init__`` method is patched, the rest of the methods are patched (on the
+            class, once) after the first instance's ``__init__`` is called. *Only available for classes*.
+        methods (list or regex or string or :obj:`Pointcut`):
+            Methods from target to patch. *Only available for classes*
+        deferred (bool):
+            If ``True`` the target is not imported: the weave is applied when the target's module gets imported (right
+            away if it already is). For patterns it means that modules imported later are weaved too (until
+            rollback). *Only available for string targets*
+        duplicates (str):
+            What to do with aspects that are already weaved on a function (as reported by :func:`layers`):
+            ``'stack'`` applies them again, ``'skip'`` doesn't apply them and ``'replace'`` makes a new wrapper where
+            they only appear once (in the new position).
+        counters (bool):
+            If ``True`` the calls, exceptions and cumulative time of every weaved function are counted (the wrapper
+            that counts them is the outermost one). See :func:`weaves`.
+        plan (str):
+            Path of a file where the resolved patches are saved (as JSON), to be replayed next time without looking up
+            the targets again (as long as the targets, the options, Python and the source files of the patched modules
+            are the same). Only for string targets (not patterns). If some patch can't be replayed (an instance or a
+            lazy weave for example) the plan is not saved.
+        threadsafe (bool):
+            If ``True`` all the replacements are prepared first (the aspects, wrappers and subclasses are made
+            before anything is patched) and then published in a single loop of plain attribute assignments, while
+            holding a process-wide lock that serializes it with other threadsafe weaves and rollbacks. Other threads
+            keep running, but the window in which they could see a half-weaved target is as short as possible. If
+            something else changed the targets in the meantime the weave is retried (and :exc:`WeaveConflict` is
+            raised if that keeps happening). Rolling back restores the attributes the same way.
+
+    Returns:
+        aspectlib.Rollback: An object that can rollback the patches.
+
+    Raises:
+        TypeError: If target is a unacceptable object, or the specified options are not available for that type of
+            object.
+
+    .. versionchanged:: 0.4.0
+
+        Replaced `only_methods`, `skip_methods`, `skip_magicmethods` options with `methods`.
+        Renamed `on_init` option to `lazy`.
+        Added `aliases` option.
+        Replaced `skip_subclasses` option with `subclasses`.
+
+    .. versionchanged:: 2.1.0
+
+        Allowed a dict of targets and aspects.
+        Added `deferred` option.
+        Allowed patterns as string targets.
+        Added `threadsafe` option.
+        Added `duplicates` option.
+        Added `counters` option. Every weave is recorded (see :func:`weaves`).
+        Allowed :obj:`Concern` aspects.
+        Added `plan` option.
+    """
+    if isinstance(target, Mapping):
+        if aspects is not None:
+            raise TypeError(f"Can't use aspects={aspects!r} when weaving a mapping of targets and aspects.")
+        targets = list(target.items())
+    else:
+        targets = [(target, aspects)]
+    for _, item in targets:
+        _check_aspects(item)
+
+    recorded = dict(options)
+    counters = woven = None
+    if options.pop('counters', False):
+        counters = _Counters()
+        woven = [(item, _counted(item_aspects, counters)) for item, item_aspects in targets]
+
+    plan = options.pop('plan', None)
+    weaver = _weave_targets if plan is None else partial(_weave_planned, plan)
+    start = perf_counter()
+    if options.pop('threadsafe', False):
+        entanglement = _weave_threadsafe(weaver, target, woven or targets, options)
+    else:
+        entanglement = weaver(target, woven or targets, options)
+    if not isinstance(entanglement, Rollback):
+        entanglement = Rollback(entanglement)
+    with _atomic(entanglement):
+        _register(entanglement, targets, recorded, perf_counter() - start, counters)
+    return entanglement
+
+
+def _weave_threadsafe(weaver, target, targets, options):
+    for _ in range(_THREADSAFE_ATTEMPTS):
+        previous = getattr(_staging, 'patches', None)
+        _staging.patches = patches = {}
+        try:
+            entanglement = weaver(target, targets, dict(options))
+            with _weaving_lock:
+                published = _publish(patches)
+            if not published:
+                entanglement.rollback()
+        finally:
+            _staging.patches = previous
+        if published:
+            entanglement._threadsafe = True
+            return entanglement
+    raise WeaveConflict(f"Couldn't weave {target!r}: the patched attributes kept changing (tried {_THREADSAFE_ATTEMPTS} times).")
+
+
+def _weave_targets(target, targets, options):
+    options.setdefault('bag', ObjectBag())
+    options.setdefault('index', _AliasIndex())
+    if isinstance(target, Mapping):
+        with _atomic(Rollback()) as entanglement:
+            for item, item_aspects in targets:
+                entanglement.merge(_weave(item, item_aspects, **options))
+        return entanglement
+    else:
+        ((item, item_aspects),) = targets
+        return _weave(item, item_aspects, **options)
+
+
+_PLAN_VERSION = 1
+
+
+def _plan_description(value):
+    """
+    Describes an aspect or an option for the key of a plan. It must be the same in the next run, so there's nothing that
+    has a memory address in it (eg: the default ``repr`` of functions and instances).
+    """
+    table = _concern_table(value)
+    if table is not None:
+        return [_describe(value), {name: _plan_description(aspect) for name, aspect in sorted(table.items())}]
+    if isinstance(value, (set, frozenset)):
+        value = sorted(value, key=repr)
+    plain = (type(None), basestring, bool, int, float, re.Pattern, Pointcut)
+    if isinstance(value, plain) or isinstance(value, (list, tuple)) and all(isinstance(item, plain) for item in value):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return [_plan_description(item) for item in value]
+    return _describe(value)
+
+
+def _weave_planned(path, target, targets, options):
+    """
+    Weaves the string targets using the plan saved in ``path`` if it's still valid, otherwise weaves them the usual way
+    and saves a new plan (if all the patches can be replayed).
+    """
+    if options.get('deferred'):
+        raise TypeError("Can't use deferred=True with a plan.")
+    for item, _ in targets:
+        if not isinstance(item, basestring):
+            raise TypeError(f"Can't use a plan for {item!r}. Only string targets can be planned.")
+    options.setdefault('bag', ObjectBag())
+    options.setdefault('index', _AliasIndex())
+    key = {
+        'python': sys.version,
+        'aspectlib': __version__,
+        'targets': [item for item, _ in targets],
+        'aspects': [_plan_description(item_aspects) for _, item_aspects in targets],
+        'options': {name: _plan_description(value) for name, value in sorted(options.items()) if name not in ('bag', 'index')},
+    }
+    plan = _load_plan(path, key)
+    if plan is not None:
+        try:
+            return _replay_plan(plan, targets, options)
+        except (ImportError, AttributeError, KeyError) as exc:
+            logdebug('  --- plan %s is stale (%r), weaving again.', path, exc)
+
+    entanglement = Rollback()
+    patches = []
+    modules = {}
+    with _atomic(entanglement):
+        for position, (item, item_aspects) in enumerate(targets):
+            rollback = _weave(item, item_aspects, **options)
+            if patches is not None and isinstance(rollback, Rollback):
+                groups = {}
+                for entry in rollback._journal:
+                    patch = _plan_patch(entry, modules) if type(entry) is tuple else None
+                    if patch is None:
+                        logdebug('  --- %r cannot be planned.', entry)
+                        patches = None
+                        break
+                    group = groups.setdefault(id(entry[2]), len(groups)) if patch[-1] == 'function' else None
+                    patches.append([position, *patch, group])
+            entanglement.merge(rollback)
+    if patches is not None:
+        _save_plan(path, {'version': _PLAN_VERSION, 'key': key, 'modules': modules, 'patches': patches})
+    return entanglement
+
+
+def _plan_patch(entry, modules):
+    owner, name, original = entry
+    if ismodule(owner):
+        if sys.modules.get(owner.__name__) is owner and isroutine(original):
+            modules[owner.__name__] = _module_stamp(owner)
+            return owner.__name__, '', name, 'function'
+    elif isclass(owner) and owner.__module__ in sys.modules:
+        try:
+            resolved = _resolve_qualname(sys.modules[owner.__module__], owner.__qualname__)
+        except AttributeError:
+            return None
+        if resolved is owner:
+            for klass in owner.__mro__:
+                if klass is not object and klass.__module__ in sys.modules:
+                    modules[klass.__module__] = _module_stamp(sys.modules[klass.__module__])
+            return owner.__module__, owner.__qualname__, name, 'inherited' if original is ABSENT else 'method'
+
+
+def _resolve_qualname(owner, qualname):
+    for part in qualname.split('.') if qualname else ():
+        owner = getattr(owner, part)
+    return owner
+
+
+def _module_stamp(module):
+    filename = getattr(module, '__file__', None)
+    if not filename:
+        return None
+    try:
+        stat = Path(filename).stat()
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _load_plan(path, key):
+    try:
+        with Path(path).open() as fh:
+            plan = json.load(fh)
+    except (OSError, ValueError) as exc:
+        logdebug('  --- plan %s is not usable: %r', path, exc)
+        return None
+    if not isinstance(plan, dict) or plan.get('version') != _PLAN_VERSION or plan.get('key') != key:
+        logdebug('  --- plan %s was made for something else.', path)
+        return None
+    for name, stamp in plan['modules'].items():
+        try:
+            module = sys.modules.get(name) or _import_module(name)
+        except ImportError:
+            return None
+        if _module_stamp(module) != stamp:
+            logdebug('  --- plan %s is outdated (%s changed).', path, name)
+            return None
+    return plan
+
+
+def _save_plan(path, plan):
+    path = Path(path)
+    temporary = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        with temporary.open('w') as fh:
+            json.dump(plan, fh)
+        temporary.replace(path)
+    except OSError as exc:
+        logdebug('  --- could not save plan %s: %r', path, exc)
+
+
+def _replay_plan(plan, targets, options):
+    logdebug('@ replaying plan for %s ...', plan['key']['targets'])
+    duplicates = options.get('duplicates', 'stack')
+    entanglement = Rollback()
+    wrappers = {}
+    with _atomic(entanglement):
+        for position, module_name, qualname, name, kind, group in plan['patches']:
+            aspects = targets[position][1]
+            table = _concern_table(aspects)
+            if table is not None:
+                aspects = table[name]
+            owner = _resolve_qualname(sys.modules[module_name], qualname)
+            if kind == 'function':
+                original = owner.__dict__[name]
+                func, wrapper = wrappers.get((position, group), (original, None))
+                if func is not original:
+                    raise KeyError(f'{module_name}.{name} is not an alias of {func!r} anymore.')
+                if wrapper is None:
+                    wrapper = _checked_apply(aspects, func, module=owner, duplicates=duplicates)
+                    try:
+                        wrapper.__module__ = owner.__name__
+                    except (TypeError, AttributeError):
+                        pass
+                    wrappers[position, group] = func, wrapper
+                _setattr(owner, name, wrapper, original)
+                entanglement.record(owner, name, original)
+            elif kind == 'method':
+                func = owner.__dict__[name]
+                _setattr(owner, name, _rewrap_method(func, owner, aspects, duplicates), func)
+                entanglement.record(owner, name, func)
+            elif kind == 'inherited':
+                for klass in owner.__mro__[1:]:
+                    if name in klass.__dict__:
+                        break
+                else:
+                    raise AttributeError(f'{owner!r} has no {name!r} attribute anymore.')
+                expected = _current(owner, name)
+                _setattr(owner, name, _rewrap_method(klass.__dict__[name], klass, aspects, duplicates), expected)
+                entanglement.record(owner, name)
+            else:
+                raise KeyError(f'Unknown kind of patch {kind!r}.')
+    return entanglement
+
+
+def _check_aspects(aspects):
+    if not callable(aspects):
+        if not hasattr(aspects, '__iter__'):
+            raise ExpectedAdvice(f'{aspects} must be an `Aspect` instance, a callable or an iterable of.')
+        for obj in aspects:
+            if not callable(obj):
+                raise ExpectedAdvice(f'{obj} must be an `Aspect` instance or a callable.')
+
+
+def _weave(target, aspects, deferred=False, **options):
+    assert target, f"Can't weave falsy value {target!r}."
+    logdebug('weave (target=%s, aspects=%s, deferred=%s, **options=%s)', target, aspects, deferred, options)
+
+    bag = options['bag']
+    duplicates = options.get('duplicates', 'stack')
+
+    if isinstance(target, (list, tuple)):
+        with _atomic(Rollback()) as entanglement:
+            for item in target:
+                entanglement.merge(_weave(item, aspects, deferred=deferred, **options))
+        return entanglement
+    elif isinstance(target, basestring):
+        if ':' in target:
+            hook = _PatternWeave(target, aspects, options)
+            if deferred:
+                _import_hooks.add(hook)
+            try:
+                for name, module in list(sys.modules.items()):
+                    if module is not None and hook.matches(name):
+                        hook(module)
+            except BaseException:
+                hook.cancel()
+                raise
+            return Rollback(hook.cancel)
+
+        if '*' in target or '?' in target:
+            raise SyntaxError(f'Could not use {target!r} as a pattern, it must have a colon (eg: {target + ":"!r} to weave the modules).')
+        parts = target.split('.')
+        for part in parts:
+            _check_name(part)
+
+        if deferred:
+            hook = _DeferredWeave(target, aspects, options)
+            _import_hooks.add(hook)
+            hook()
+            return Rollback(hook.cancel)
+
+        if len(parts) == 1:
+            return weave_module(_import_module(part), aspects, **options)
+
+        for pos in reversed(range(1, len(parts))):
+            owner, name = '.'.join(parts[:pos]), '.'.join(parts[pos:])
+            try:
+                owner = _import_module(owner)
+            except ImportError:
+                continue
+            else:
+                break
+        else:
+            raise ImportError(f'Could not import {target!r}. Last try was for {owner}')
 
         if '.' in name:
             path, name = name.rsplit('.', 1)
@@ -445,18 +3324,7 @@ def weave(target, aspects, **options):
                 owner = getattr(owner, path.popleft())
 
         logdebug('@ patching %s from %s ...', name, owner)
-        obj = getattr(owner, name)
-
-        if isinstance(obj, (type, ClassType)):
-            logdebug('   .. as a class %r.', obj)
-            return weave_class(obj, aspects, owner=owner, name=name, **options)
-        elif callable(obj):  # or isinstance(obj, FunctionType) ??
-            logdebug('   .. as a callable %r.', obj)
-            if bag.has(obj):
-                return Nothing
-            return patch_module_function(owner, obj, aspects, force_name=name, **options)
-        else:
-            return weave(obj, aspects, **options)
+        return _weave_attribute(owner, name, getattr(owner, name), aspects, **options)
 
     name = getattr(target, '__name__', None)
     if name and getattr(builtins, name, None) is target:
@@ -470,19 +3338,23 @@ def weave(target, aspects, **options):
         name = target.__name__
         logdebug('@ patching %r (%s) as instance method.', target, name)
         func = target.__func__
-        setattr(inst, name, _checked_apply(aspects, func).__get__(inst, type(inst)))
-        return Rollback(lambda: delattr(inst, name))
+        expected = _current(inst, name)
+        _setattr(inst, name, _checked_apply(aspects, func, duplicates=duplicates).__get__(inst, type(inst)), expected)
+        entanglement = Rollback()
+        entanglement.record(inst, name)
+        return entanglement
     elif PY3 and isfunction(target):
         if bag.has(target):
             return Nothing
-        owner = _import_module(target.__module__)
-        path = deque(target.__qualname__.split('.')[:-1])
+        original = getattr(target, '__woven__', (target,))[0]  # the wrappers don't have a meaningful qualname
+        owner = _import_module(original.__module__)
+        path = deque(original.__qualname__.split('.')[:-1])
         while path:
             owner = getattr(owner, path.popleft())
-        name = target.__name__
+        name = original.__name__
         logdebug('@ patching %r (%s) as a property.', target, name)
         func = owner.__dict__[name]
-        return patch_module(owner, name, _checked_apply(aspects, func), func, **options)
+        return patch_module(owner, name, _checked_apply(aspects, func, duplicates=duplicates), func, **options)
     elif isclass(target):
         return weave_class(target, aspects, **options)
     elif ismodule(target):
@@ -493,24 +3365,96 @@ def weave(target, aspects, **options):
         raise UnsupportedType(f"Can't weave object {target} of type {type(target)}")
 
 
-def _rewrap_method(func, klass, aspect):
+def _weave_attribute(owner, name, obj, aspects, **options):
+    if isinstance(obj, (type, ClassType)):
+        logdebug('   .. as a class %r.', obj)
+        return weave_class(obj, aspects, owner=owner, name=name, **options)
+    elif callable(obj):  # or isinstance(obj, FunctionType) ??
+        logdebug('   .. as a callable %r.', obj)
+        if options['bag'].has(obj):
+            return Nothing
+        return patch_module_function(owner, obj, aspects, force_name=name, **options)
+    else:
+        return _weave(obj, aspects, **options)
+
+
+def _rewrap_method(func, klass, aspect, duplicates='stack'):
     if isinstance(func, staticmethod):
         if hasattr(func, '__func__'):
-            return staticmethod(_checked_apply(aspect, func.__func__))
+            return staticmethod(_checked_apply(aspect, func.__func__, duplicates=duplicates))
         else:
-            return staticmethod(_checked_apply(aspect, func.__get__(None, klass)))
+            return staticmethod(_checked_apply(aspect, func.__get__(None, klass), duplicates=duplicates))
     elif isinstance(func, classmethod):
         if hasattr(func, '__func__'):
-            return classmethod(_checked_apply(aspect, func.__func__))
+            return classmethod(_checked_apply(aspect, func.__func__, duplicates=duplicates))
         else:
-            return classmethod(_checked_apply(aspect, func.__get__(None, klass).im_func))
+            return classmethod(_checked_apply(aspect, func.__get__(None, klass).im_func, duplicates=duplicates))
     else:
-        return _checked_apply(aspect, func)
+        return _checked_apply(aspect, func, duplicates=duplicates)
+
 
+_instance_classes = WeakValueDictionary()
+_instance_class_sources = WeakKeyDictionary()
 
-def weave_instance(instance, aspect, methods=NORMAL_METHODS, lazy=False, bag=BrokenBag, **options):
+
+def _find_attribute(klass, attr):
+    for sklass in klass.__mro__:
+        if attr in sklass.__dict__:
+            return sklass.__dict__[attr]
+    return ABSENT
+
+
+def _woven_instance_class(klass, aspect, methods, duplicates):
+    """
+    Returns a subclass of ``klass`` with the matching methods weaved. It's made once for the given aspects and options,
+    and reused as long as something (eg: a weaved instance) keeps it alive and the methods it weaved are still the ones
+    the class has. The cache only has weak references to the class (a woven subclass references its base, so the class
+    couldn't be collected otherwise).
+    """
+    key = (
+        ref(klass),
+        tuple(aspect) if isinstance(aspect, (list, tuple)) else aspect,
+        tuple(methods) if isinstance(methods, list) else methods,
+        duplicates,
+    )
+    with _weaving_lock:
+        try:
+            woven = _instance_classes.get(key)
+        except TypeError:  # unhashable aspects or class
+            key = woven = None
+        if woven is not None:
+            if all(_find_attribute(klass, attr) is func for attr, func in _instance_class_sources[woven]):
+                logdebug(' * reusing %r.', woven)
+                return woven
+            logdebug(' * not reusing %r, the methods of %r were changed.', woven, klass)
+
+        method_matches, pointcut = _method_matcher(methods)
+        sources = []
+        wrappers = {'__slots__': (), '__module__': klass.__module__, '__qualname__': klass.__qualname__, '__doc__': klass.__doc__}
+        for attr in dir(klass):
+            if method_matches(attr):
+                for sklass in klass.__mro__:
+                    if attr in sklass.__dict__:
+                        break
+                else:
+                    continue
+                func = sklass.__dict__[attr]
+                if pointcut is not None and not pointcut.matches(klass, attr, func, sklass is not klass):
+                    continue
+                if isfunction(func) or isinstance(func, (classmethod, staticmethod)):
+                    wrappers[attr] = _rewrap_method(func, sklass, aspect, duplicates)
+                    sources.append((attr, func))
+        logdebug(' * creating subclass of %r with attributes %r', klass, wrappers)
+        woven = type(klass.__name__, (klass, Fabric), wrappers)
+        if key is not None:
+            _instance_classes[key] = woven
+            _instance_class_sources[woven] = tuple(sources)
+        return woven
+
+
+def weave_instance(instance, aspect, methods=NORMAL_METHODS, lazy=False, bag=BrokenBag, duplicates='stack', **options):
     """
-    Low-level weaver for instances.
+    Low-level weaver for instances. The class of the instance is changed to a subclass with the weaved methods.
 
     .. warning:: You should not use this directly.
 
@@ -519,28 +3463,20 @@ def weave_instance(instance, aspect, methods=NORMAL_METHODS, lazy=False, bag=Bro
     if bag.has(instance):
         return Nothing
 
+    logdebug('weave_instance (instance=%r, aspect=%s, methods=%s, lazy=%s, **options=%s)', instance, aspect, methods, lazy, options)
+    klass = type(instance)
     entanglement = Rollback()
-    method_matches = make_method_matcher(methods)
-    logdebug('weave_instance (module=%r, aspect=%s, methods=%s, lazy=%s, **options=%s)', instance, aspect, methods, lazy, options)
-
-    def fixup(func):
-        return func.__get__(instance, type(instance))
-
-    fixed_aspect = [*aspect, fixup] if isinstance(aspect, (list, tuple)) else [aspect, fixup]
-
-    for attr in dir(instance):
-        if method_matches(attr):
-            func = getattr(instance, attr)
-            if ismethod(func):
-                if hasattr(func, '__func__'):
-                    realfunc = func.__func__
-                else:
-                    realfunc = func.im_func
-                entanglement.merge(patch_module(instance, attr, _checked_apply(fixed_aspect, realfunc, module=None), **options))
+    with _atomic(entanglement):
+        woven = _woven_instance_class(klass, aspect, methods, duplicates)
+        try:
+            _setattr(instance, '__class__', woven, klass)
+        except TypeError as exc:
+            raise TypeError(f"Can't weave {instance!r}: {exc}") from exc
+        entanglement.record(instance, '__class__', klass)
     return entanglement
 
 
-def weave_module(module, aspect, methods=NORMAL_METHODS, lazy=False, bag=BrokenBag, **options):
+def weave_module(module, aspect, methods=NORMAL_METHODS, lazy=False, bag=BrokenBag, index=None, **options):
     """
     Low-level weaver for "whole module weaving".
 
@@ -552,26 +3488,50 @@ def weave_module(module, aspect, methods=NORMAL_METHODS, lazy=False, bag=BrokenB
         return Nothing
 
     entanglement = Rollback()
-    method_matches = make_method_matcher(methods)
+    method_matches, pointcut = _method_matcher(methods)
     logdebug('weave_module (module=%r, aspect=%s, methods=%s, lazy=%s, **options=%s)', module, aspect, methods, lazy, options)
 
-    for attr in dir(module):
-        if method_matches(attr):
-            func = getattr(module, attr)
-            if isroutine(func):
-                entanglement.merge(patch_module_function(module, func, aspect, force_name=attr, **options))
-            elif isclass(func):
-                entanglement.merge(
-                    weave_class(func, aspect, owner=module, name=attr, methods=methods, lazy=lazy, bag=bag, **options),
-                    #  it's not consistent with the other ways of weaving a class (it's never weaved as a routine).
-                    #  therefore it's disabled until it's considered useful.
-                    #  #patch_module_function(module, getattr(module, attr), aspect, force_name=attr, **options),
-                )
+    with _atomic(entanglement):
+        if index is None:
+            index = _AliasIndex()
+        woven = set()
+        for attr in dir(module):
+            if method_matches(attr):
+                func = index.get(module, attr)
+                if id(func) in woven:
+                    logdebug('  --- %s.%s is already weaved (as an alias).', module, attr)
+                    continue
+                if isroutine(func):
+                    if pointcut is not None and not pointcut.matches(module, attr, func):
+                        continue
+                    entanglement.merge(patch_module_function(module, func, aspect, force_name=attr, index=index, **options))
+                elif isclass(func):
+                    entanglement.merge(
+                        weave_class(func, aspect, owner=module, name=attr, methods=methods, lazy=lazy, bag=bag, index=index, **options),
+                        #  it's not consistent with the other ways of weaving a class (it's never weaved as a routine).
+                        #  therefore it's disabled until it's considered useful.
+                        #  #patch_module_function(module, getattr(module, attr), aspect, force_name=attr, **options),
+                    )
+                else:
+                    continue
+                woven.add(id(index.get(module, attr)))
     return entanglement
 
 
 def weave_class(
-    klass, aspect, methods=NORMAL_METHODS, subclasses=True, lazy=False, owner=None, name=None, aliases=True, bases=True, bag=BrokenBag
+    klass,
+    aspect,
+    methods=NORMAL_METHODS,
+    subclasses=True,
+    lazy=False,
+    owner=None,
+    name=None,
+    aliases=True,
+    bases=True,
+    bag=BrokenBag,
+    index=None,
+    duplicates='stack',
+    future_subclasses=True,
 ):
     """
     Low-level weaver for classes.
@@ -584,7 +3544,22 @@ def weave_class(
         return Nothing
 
     entanglement = Rollback()
-    method_matches = make_method_matcher(methods)
+    method_matches, pointcut = _method_matcher(methods)
+    table = _concern_table(aspect)
+    if table is None:
+
+        def aspect_for(attr):
+            return aspect
+
+    else:
+        if lazy:
+            raise TypeError(f"Can't use lazy=True with a concern ({aspect!r}).")
+        matches = method_matches
+
+        def method_matches(attr):
+            return attr in table and matches(attr)
+
+        aspect_for = table.__getitem__
     logdebug(
         'weave_class (klass=%r, methods=%s, subclasses=%s, lazy=%s, owner=%s, name=%s, aliases=%s, bases=%s)',
         klass,
@@ -597,59 +3572,111 @@ def weave_class(
         bases,
     )
 
-    if subclasses and hasattr(klass, '__subclasses__'):
-        sub_targets = klass.__subclasses__()
-        if sub_targets:
-            logdebug('~ weaving subclasses: %s', sub_targets)
-        for sub_class in sub_targets:
-            if not issubclass(sub_class, Fabric):
-                entanglement.merge(weave_class(sub_class, aspect, methods=methods, subclasses=subclasses, lazy=lazy, bag=bag))
-    if lazy:
-
-        def __init__(self, *args, **kwargs):
-            super(SubClass, self).__init__(*args, **kwargs)
-            for attr in dir(self):
-                if method_matches(attr) and attr not in wrappers:
-                    func = getattr(self, attr, None)
+    with _atomic(entanglement):
+        if subclasses and hasattr(klass, '__subclasses__'):
+            sub_targets = klass.__subclasses__()
+            if sub_targets:
+                logdebug('~ weaving subclasses: %s', sub_targets)
+            for sub_class in sub_targets:
+                if not issubclass(sub_class, Fabric):
+                    entanglement.merge(
+                        weave_class(
+                            sub_class,
+                            aspect,
+                            methods=methods,
+                            subclasses=subclasses,
+                            lazy=lazy,
+                            bag=bag,
+                            index=index,
+                            duplicates=duplicates,
+                            future_subclasses=False,
+                        )
+                    )
+        if lazy:
+            prepared = WeakSet()
+            patched = []
+
+            def __init__(self, *args, **kwargs):
+                super(SubClass, self).__init__(*args, **kwargs)
+                if type(self) not in prepared:
+                    prepare(type(self))
+
+            def prepare(cls):
+                with _weaving_lock:
+                    for sklass in reversed(cls.__mro__):
+                        if sklass in prepared or not issubclass(sklass, SubClass):
+                            continue
+                        if sklass is SubClass:
+                            prepare_methods()
+                        else:
+                            prepare_subclass(sklass)
+                        prepared.add(sklass)
+
+            def prepare_methods():
+                logdebug(' * patching the methods of %r (first instance).', SubClass)
+                for attr in dir(SubClass):
+                    if method_matches(attr) and attr not in wrappers:
+                        for sklass in SubClass.__mro__:
+                            if attr in sklass.__dict__:
+                                break
+                        else:
+                            continue
+                        func = sklass.__dict__[attr]
+                        if pointcut is not None and not pointcut.matches(klass, attr, func, sklass is not klass):
+                            continue
+                        if sklass is not object and isroutine(func):
+                            setattr(SubClass, attr, _rewrap_method(func, sklass, aspect, duplicates))
+
+            def prepare_subclass(sklass):
+                logdebug(' * patching the methods of subclass %r (first instance).', sklass)
+                for attr, func in list(sklass.__dict__.items()):
+                    if method_matches(attr) and attr not in wrappers and isroutine(func):
+                        if pointcut is None or pointcut.matches(sklass, attr, func):
+                            setattr(sklass, attr, _rewrap_method(func, sklass, aspect, duplicates))
+                            patched.append((sklass, attr, func))
+
+            wrappers = {'__init__': _checked_apply(aspect, __init__) if method_matches('__init__') else __init__}
+            for attr, func in klass.__dict__.items():
+                if method_matches(attr) and (pointcut is None or pointcut.matches(klass, attr, func)):
+                    if ismethoddescriptor(func):
+                        wrappers[attr] = _rewrap_method(func, klass, aspect, duplicates)
+
+            logdebug(' * creating subclass with attributes %r', wrappers)
+            name = name or klass.__name__
+            SubClass = type(name, (klass, Fabric), wrappers)
+            SubClass.__module__ = klass.__module__
+            module = owner or _import_module(klass.__module__)
+            entanglement.merge(patch_module(module, name, SubClass, original=klass, aliases=aliases, index=index))
+            entanglement.merge(partial(_undo, patched))  # the methods of the subclasses defined later
+        else:
+            if index is not None:
+                index.forget(klass)
+            for attr, func in klass.__dict__.items():
+                if method_matches(attr) and (pointcut is None or pointcut.matches(klass, attr, func)):
                     if isroutine(func):
-                        setattr(self, attr, _checked_apply(aspect, force_bind(func)).__get__(self, SubClass))
-
-        wrappers = {'__init__': _checked_apply(aspect, __init__) if method_matches('__init__') else __init__}
-        for attr, func in klass.__dict__.items():
-            if method_matches(attr):
-                if ismethoddescriptor(func):
-                    wrappers[attr] = _rewrap_method(func, klass, aspect)
-
-        logdebug(' * creating subclass with attributes %r', wrappers)
-        name = name or klass.__name__
-        SubClass = type(name, (klass, Fabric), wrappers)
-        SubClass.__module__ = klass.__module__
-        module = owner or _import_module(klass.__module__)
-        entanglement.merge(patch_module(module, name, SubClass, original=klass, aliases=aliases))
-    else:
-        original = {}
-        for attr, func in klass.__dict__.items():
-            if method_matches(attr):
-                if isroutine(func):
-                    logdebug('@ patching attribute %r (original: %r).', attr, func)
-                    setattr(klass, attr, _rewrap_method(func, klass, aspect))
-                else:
-                    continue
-                original[attr] = func
-        entanglement.merge(lambda: deque((setattr(klass, attr, func) for attr, func in original.items()), maxlen=0))
-        if bases:
-            super_original = set()
-            for sklass in _find_super_classes(klass):
-                if sklass is not object:
-                    for attr, func in sklass.__dict__.items():
-                        if method_matches(attr) and attr not in original and attr not in super_original:
-                            if isroutine(func):
-                                logdebug('@ patching attribute %r (from superclass: %s, original: %r).', attr, sklass.__name__, func)
-                                setattr(klass, attr, _rewrap_method(func, sklass, aspect))
-                            else:
+                        logdebug('@ patching attribute %r (original: %r).', attr, func)
+                        _setattr(klass, attr, _rewrap_method(func, klass, aspect_for(attr), duplicates), func)
+                    else:
+                        continue
+                    entanglement.record(klass, attr, func)
+            if bases:
+                seen = set(klass.__dict__)
+                for sklass in _find_super_classes(klass):
+                    if sklass is not object and sklass is not klass:
+                        for attr, func in sklass.__dict__.items():
+                            if attr in seen:
                                 continue
-                            super_original.add(attr)
-            entanglement.merge(lambda: deque((delattr(klass, attr) for attr in super_original), maxlen=0))
+                            seen.add(attr)
+                            if method_matches(attr) and (pointcut is None or pointcut.matches(klass, attr, func, True)):
+                                if isroutine(func):
+                                    logdebug('@ patching attribute %r (from superclass: %s, original: %r).', attr, sklass.__name__, func)
+                                    expected = _current(klass, attr)
+                                    _setattr(klass, attr, _rewrap_method(func, sklass, aspect_for(attr), duplicates), expected)
+                                else:
+                                    continue
+                                entanglement.record(klass, attr)
+        if table is not None and subclasses and future_subclasses:
+            entanglement.merge(_hook_subclasses(klass, aspect, methods, duplicates))
 
     return entanglement
 
@@ -670,7 +3697,7 @@ def _import_module(module):
     return sys.modules[module]
 
 
-def patch_module(module, name, replacement, original=UNSPECIFIED, aliases=True, location=None, **_bogus_options):
+def patch_module(module, name, replacement, original=UNSPECIFIED, aliases=True, location=None, index=None, **_bogus_options):
     """
     Low-level attribute patcher.
 
@@ -679,6 +3706,7 @@ def patch_module(module, name, replacement, original=UNSPECIFIED, aliases=True,
     :param replacement: The replacement value.
     :param original: The original value (in case the object beeing patched uses descriptors or is plain weird).
     :param bool aliases: If ``True`` patch all the attributes that have the same original value.
+    :param index: An alias index shared between patches (avoids scanning ``module`` again for every patch).
 
     :returns: An :obj:`aspectlib.Rollback` object.
     """
@@ -687,42 +3715,43 @@ def patch_module(module, name, replacement, original=UNSPECIFIED, aliases=True,
     original = getattr(module, name) if original is UNSPECIFIED else original
     location = module.__name__ if hasattr(module, '__name__') else type(module).__module__
     target = module.__name__ if hasattr(module, '__name__') else type(module).__name__
+    if index is None:
+        index = _AliasIndex()
     try:
         replacement.__module__ = location
     except (TypeError, AttributeError):
         pass
-    for alias in dir(module):
-        logdebug('alias:%s (%s)', alias, name)
-        if hasattr(module, alias):
-            obj = getattr(module, alias)
-            logdebug('- %s:%s (%s)', obj, original, obj is original)
-            if obj is original:
-                if aliases or alias == name:
-                    logdebug('= saving %s on %s.%s ...', replacement, target, alias)
-                    setattr(module, alias, replacement)
-                    rollback.merge(lambda alias=alias: setattr(module, alias, original))
+    names = index.aliases(module, original)
+    if index.get(module, name, UNSPECIFIED) is not UNSPECIFIED:
+        obj = getattr(module, name)
+        logdebug('- %s:%s (%s)', obj, original, obj is original)
+        if obj is not original and not ismethod(obj):
+            raise AssertionError(f'{module}.{name} = {obj} is not {original}.')
+        if name not in names:
+            names.append(name)
+    with _atomic(rollback):
+        for alias in names:
+            logdebug('alias:%s (%s)', alias, name)
+            if alias == name or aliases and getattr(module, alias, None) is original:
+                logdebug('= saving %s on %s.%s ...', replacement, target, alias)
+                _setattr(module, alias, replacement)
+                index.update(module, alias, replacement)
+                rollback.record(module, alias, original)
                 if alias == name:
                     seen = True
-            elif alias == name:
-                if ismethod(obj):
-                    logdebug('= saving %s on %s.%s ...', replacement, target, alias)
-                    setattr(module, alias, replacement)
-                    rollback.merge(lambda alias=alias: setattr(module, alias, original))
-                    seen = True
-                else:
-                    raise AssertionError(f'{module}.{alias} = {obj} is not {original}.')
-
-    if not seen:
-        warnings.warn(
-            f'Setting {target}.{name} to {replacement}. There was no previous definition, probably patching the wrong module.', stacklevel=2
-        )
-        logdebug('= saving %s on %s.%s ...', replacement, target, name)
-        setattr(module, name, replacement)
-        rollback.merge(lambda: setattr(module, name, original))
+        if not seen:
+            warnings.warn(
+                f'Setting {target}.{name} to {replacement}. There was no previous definition, probably patching the wrong module.',
+                stacklevel=2,
+            )
+            logdebug('= saving %s on %s.%s ...', replacement, target, name)
+            _setattr(module, name, replacement)
+            index.update(module, name, replacement)
+            rollback.record(module, name, original)
     return rollback
 
 
-def patch_module_function(module, target, aspect, force_name=None, bag=BrokenBag, **options):
+def patch_module_function(module, target, aspect, force_name=None, bag=BrokenBag, duplicates='stack', **options):
     """
     Low-level patcher for one function from a specified module.
 
@@ -734,4 +3763,4 @@ def patch_module_function(module, target, aspect, force_name=None, bag=BrokenBag
         'patch_module_function (module=%s, target=%s, aspect=%s, force_name=%s, **options=%s', module, target, aspect, force_name, options
     )
     name = force_name or target.__name__
-    return patch_module(module, name, _checked_apply(aspect, target, module=module), original=target, **options)
+    return patch_module(module, name, _checked_apply(aspect, target, module=module, duplicates=duplicates), original=target, **options)
@@ -165,6 +165,7 @@ def log(
         __slots__ = 'cutpoint_function', 'final_function', 'binding', '__name__', '__weakref__'
 
         bind = False
+        specialize = False
 
         def __init__(self, cutpoint_function, binding=None):
             mimic(self, cutpoint_function)
@@ -15,12 +15,14 @@ from aspectlib import ALL_METHODS
 from aspectlib import mimic
 from aspectlib import weave
 
+from .utils import IdentityMap
 from .utils import Sentinel
 from .utils import camelcase_to_underscores
 from .utils import container
 from .utils import logf
 from .utils import qualname
 from .utils import repr_ex
+from .utils import weak
 
 try:
     from logging import _levelNames as nameToLevel
@@ -173,7 +175,9 @@ class _RecordingFunctionWrapper:
     See :obj:`aspectlib.test.record` for arguments.
     """
 
-    def __init__(self, wrapped, iscalled=True, calls=None, callback=None, extended=False, results=False, recurse_lock=None, binding=None):
+    def __init__(
+        self, wrapped, iscalled=True, calls=None, callback=None, extended=False, results=False, recurse_lock=None, binding=None, weak=False
+    ):
         assert not results or iscalled, '`iscalled` must be True if `results` is True'
         mimic(self, wrapped)
         self.__wrapped = wrapped
@@ -184,6 +188,7 @@ class _RecordingFunctionWrapper:
         self.__extended = extended
         self.__results = results
         self.__recurse_lock = recurse_lock
+        self.__weak = weak
         self.calls = [] if not callback and calls is None else calls
 
     def __call__(self, *args, **kwargs):
@@ -213,10 +218,13 @@ class _RecordingFunctionWrapper:
         if self.__callback is not None:
             self.__callback(self.__binding, qualname(self), args, kwargs, *response)
         if self.calls is not None:
+            binding = self.__binding
+            if self.__weak and binding is not None:
+                binding = weak(binding)
             if self.__extended:
-                self.calls.append((ResultEx if response else CallEx)(self.__binding, qualname(self), args, kwargs, *response))
+                self.calls.append((ResultEx if response else CallEx)(binding, qualname(self), args, kwargs, *response))
             else:
-                self.calls.append((Result if response else Call)(self.__binding, args, kwargs, *response))
+                self.calls.append((Result if response else Call)(binding, args, kwargs, *response))
 
     def __get__(self, instance, owner):
         return _RecordingFunctionWrapper(
@@ -227,6 +235,7 @@ class _RecordingFunctionWrapper:
             extended=self.__extended,
             results=self.__results,
             binding=instance,
+            weak=self.__weak,
         )
 
     def __enter__(self):
@@ -253,6 +262,10 @@ def record(func=None, recurse_lock_factory=allocate_lock, **options):
             If ``True`` the `func`'s ``__name__`` will also be included in the call list. (default: ``False``)
         results (bool):
             If ``True`` the results (and exceptions) will also be included in the call list. (default: ``False``)
+        weak (bool):
+            If ``True`` the call list only has weak references (:func:`weakref.ref`) to the instances the methods were
+            called on, so recording doesn't keep them alive. Instances that don't support weak references are kept as
+            they are. (default: ``False``)
 
     Returns:
         A wrapper that records all calls made to `func`. The history is available as a ``call``
@@ -287,6 +300,10 @@ def record(func=None, recurse_lock_factory=allocate_lock, **options):
         Renamed `call` option to `iscalled`.
         Added `callback` option.
         Added `extended` option.
+
+    .. versionchanged:: 2.1.0
+
+        Added `weak` option.
     """
     if func:
         return _RecordingFunctionWrapper(func, recurse_lock=recurse_lock_factory(), **options)
@@ -436,12 +453,12 @@ class _RecordingBase:
         self._target = target
         self._options = options
         self._calls = OrderedDict()
-        self._ids = {}
+        self._ids = IdentityMap()
         self._instances = defaultdict(int)
 
     def _make_key(self, binding, name, args, kwargs):
         if binding is not None:
-            binding, _ = self._ids[id(binding)]
+            (binding,) = self._ids[id(binding)]
         return (binding, name, ', '.join(repr_ex(i) for i in args), ', '.join(f'{k}={repr_ex(v)}' for k, v in kwargs.items()))
 
     def _tag_result(self, name, result):
@@ -449,7 +466,7 @@ class _RecordingBase:
             instance_name = camelcase_to_underscores(name.rsplit('.', 1)[-1])
             self._instances[instance_name] += 1
             instance_name = f'{instance_name}_{self._instances[instance_name]}'
-            self._ids[id(result.value)] = instance_name, result.value
+            self._ids.add(result.value, (instance_name,))
             result.value = instance_name
         else:
             result.value = repr_ex(result.value, self._ids)
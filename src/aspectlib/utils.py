@@ -4,8 +4,10 @@ import platform
 import re
 import sys
 from collections import deque
+from functools import partial
 from functools import wraps
 from inspect import isclass
+from weakref import ref
 
 RegexType = type(re.compile(''))
 
@@ -67,8 +69,8 @@ def force_bind(func):
 def make_method_matcher(regex_or_regexstr_or_namelist):
     if isinstance(regex_or_regexstr_or_namelist, basestring):
         return re.compile(regex_or_regexstr_or_namelist).match
-    elif isinstance(regex_or_regexstr_or_namelist, (list, tuple)):
-        return regex_or_regexstr_or_namelist.__contains__
+    elif isinstance(regex_or_regexstr_or_namelist, (list, tuple, set, frozenset)):
+        return frozenset(regex_or_regexstr_or_namelist).__contains__
     elif isinstance(regex_or_regexstr_or_namelist, RegexType):
         return regex_or_regexstr_or_namelist.match
     else:
@@ -89,6 +91,46 @@ class Sentinel:
     __str__ = __repr__
 
 
+def _discard_identity(mapping_ref, key, obj_ref):
+    mapping = mapping_ref()
+    if mapping is not None and mapping._refs.get(key) is obj_ref:
+        del mapping._refs[key]
+        dict.pop(mapping, key, None)
+
+
+class IdentityMap(dict):
+    """
+    A dict keyed by ``id(obj)`` that doesn't keep the objects alive: the entries are removed when the objects are
+    garbage collected (so the ids can't be confused with the ids of newer objects). Objects that don't support weak
+    references are kept alive by the map instead.
+    """
+
+    __slots__ = '_refs', '__weakref__'
+
+    def __init__(self):
+        super().__init__()
+        self._refs = {}
+
+    def add(self, obj, value):
+        key = id(obj)
+        try:
+            obj_ref = ref(obj, partial(_discard_identity, ref(self), key))
+        except TypeError:
+            obj_ref = obj
+        self._refs[key] = obj_ref
+        self[key] = value
+
+
+def weak(obj):
+    """
+    Returns a weak reference to ``obj``, or ``obj`` itself if it doesn't support weak references.
+    """
+    try:
+        return ref(obj)
+    except TypeError:
+        return obj
+
+
 def container(name):
     def __init__(self, value):
         self.value = value
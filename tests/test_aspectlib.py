@@ -1,8 +1,22 @@
+import gc
+import inspect
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import types
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
 import aspectlib
 from aspectlib.test import mock
 from aspectlib.test import record
+from aspectlib.utils import DEBUG
 
 
 class Base:
@@ -43,6 +57,10 @@ def module_func2():
 module_func3 = module_func2
 
 
+def module_square(arg):
+    return arg * arg, os.getpid()
+
+
 class NormalTestClass:
     some = 'attribute'
 
@@ -563,6 +581,87 @@ def test_weave_instance():
     assert inst.foo == 'stuff'
 
 
+def test_weave_instance_swaps_class():
+    aspect = mock('mocked')
+    first, second, other = NormalTestClass(), NormalTestClass(), NormalTestClass()
+    with aspectlib.weave(first, aspect), aspectlib.weave(second, aspect, threadsafe=True):
+        assert type(first) is type(second) is not NormalTestClass
+        assert isinstance(first, NormalTestClass)
+        assert 'foobar' not in vars(first)
+        assert first.foobar('x') == second.foobar('x') == 'mocked'
+        assert first.class_foobar('x') == 'mocked'
+        assert first.static_foobar('x') == 'mocked'
+        assert other.foobar('x') is None
+        assert type(other) is NormalTestClass
+    assert type(first) is type(second) is NormalTestClass
+    assert first.foobar('x') is None
+
+
+def test_weave_instance_slots():
+    inst = SlotsTestClass()
+    with aspectlib.weave(inst, mock('mocked')):
+        assert inst.foobar('x') == 'mocked'
+        inst.other = 'stuff'
+        assert inst.other == 'stuff'
+    assert inst.foobar('x') is None
+    assert type(inst) is SlotsTestClass
+
+
+def test_weave_instance_cache_checks_methods():
+    calls = []
+
+    def aspect(name):
+        @aspectlib.Aspect
+        def aspect(*args):
+            calls.append(name)
+            yield
+
+        return aspect
+
+    class Parent:
+        def inherited(self):
+            return 'inherited'
+
+    class Klass(Parent):
+        def meth(self):
+            return 'meth'
+
+    first = aspect('first')
+    x = Klass()
+    with aspectlib.weave(x, first):
+        with aspectlib.weave(Klass, aspect('second')):
+            y = Klass()
+            with aspectlib.weave(y, first):
+                assert type(y) is not type(x)
+                assert y.meth() == 'meth'
+                assert y.inherited() == 'inherited'
+                assert calls == ['first', 'second', 'first', 'second']
+        z = Klass()
+        with aspectlib.weave(z, first):
+            del calls[:]
+            assert z.meth() == 'meth'
+            assert calls == ['first']
+
+
+def test_weave_instance_cache_doesnt_keep_classes():
+    aspect = mock('mocked')
+    refs = []
+    for i in range(5):
+        klass = type(f'Dynamic{i}', (), {'foobar': lambda self: None})
+        inst = klass()
+        with aspectlib.weave(inst, aspect):
+            assert inst.foobar() == 'mocked'
+        refs.append(weakref.ref(klass))
+    del klass, inst
+    gc.collect()
+    assert [ref() for ref in refs] == [None] * 5
+    assert not [key for key in aspectlib._instance_classes.keys() if key[1] is aspect]
+
+
+def test_weave_instance_bad():
+    pytest.raises(TypeError, aspectlib.weave, 1.5, mock('mocked'), methods=['hex'])
+
+
 def test_weave_subclass_meth_from_baseclass():
     history = []
 
@@ -1175,6 +1274,53 @@ def test_weave_subclass(Bub=Sub):
     assert Bub is Sub
 
 
+def test_weave_lazy_patches_class_once():
+    calls = []
+    with aspectlib.weave(Sub, record(calls=calls, iscalled=True), lazy=True):
+        assert 'meth' not in Sub.__dict__
+        first, second = Sub(), Sub()
+        assert 'meth' in Sub.__dict__
+        assert vars(first) == vars(second) == {}
+        wrapper = Sub.__dict__['meth']
+        assert first.meth() == second.meth() == 'base'
+        assert Sub.__dict__['meth'] is wrapper
+        assert [call.self for call in calls if call.args == ()] == [first, second]
+    assert Sub().meth() == 'base'
+    assert 'meth' not in Sub.__dict__
+
+
+def test_weave_lazy_later_subclass():
+    calls = []
+
+    @aspectlib.Aspect
+    def aspect(*args):
+        calls.append(args[1:])
+        yield
+
+    with aspectlib.weave(Sub, aspect, lazy=True):
+
+        class Later(Sub):
+            def meth(self):
+                return 'later'
+
+            def other(self, arg):
+                return arg
+
+        class Latest(Later):
+            def other(self, arg):
+                return arg * 2
+
+        assert Later().meth() == 'later'
+        assert Later().other(1) == 1
+        assert Latest().other(2) == 4
+        assert Latest().meth() == 'later'
+        assert calls == [(), (1,), (2,), ()]
+        assert len(aspectlib.layers(Later.__dict__['other'])) == 1
+        assert len(aspectlib.layers(Latest.__dict__['other'])) == 1
+    assert aspectlib.layers(Later.__dict__['meth']) == ()
+    assert aspectlib.layers(Latest.__dict__['other']) == ()
+
+
 def test_weave_subclass_meth_manual():
     with aspectlib.weave(Sub, mock('foobar'), lazy=True, methods=['meth']):
         assert Sub().meth() == 'foobar'
@@ -1455,6 +1601,910 @@ def test_weave_module_as_str():
     test_weave_module('test_pkg1.test_pkg2.test_mod')
 
 
+def test_weave_module_aliases_scanned_once():
+    scans = []
+
+    class Module(types.ModuleType):
+        def __dir__(self):
+            scans.append(self)
+            return super().__dir__()
+
+    module = Module('test_weave_module_aliases_scanned_once')
+    for i in range(50):
+        setattr(module, f'func{i}', lambda i=i: i)
+    module.alias = module.func0
+    calls = []
+    with aspectlib.weave(module, record(calls=calls)):
+        assert len(scans) == 2
+        assert module.alias is module.func0
+        assert module.func0() == 0
+        assert module.alias() == 0
+        assert module.func49() == 49
+    assert len(calls) == 3
+    assert module.alias is module.func0
+    assert module.func0() == 0
+    assert len(calls) == 3
+
+
+def test_weave_mapping():
+    with aspectlib.weave({module_func: mock('func'), 'test_aspectlib.Base.meth': mock('meth')}):
+        assert module_func() == 'func'
+        assert Base().meth() == 'meth'
+        assert Base2().meth() == 'meth'
+    assert module_func() is None
+    assert Base().meth() == 'base'
+
+
+def test_weave_atomic():
+    original = module_func
+    pytest.raises(AttributeError, aspectlib.weave, [module_func, 'test_aspectlib.missing_func'], mock('stuff'))
+    assert module_func is original
+    pytest.raises(AttributeError, aspectlib.weave, {module_func: mock('stuff'), 'test_aspectlib.missing_func': mock('stuff')})
+    assert module_func is original
+
+
+def test_weave_class_atomic():
+    class Klass:
+        def a(self):
+            return 'a'
+
+        def b(self):
+            return 'b'
+
+    original = dict(vars(Klass))
+
+    def aspect(func):
+        if func.__name__ == 'b':
+            raise RuntimeError('broken')
+        return mock('stuff')(func)
+
+    pytest.raises(RuntimeError, aspectlib.weave, Klass, aspect)
+    assert dict(vars(Klass)) == original
+    assert Klass().a() == 'a'
+
+
+def test_rollback_reverse_order():
+    original = module_func
+    with aspectlib.Rollback() as rollback:
+        rollback.merge(aspectlib.weave(module_func, mock('first')))
+        rollback.merge(aspectlib.weave(module_func, mock('second')))
+        assert module_func() == 'second'
+    assert module_func is original
+
+
+def test_rollback_record():
+    class Klass:
+        attr = 'original'
+
+    rollback = aspectlib.Rollback()
+    rollback.record(Klass, 'attr', Klass.attr)
+    Klass.attr = 'patched'
+    rollback.record(Klass, 'other')
+    Klass.other = 'patched'
+    rollback()
+    assert Klass.attr == 'original'
+    assert not hasattr(Klass, 'other')
+    rollback()
+    assert Klass.attr == 'original'
+
+
+def test_weave_threadsafe():
+    class Klass:
+        def a(self):
+            return 'a'
+
+        def b(self):
+            return 'b'
+
+    original = dict(vars(Klass))
+    aspect = mock('stuff')
+    stop = threading.Event()
+    seen = set()
+
+    def reader():
+        while not stop.is_set():
+            snapshot = dict(vars(Klass))
+            for name in 'ab':
+                value = snapshot[name]
+                seen.add(value is original[name] or aspectlib.layers(value) == (aspect,))
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for _ in range(200):
+            with aspectlib.weave(Klass, aspect, threadsafe=True):
+                assert Klass().a() == Klass().b() == 'stuff'
+            assert Klass().a() == 'a'
+    finally:
+        stop.set()
+        thread.join()
+    assert seen == {True}
+    assert dict(vars(Klass)) == original
+
+
+def test_weave_threadsafe_rollback_callables_unlocked():
+    acquired = []
+
+    def try_lock():
+        acquired.append(aspectlib._weaving_lock.acquire(timeout=5))
+        if acquired[-1]:
+            aspectlib._weaving_lock.release()
+
+    def callback():
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+
+    rollback = aspectlib.weave(Base, mock('stuff'), threadsafe=True)
+    rollback.merge(callback)
+    assert Base().meth() == 'stuff'
+    rollback()
+    assert acquired == [True]
+    assert Base().meth() == 'base'
+
+
+def test_weave_threadsafe_conflict():
+    class Klass:
+        def a(self):
+            return 'a'
+
+    changes = []
+
+    def meddling_aspect(func):
+        if len(changes) < 1:
+            changes.append(func)
+            Klass.a = lambda self: 'changed'
+        return mock('stuff')(func)
+
+    with aspectlib.weave(Klass, meddling_aspect, threadsafe=True):
+        assert Klass().a() == 'stuff'
+    assert Klass().a() == 'changed'
+
+    def always_meddling_aspect(func):
+        Klass.a = lambda self: 'changed'
+        return mock('stuff')(func)
+
+    pytest.raises(aspectlib.WeaveConflict, aspectlib.weave, Klass, always_meddling_aspect, threadsafe=True)
+    assert Klass().a() == 'changed'
+
+
+def test_weave_threadsafe_overlapping_targets():
+    pytest.raises(aspectlib.WeaveConflict, aspectlib.weave, {Base: mock('x'), 'test_aspectlib.Base.meth': mock('y')}, threadsafe=True)
+    assert Base().meth() == 'base'
+    assert Sub().meth() == 'base'
+
+
+def test_switch():
+    applied = []
+
+    def aspect(value):
+        def decorator(func):
+            applied.append(value)
+            return mock(value)(func)
+
+        return decorator
+
+    switch = aspectlib.Switch(aspect('first'))
+    with aspectlib.weave(Base, switch, subclasses=False):
+        assert switch.enabled
+        assert Base().meth() == 'first'
+        switch.disable()
+        assert not switch.enabled
+        assert Base().meth() == 'base'
+        switch.enable()
+        assert Base().meth() == 'first'
+        assert switch.swap(aspect('second')) is not None
+        assert Base().meth() == 'second'
+        assert Base().meth() == 'second'
+        switch.disable()
+        switch.swap([aspect('third'), aspect('fourth')])
+        assert Base().meth() == 'base'
+        switch.enable()
+        assert Base().meth() == 'fourth'
+    assert Base().meth() == 'base'
+    assert applied == ['first', 'second', 'third', 'fourth']
+
+
+def test_switch_on_generator():
+    calls = []
+    switch = aspectlib.Switch(aspectlib.Hooks(before=lambda arg: calls.append(arg)), enabled=False)
+
+    @switch
+    def func(arg):
+        yield from range(arg)
+        return 'done'
+
+    assert inspect.isgeneratorfunction(func)
+    assert list(func(2)) == [0, 1]
+    switch.enable()
+    assert list(func(3)) == [0, 1, 2]
+    assert calls == [3]
+    pytest.raises(aspectlib.ExpectedAdvice, switch.swap, 'crap')
+
+
+def test_scoped():
+    scope = aspectlib.Scoped(mock('stuff'))
+    with aspectlib.weave(Base, scope, subclasses=False):
+        assert Base().meth() == 'base'
+        with aspectlib.active(scope):
+            assert Base().meth() == 'stuff'
+            with aspectlib.active(scope):
+                assert Base().meth() == 'stuff'
+            assert Base().meth() == 'stuff'
+            results = []
+            thread = threading.Thread(target=lambda: results.append(Base().meth()))
+            thread.start()
+            thread.join()
+            assert results == ['base']
+            scope.disable()
+            assert Base().meth() == 'base'
+            scope.enable()
+            assert Base().meth() == 'stuff'
+        assert Base().meth() == 'base'
+    pytest.raises(TypeError, aspectlib.active(aspectlib.Switch(mock('stuff'))).__enter__)
+
+
+def test_weave_duplicates():
+    calls = []
+
+    def advising_function(*args):
+        calls.append('aspect')
+        yield
+
+    with aspectlib.weave(module_func, aspectlib.Aspect(advising_function)):
+        assert aspectlib.layers(module_func) == (aspectlib.Aspect(advising_function),)
+        with aspectlib.weave(module_func, aspectlib.Aspect(advising_function), duplicates='skip'):
+            assert len(aspectlib.layers(module_func)) == 1
+            module_func()
+            assert calls == ['aspect']
+        with aspectlib.weave(module_func, aspectlib.Aspect(advising_function)):
+            assert len(aspectlib.layers(module_func)) == 2
+            module_func()
+            assert calls == ['aspect', 'aspect', 'aspect']
+    assert aspectlib.layers(module_func) == ()
+    pytest.raises(TypeError, aspectlib.weave, module_func, mock('stuff'), duplicates='crap')
+
+
+def test_weave_duplicates_replace():
+    first = mock('first')
+    second = mock('second')
+    with aspectlib.weave(Base, [first, second], subclasses=False):
+        assert Base().meth() == 'second'
+        with aspectlib.weave(Base, second, subclasses=False, duplicates='replace'):
+            assert aspectlib.layers(Base.meth) == (first, second)
+            assert aspectlib.layers(Base().meth) == (first, second)
+        with aspectlib.weave(Base, first, subclasses=False, duplicates='replace'):
+            assert aspectlib.layers(Base.meth) == (second, first)
+            assert Base().meth() == 'first'
+        assert aspectlib.layers(Base.meth) == (first, second)
+    assert aspectlib.layers(Base.meth) == ()
+    assert Base().meth() == 'base'
+
+
+def test_weave_duplicates_static_and_class_methods():
+    aspect = mock('stuff')
+    with aspectlib.weave(NormalTestClass, aspect, methods=['static_foobar', 'class_foobar']):
+        with aspectlib.weave(NormalTestClass, aspect, methods=['static_foobar', 'class_foobar'], duplicates='skip'):
+            assert aspectlib.layers(NormalTestClass.static_foobar) == (aspect,)
+            assert aspectlib.layers(NormalTestClass.class_foobar) == (aspect,)
+
+
+def test_aspect_equality():
+    def advising_function():
+        yield
+
+    assert aspectlib.Aspect(advising_function) == aspectlib.Aspect(advising_function)
+    assert hash(aspectlib.Aspect(advising_function)) == hash(aspectlib.Aspect(advising_function))
+    assert aspectlib.Aspect(advising_function) != aspectlib.Aspect(advising_function, bind=True)
+    assert aspectlib.Aspect(advising_function) != aspectlib.Aspect(lambda: (yield))
+
+
+def test_weaves_registry():
+    aspect = aspectlib.Aspect(lambda *args: (yield))
+    before = aspectlib.weaves()
+    with aspectlib.weave(Base, aspect, threadsafe=True) as rollback:
+        (entry,) = (entry for entry in aspectlib.weaves() if entry not in before)
+        assert entry['targets'] == [
+            {'target': 'test_aspectlib.Base', 'aspects': ['Aspect(test_aspectlib.test_weaves_registry.<locals>.<lambda>)']}
+        ]
+        assert entry['options'] == {'threadsafe': 'True'}
+        assert entry['patched'] == 4  # Base and its subclasses
+        assert entry['duration'] >= 0
+        assert entry['counters'] is None
+        assert isinstance(rollback, aspectlib.Rollback)
+    assert aspectlib.weaves() == before
+
+
+def test_weaves_registry_mapping_and_dump():
+    aspect = aspectlib.Aspect(lambda *args: (yield))
+    name = 'Aspect(test_aspectlib.test_weaves_registry_mapping_and_dump.<locals>.<lambda>)'
+    with aspectlib.weave({module_func: [aspect, mock('foo')], Sub: aspect}):
+        (entry,) = json.loads(aspectlib.dump_weaves())[-1:]
+        assert entry['targets'] == [
+            {'target': 'test_aspectlib.module_func', 'aspects': [name, 'aspectlib.test.mock.<locals>.mock_decorator']},
+            {'target': 'test_aspectlib.Sub', 'aspects': [name]},
+        ]
+        assert entry['patched'] == 2
+        buf = io.StringIO()
+        aspectlib.dump_weaves(buf, indent=2)
+        assert json.loads(buf.getvalue())[-1] == entry
+    assert all(item['id'] != entry['id'] for item in aspectlib.weaves())
+
+
+class LateRepr:
+    def send(self):
+        return 'sent'
+
+    def __repr__(self):
+        return self.late
+
+
+def test_weaves_registry_doesnt_call_repr():
+    obj = LateRepr()
+    with aspectlib.weave(obj, mock('mocked')):
+        assert obj.send() == 'mocked'
+        (entry,) = aspectlib.weaves()[-1:]
+        assert entry['targets'] == [
+            {'target': 'test_aspectlib.LateRepr instance', 'aspects': ['aspectlib.test.mock.<locals>.mock_decorator']}
+        ]
+    assert obj.send() == 'sent'
+    assert type(obj) is LateRepr
+
+
+def test_weaves_registry_failure_rolls_back(monkeypatch):
+    def broken(obj):
+        raise RuntimeError('broken')
+
+    before = aspectlib.weaves()
+    monkeypatch.setattr(aspectlib, '_describe', broken)
+    with pytest.raises(RuntimeError, match='^broken$'):
+        aspectlib.weave(Base, mock('mocked'))
+    assert Base().meth() == 'base'
+    assert aspectlib.weaves() == before
+
+
+def test_weave_counters():
+    class Counted:
+        def ok(self):
+            return 'ok'
+
+        def bad(self):
+            raise ValueError('bad')
+
+        def gen(self):
+            yield 1
+            return 2
+
+    with aspectlib.weave(Counted, aspectlib.Aspect(lambda *args: (yield)), counters=True):
+        obj = Counted()
+        assert obj.ok() == 'ok'
+        assert obj.ok() == 'ok'
+        with pytest.raises(ValueError, match='^bad$'):
+            obj.bad()
+        assert list(obj.gen()) == [1]
+        (entry,) = aspectlib.weaves()[-1:]
+        counters = {counter['name'].rpartition('.')[2]: counter for counter in entry['counters']}
+        assert entry['options'] == {'counters': 'True'}
+        assert entry['targets'][0]['aspects'] == ['Aspect(test_aspectlib.test_weave_counters.<locals>.<lambda>)']
+        assert {name: (counter['calls'], counter['exceptions']) for name, counter in counters.items()} == {
+            'ok': (2, 0),
+            'bad': (1, 1),
+            'gen': (1, 0),
+        }
+        assert all(counter['time'] > 0 for counter in counters.values())
+        assert isinstance(aspectlib.layers(Counted.ok)[-1], aspectlib._Counters)
+    assert Counted().ok() == 'ok'
+
+
+def test_object_bag_forgets_collected_objects():
+    bag = aspectlib.ObjectBag()
+
+    class Thing:
+        pass
+
+    obj = Thing()
+    assert not bag.has(obj)
+    assert bag.has(obj)
+    del obj
+    gc.collect()
+    assert len(bag._objects) == 0
+    unweakrefable = (1, 2)
+    assert not bag.has(unweakrefable)
+    assert bag.has(unweakrefable)
+    assert len(bag._objects) == 1
+
+
+class CheckedConcern(aspectlib.Concern):
+    @aspectlib.Aspect
+    def process(self, data):
+        if not data:
+            raise ValueError('empty')
+        yield
+
+    def other(func):
+        return mock('mocked')(func)
+
+
+class Processor:
+    def process(self, data):
+        return data
+
+    def other(self):
+        return 'other'
+
+    def untouched(self):
+        return 'untouched'
+
+
+class ExistingProcessor(Processor):
+    def process(self, data):
+        return data.upper()
+
+
+def test_concern_table():
+    class MoreConcern(CheckedConcern):
+        def __repr__(self):
+            pass
+
+        def untouched(func):
+            return func
+
+    assert sorted(CheckedConcern.__concern__) == ['other', 'process']
+    assert sorted(MoreConcern.__concern__) == ['other', 'process', 'untouched']
+    assert aspectlib.Concern.__concern__ == {}
+
+
+def test_concern_weave():
+    with aspectlib.weave(Processor, CheckedConcern):
+        assert Processor().process('x') == 'x'
+        with pytest.raises(ValueError, match='^empty$'):
+            Processor().process('')
+        assert Processor().other() == 'mocked'
+        assert Processor().untouched() == 'untouched'
+        with pytest.raises(ValueError, match='^empty$'):
+            ExistingProcessor().process('')
+        assert ExistingProcessor().process('x') == 'X'
+
+        class NewProcessor(Processor):
+            def process(self, data):
+                return data * 2
+
+        class NewerProcessor(NewProcessor):
+            def other(self):
+                return 'newer'
+
+        assert NewProcessor().process('x') == 'xx'
+        with pytest.raises(ValueError, match='^empty$'):
+            NewProcessor().process('')
+        assert NewProcessor().other() == 'mocked'
+        assert NewerProcessor().other() == 'mocked'
+        assert len(aspectlib.layers(NewProcessor.process)) == 1
+        assert len(aspectlib.layers(NewerProcessor.process)) == 1
+        assert len(aspectlib.layers(NewerProcessor.other)) == 1
+
+    assert '__init_subclass__' not in Processor.__dict__
+    assert Processor().process('') == ''
+    assert NewProcessor().process('') == ''
+    assert NewerProcessor().other() == 'newer'
+
+    class LateProcessor(Processor):
+        def process(self, data):
+            return data
+
+    assert LateProcessor().process('') == ''
+
+
+def test_concern_counters():
+    with aspectlib.weave(Processor, CheckedConcern, counters=True):
+        assert Processor().process('x') == 'x'
+        with pytest.raises(ValueError, match='^empty$'):
+            Processor().process('')
+        assert Processor().other() == 'mocked'
+        assert Processor().untouched() == 'untouched'
+
+        class NewProcessor(Processor):
+            def other(self):
+                return 'new'
+
+        assert NewProcessor().other() == 'mocked'
+        (entry,) = aspectlib.weaves()[-1:]
+        assert entry['targets'] == [{'target': 'test_aspectlib.Processor', 'aspects': ['test_aspectlib.CheckedConcern']}]
+        counters = {counter['name']: (counter['calls'], counter['exceptions']) for counter in entry['counters'] if counter['calls']}
+        assert counters == {
+            'test_aspectlib.Processor.process': (2, 1),
+            'test_aspectlib.Processor.other': (1, 0),
+            'test_aspectlib.test_concern_counters.<locals>.NewProcessor.other': (1, 0),
+        }
+    assert Processor().process('') == ''
+
+
+def test_concern_keeps_init_subclass():
+    calls = []
+
+    class Plugin:
+        def __init_subclass__(cls, name=None, **kwargs):
+            super().__init_subclass__(**kwargs)
+            calls.append((cls.__name__, name))
+
+        def process(self, data):
+            return data
+
+    original = Plugin.__dict__['__init_subclass__']
+    with aspectlib.weave(Plugin, CheckedConcern):
+
+        class MyPlugin(Plugin, name='mine'):
+            def process(self, data):
+                return data
+
+        with pytest.raises(ValueError, match='^empty$'):
+            MyPlugin().process('')
+    assert calls == [('MyPlugin', 'mine')]
+    assert Plugin.__dict__['__init_subclass__'] is original
+
+
+def test_concern_bad_targets():
+    pytest.raises(TypeError, aspectlib.weave, module_func, CheckedConcern)
+    pytest.raises(TypeError, aspectlib.weave, Processor, CheckedConcern, lazy=True)
+    assert Processor().process('') == ''
+
+
+def marked(func):
+    func.marked = True
+    return func
+
+
+class PointcutBase:
+    def inherited(self):
+        pass
+
+    async def inherited_async(self):
+        pass
+
+    def overridden(self):
+        pass
+
+
+class PointcutTarget(PointcutBase):
+    @marked
+    def own(self):
+        pass
+
+    async def own_async(self):
+        pass
+
+    def own_generator(self):
+        yield
+
+    def overridden(self):
+        pass
+
+    @classmethod
+    @marked
+    def own_classmethod(cls):
+        pass
+
+    imported = staticmethod(module_func)
+
+
+def _pointcut_woven(pointcut, **options):
+    with aspectlib.weave(PointcutTarget, mock('mocked'), methods=pointcut, **options):
+        return sorted(name for name in dir(PointcutTarget) if aspectlib.layers(getattr(PointcutTarget, name)))
+
+
+def test_pointcut():
+    assert _pointcut_woven(aspectlib.Pointcut()) == [
+        'imported',
+        'inherited',
+        'inherited_async',
+        'overridden',
+        'own',
+        'own_async',
+        'own_classmethod',
+        'own_generator',
+    ]
+    assert _pointcut_woven(aspectlib.Pointcut(markers='marked')) == ['own', 'own_classmethod']
+    assert _pointcut_woven(aspectlib.Pointcut(kind='coroutine')) == ['inherited_async', 'own_async']
+    assert _pointcut_woven(aspectlib.Pointcut(kind=['generator', 'coroutine'], inherited=False)) == ['own_async', 'own_generator']
+    assert _pointcut_woven(aspectlib.Pointcut(inherited=True)) == ['inherited', 'inherited_async']
+    assert _pointcut_woven(aspectlib.Pointcut(inherited=True), bases=False) == []
+    assert _pointcut_woven(aspectlib.Pointcut(names=('own', 'imported'), module='test_aspectlib')) == ['imported', 'own']
+    assert _pointcut_woven(aspectlib.Pointcut(module='test_pkg1')) == []
+    assert _pointcut_woven(aspectlib.Pointcut(names='own_.*') & ~aspectlib.Pointcut(kind='function')) == ['own_async', 'own_generator']
+    assert _pointcut_woven(aspectlib.Pointcut(markers='marked') | aspectlib.Pointcut(names=['inherited'])) == [
+        'inherited',
+        'own',
+        'own_classmethod',
+    ]
+    assert _pointcut_woven(~aspectlib.Pointcut(names='(?!own$)')) == ['own']
+    assert not any(aspectlib.layers(getattr(PointcutTarget, name)) for name in dir(PointcutTarget))
+
+
+def test_pointcut_invert_skips_magic_methods():
+    class Target:
+        def __init__(self):
+            pass
+
+        def __repr__(self):
+            return 'Target()'
+
+        def foo(self):
+            pass
+
+        def bar(self):
+            pass
+
+    def woven(pointcut):
+        with aspectlib.weave(Target, mock('mocked'), methods=pointcut):
+            return sorted(name for name in ('__init__', '__repr__', 'foo', 'bar') if aspectlib.layers(getattr(Target, name)))
+
+    inverted = ~aspectlib.Pointcut(names=['foo'])
+    assert woven(inverted) == ['bar']
+    assert woven(~inverted) == ['foo']
+    assert woven(~aspectlib.Pointcut(names=['__init__'])) == ['bar', 'foo']
+    assert woven(~~aspectlib.Pointcut(names=['__init__'])) == ['__init__']
+    assert woven(inverted | aspectlib.Pointcut(names=['__repr__'])) == ['__repr__', 'bar']
+
+
+def test_pointcut_cache():
+    pointcut = aspectlib.Pointcut(markers='marked')
+    assert pointcut.matches(PointcutTarget, 'own', PointcutTarget.own)
+    assert pointcut.matches(PointcutTarget, 'own', PointcutTarget.own)
+    assert pointcut._cache[PointcutTarget] == {('own', False): (PointcutTarget.own, True)}
+    assert not pointcut.matches(PointcutTarget, 'own', PointcutTarget.overridden)
+    with aspectlib.weave(PointcutTarget.own, mock('mocked')):
+        assert pointcut.matches(PointcutTarget, 'own', PointcutTarget.own)
+
+
+def test_pointcut_bad():
+    pytest.raises(TypeError, aspectlib.Pointcut, kind='method')
+    pytest.raises(TypeError, aspectlib.Pointcut, names=123)
+    pytest.raises(TypeError, lambda: aspectlib.Pointcut() & 'foo')
+
+
+def test_weave_class_bases_dont_shadow_attributes():
+    class Shadowing(Base):
+        meth = 'not a method'
+
+    with aspectlib.weave(Shadowing, mock('mocked')):
+        assert Shadowing.meth == 'not a method'
+
+
+def test_weave_mapping_bad_args():
+    pytest.raises(TypeError, aspectlib.weave, {module_func: mock('func')}, mock('stuff'))
+    pytest.raises(aspectlib.ExpectedAdvice, aspectlib.weave, {module_func: mock('func'), module_func2: 'crap'})
+    assert module_func() is None
+
+
+@pytest.fixture
+def lazy_pkg(tmp_path, monkeypatch, request):
+    name = 'lazy_pkg_' + ''.join(char if char.isalnum() else '_' for char in request.node.name)
+    pkg = tmp_path / name
+    pkg.mkdir()
+    (pkg / '__init__.py').write_text('')
+    (pkg / 'mod.py').write_text('def func():\n    return "func"\n\n\nclass Stuff:\n    def meth(self):\n        return "meth"\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield name
+    for module in list(sys.modules):
+        if module.startswith(name):
+            del sys.modules[module]
+
+
+def test_weave_plan(lazy_pkg, tmp_path, monkeypatch):
+    plan = tmp_path / 'plan.json'
+    targets = {f'{lazy_pkg}.mod.func': mock('func-mocked'), f'{lazy_pkg}.mod.Stuff': mock('meth-mocked'), 'test_aspectlib.Sub': mock('sub')}
+    with aspectlib.weave(targets, plan=str(plan)):
+        mod = sys.modules[f'{lazy_pkg}.mod']
+        assert mod.func() == 'func-mocked'
+        assert mod.Stuff().meth() == 'meth-mocked'
+        assert Sub().meth() == 'sub'
+    data = json.loads(plan.read_text())
+    assert sorted(patch[1:] for patch in data['patches']) == [
+        [f'{lazy_pkg}.mod', '', 'func', 'function', 0],
+        [f'{lazy_pkg}.mod', 'Stuff', 'meth', 'method', None],
+        ['test_aspectlib', 'Sub', 'meth', 'inherited', None],
+    ]
+    assert sorted(data['modules']) == [f'{lazy_pkg}.mod', 'test_aspectlib']
+
+    with monkeypatch.context() as context:
+        context.setattr(aspectlib, '_weave', None)
+        with aspectlib.weave(targets, plan=str(plan)):
+            assert mod.func() == 'func-mocked'
+            assert mod.Stuff().meth() == 'meth-mocked'
+            assert Sub().meth() == 'sub'
+            assert Base().meth() == 'base'
+    assert mod.func() == 'func'
+    assert mod.Stuff().meth() == 'meth'
+    assert Sub().meth() == 'base'
+
+    source = tmp_path / lazy_pkg / 'mod.py'
+    source.write_text(source.read_text() + '\n# changed\n')
+    calls = []
+    with aspectlib.weave('aspectlib._weave', record(calls=calls, iscalled=True)):
+        with aspectlib.weave(targets, plan=str(plan)):
+            assert mod.func() == 'func-mocked'
+    assert len(calls) == 3
+    assert json.loads(plan.read_text())['modules'] != data['modules']
+
+
+def test_weave_plan_aliases(tmp_path):
+    plan = str(tmp_path / 'plan.json')
+    for _ in range(2):
+        with aspectlib.weave('test_aspectlib.module_func2', mock('mocked'), plan=plan):
+            assert module_func2() == module_func3() == 'mocked'
+            assert module_func2 is module_func3
+        assert module_func2() is None
+        assert module_func2 is module_func3
+
+
+def test_weave_plan_not_plannable(tmp_path):
+    plan = tmp_path / 'plan.json'
+    with aspectlib.weave('test_aspectlib.Global', mock('mocked'), lazy=True, plan=str(plan)):
+        assert Global().meth() == 'mocked'
+    assert not plan.exists()
+    pytest.raises(TypeError, aspectlib.weave, Global, mock('mocked'), plan=str(plan))
+    pytest.raises(TypeError, aspectlib.weave, 'test_aspectlib.Global', mock('mocked'), plan=str(plan), deferred=True)
+
+
+def test_weave_plan_other_options(tmp_path):
+    plan = tmp_path / 'plan.json'
+    plan.write_text('junk')
+    with aspectlib.weave('test_aspectlib.NormalTestClass', mock('mocked'), plan=str(plan)):
+        assert NormalTestClass().foobar(1) == 'mocked'
+    with aspectlib.weave('test_aspectlib.NormalTestClass', mock('mocked'), methods=['foobar'], plan=str(plan)):
+        assert NormalTestClass().foobar(1) == 'mocked'
+        assert NormalTestClass().class_foobar(1) is None
+    assert json.loads(plan.read_text())['key']['options'] == {'methods': "['foobar']"}
+
+
+def test_weave_plan_concern(tmp_path, monkeypatch):
+    plan = tmp_path / 'plan.json'
+    with aspectlib.weave('test_aspectlib.Processor', CheckedConcern, subclasses=False, plan=str(plan)):
+        assert Processor().other() == 'mocked'
+    assert sorted(patch[3] for patch in json.loads(plan.read_text())['patches']) == ['other', 'process']
+
+    with monkeypatch.context() as context:
+        context.setattr(aspectlib, '_weave', None)
+        with aspectlib.weave('test_aspectlib.Processor', CheckedConcern, subclasses=False, plan=str(plan)):
+            assert Processor().other() == 'mocked'
+            assert Processor().untouched() == 'untouched'
+            with pytest.raises(ValueError, match='empty'):
+                Processor().process('')
+    assert Processor().other() == 'other'
+
+    monkeypatch.setattr(CheckedConcern, '__concern__', types.MappingProxyType({**CheckedConcern.__concern__, 'untouched': mock('added')}))
+    calls = []
+    with aspectlib.weave('aspectlib._weave', record(calls=calls, iscalled=True)):
+        with aspectlib.weave('test_aspectlib.Processor', CheckedConcern, subclasses=False, plan=str(plan)):
+            assert Processor().untouched() == 'added'
+    assert len(calls) == 1
+
+
+def test_weave_plan_pointcut(tmp_path, monkeypatch):
+    plan = tmp_path / 'plan.json'
+    pointcut = aspectlib.Pointcut(names=['foobar']) | aspectlib.Pointcut(kind='generator')
+    with aspectlib.weave('test_aspectlib.NormalTestClass', mock('mocked'), methods=pointcut, plan=str(plan)):
+        assert NormalTestClass().foobar(1) == 'mocked'
+    assert json.loads(plan.read_text())['key']['options'] == {'methods': "(Pointcut(names=['foobar']) | Pointcut(kind='generator'))"}
+
+    with monkeypatch.context() as context:
+        context.setattr(aspectlib, '_weave', None)
+        pointcut = aspectlib.Pointcut(names=['foobar']) | aspectlib.Pointcut(kind='generator')
+        with aspectlib.weave('test_aspectlib.NormalTestClass', mock('mocked'), methods=pointcut, plan=str(plan)):
+            assert NormalTestClass().foobar(1) == 'mocked'
+            assert NormalTestClass().class_foobar(1) is None
+    assert NormalTestClass().foobar(1) is None
+
+
+def test_weave_deferred(lazy_pkg):
+    with aspectlib.weave([f'{lazy_pkg}.mod.func', f'{lazy_pkg}.mod.Stuff'], mock('stuff'), deferred=True):
+        assert lazy_pkg not in sys.modules
+        assert aspectlib._import_hooks in sys.meta_path
+        mod = __import__(f'{lazy_pkg}.mod', fromlist=['mod'])
+        assert aspectlib._import_hooks not in sys.meta_path
+        assert mod.func() == 'stuff'
+        assert mod.Stuff().meth() == 'stuff'
+        assert type(mod.__loader__).__name__ == 'SourceFileLoader'
+        assert mod.__spec__.loader is mod.__loader__
+    assert mod.func() == 'func'
+    assert mod.Stuff().meth() == 'meth'
+
+
+def test_weave_deferred_module(lazy_pkg):
+    with aspectlib.weave(f'{lazy_pkg}.mod', mock('stuff'), deferred=True):
+        mod = __import__(f'{lazy_pkg}.mod', fromlist=['mod'])
+        assert mod.func() == 'stuff'
+    assert mod.func() == 'func'
+
+
+def test_weave_deferred_cancelled(lazy_pkg):
+    rollback = aspectlib.weave(f'{lazy_pkg}.mod.func', mock('stuff'), deferred=True)
+    rollback()
+    assert aspectlib._import_hooks not in sys.meta_path
+    mod = __import__(f'{lazy_pkg}.mod', fromlist=['mod'])
+    assert mod.func() == 'func'
+
+
+def test_weave_deferred_already_imported():
+    from test_pkg1.test_pkg2 import test_mod
+
+    with aspectlib.weave('test_pkg1.test_pkg2.test_mod.target', mock('stuff'), deferred=True):
+        assert aspectlib._import_hooks not in sys.meta_path
+        assert test_mod.target() == 'stuff'
+    assert test_mod.target() is None
+
+
+def test_weave_pattern():
+    from test_pkg1.test_pkg2 import test_mod
+
+    with aspectlib.weave('test_pkg1.*.test_mod:*Stuff.mi?', mock('stuff')):
+        assert test_mod.Stuff().mix() == 'stuff'
+        assert test_mod.Stuff().meth() is None
+        assert 'mix' not in vars(test_mod.ThatLONGStuf)
+        assert test_mod.target() is None
+    assert test_mod.Stuff().mix() == ()
+
+
+def test_weave_pattern_functions():
+    from test_pkg1.test_pkg2 import test_mod
+
+    with aspectlib.weave('test_pkg1.**:t*', mock('stuff')):
+        assert test_mod.target() == 'stuff'
+        assert test_mod.func() is None
+        assert test_mod.ThatLONGStuf.__name__ == 'ThatLONGStuf'
+    assert test_mod.target() is None
+
+
+def test_weave_pattern_deferred(lazy_pkg):
+    with aspectlib.weave(f'{lazy_pkg}.*:Stuff.*', mock('stuff'), deferred=True):
+        assert aspectlib._import_hooks in sys.meta_path
+        mod = __import__(f'{lazy_pkg}.mod', fromlist=['mod'])
+        assert aspectlib._import_hooks in sys.meta_path
+        assert mod.Stuff().meth() == 'stuff'
+        assert mod.func() == 'func'
+    assert aspectlib._import_hooks not in sys.meta_path
+    assert mod.Stuff().meth() == 'meth'
+
+
+@pytest.mark.parametrize('deferred', [False, True])
+def test_weave_pattern_reexported(lazy_pkg, tmp_path, deferred):
+    (tmp_path / lazy_pkg / 'a.py').write_text('class FooHandler:\n    def handle_get(self):\n        return "get"\n')
+    (tmp_path / lazy_pkg / 'b.py').write_text('from .a import FooHandler\n')
+    calls = []
+
+    @aspectlib.Aspect
+    def aspect(*args):
+        calls.append(args)
+        yield
+
+    if not deferred:
+        __import__(f'{lazy_pkg}.a')
+        __import__(f'{lazy_pkg}.b')
+    with aspectlib.weave(f'{lazy_pkg}.*:*Handler.handle_*', aspect, deferred=deferred):
+        a = __import__(f'{lazy_pkg}.a', fromlist=['a'])
+        __import__(f'{lazy_pkg}.b')
+        assert a.FooHandler().handle_get() == 'get'
+        assert len(calls) == 1
+        assert aspectlib.layers(a.FooHandler.handle_get) == (aspect,)
+    assert aspectlib.layers(a.FooHandler.handle_get) == ()
+
+
+def test_weave_pattern_bad_args():
+    pytest.raises(SyntaxError, aspectlib.weave, 'test_pkg1.*:a-b', mock('stuff'))
+    pytest.raises(TypeError, aspectlib.weave, 'test_pkg1.*:Stuff', mock('stuff'), methods=['meth'])
+
+
+def test_weave_pattern_modules():
+    from test_pkg1.test_pkg2 import test_mod
+
+    with aspectlib.weave('test_pkg1.*.test_m?d:', mock('stuff')):
+        assert test_mod.target() == 'stuff'
+        assert test_mod.Stuff().meth() == 'stuff'
+    assert test_mod.target() is None
+    assert test_mod.Stuff().meth() is None
+    with pytest.raises(SyntaxError, match='must have a colon'):
+        aspectlib.weave('test_pkg1.*.test_m?d', mock('stuff'))
+
+
 def test_weave_method():
     calls = []
     intercepted = []
@@ -1503,3 +2553,894 @@ def test_weave_debug_log():
 
     with aspectlib.weave(log, retry):
         pass
+
+
+def test_hooks():
+    calls = []
+
+    hooks = aspectlib.Hooks(
+        before=lambda *args, **kwargs: calls.append(('before', args, kwargs)),
+        after_returning=lambda result, *args, **kwargs: calls.append(('after_returning', result, args, kwargs)),
+        after_raising=lambda exc, *args, **kwargs: calls.append(('after_raising', type(exc), args, kwargs)),
+    )
+
+    @hooks
+    def func(a, b=None):
+        if b is None:
+            raise RuntimeError
+        return a + b
+
+    assert func(1, b=2) == 3
+    pytest.raises(RuntimeError, func, 1)
+    assert calls == [
+        ('before', (1,), {'b': 2}),
+        ('after_returning', 3, (1,), {'b': 2}),
+        ('before', (1,), {}),
+        ('after_raising', RuntimeError, (1,), {}),
+    ]
+
+
+def test_hooks_bind():
+    calls = []
+
+    @aspectlib.Hooks(bind=True, before=lambda cutpoint, *args: calls.append((cutpoint.__name__, args)))
+    def func(arg):
+        return arg
+
+    assert func(1) == 1
+    assert calls == [('func', (1,))]
+
+
+def test_hooks_around():
+    calls = []
+
+    def around(cutpoint, *args, **kwargs):
+        calls.append('around')
+        return cutpoint(*args, **kwargs) * 2
+
+    @aspectlib.Hooks(around=around, after_returning=lambda result, *args: calls.append(result))
+    def func(arg):
+        return arg
+
+    assert func(2) == 4
+    assert calls == ['around', 4]
+
+
+def test_hooks_subclass():
+    calls = []
+
+    class Counter(aspectlib.Hooks):
+        def before(self, *args):
+            calls.append(args)
+
+    @Counter()
+    def func(arg):
+        return arg
+
+    assert func(1) == 1
+    assert calls == [(1,)]
+
+
+def test_hooks_on_generator():
+    calls = []
+
+    @aspectlib.Hooks(
+        before=lambda: calls.append('before'),
+        after_returning=lambda result: calls.append(result),
+        after_raising=lambda exc: calls.append(exc),
+    )
+    def func():
+        yield 1
+        yield 2
+        return 'done'
+
+    gen = func()
+    assert calls == []
+    assert list(gen) == [1, 2]
+    assert calls == ['before', 'done']
+
+
+def test_weave_hooks():
+    calls = []
+    hooks = aspectlib.Hooks(before=lambda *args: calls.append(args[1:]))
+
+    with aspectlib.weave(NormalTestClass, hooks, methods=['foobar']):
+        inst = NormalTestClass()
+        inst.foobar('x')
+        assert calls == [(None,), ('x',)]
+
+    inst.foobar('y')
+    assert calls == [(None,), ('x',)]
+
+
+@pytest.mark.skipif(bool(DEBUG), reason='Wrappers are instrumented in debug mode.')
+@pytest.mark.skipif(bool(DEBUG), reason='Wrappers are instrumented in debug mode.')
+def test_aspect_wrapper_no_logging():
+    @aspectlib.Aspect
+    def aspect(*args):
+        yield aspectlib.Proceed
+
+    def gen():
+        yield 1
+
+    async def coro():
+        pass
+
+    for func, name in [
+        (module_func, 'advising_function_wrapper'),
+        (Base.meth, 'advising_function_wrapper'),
+        (gen, 'advising_generator_wrapper_py35'),
+        (coro, 'advising_asyncgenerator_wrapper_py35'),
+    ]:
+        wrapper = aspect(func)
+        assert wrapper.__code__.co_name == name
+        assert 'logdebug' not in wrapper.__code__.co_names
+        assert 'logdebug' not in wrapper.__code__.co_freevars
+
+
+@pytest.mark.skipif(bool(DEBUG), reason='Wrappers are instrumented in debug mode.')
+def test_aspect_debug_variant(monkeypatch):
+    monkeypatch.setattr(aspectlib, 'DEBUG', True)
+    monkeypatch.setattr(aspectlib.utils, 'DEBUG', True)
+    hist = []
+    handler = type('Handler', (logging.Handler,), {'emit': lambda self, record: hist.append(record.getMessage())})()
+    aspectlib.logger.addHandler(handler)
+    aspectlib.logger.setLevel(logging.DEBUG)
+
+    @aspectlib.Aspect
+    def aspect():
+        try:
+            yield aspectlib.Proceed
+        except ZeroDivisionError:
+            hist.append('error')
+        yield aspectlib.Return('stuff')
+
+    @aspect
+    def func():
+        1 / 0  # noqa: B018
+
+    try:
+        assert func() == 'stuff'
+    finally:
+        aspectlib.logger.removeHandler(handler)
+        aspectlib.logger.setLevel(logging.NOTSET)
+    assert hist[0].startswith("Got advice <class 'aspectlib.Proceed'> from <function test_aspect_debug_variant.<locals>.aspect")
+    assert hist[1] == 'error'
+    assert hist[2].startswith('Got advice <aspectlib.Return object')
+
+
+def _make_chain_aspects(hist):
+    @aspectlib.Aspect
+    def add_one(arg):
+        hist.append(('add_one', arg))
+        result = yield aspectlib.Proceed(arg + 1)
+        hist.append(('add_one', 'result', result))
+
+    @aspectlib.Aspect
+    def squelch(arg):
+        try:
+            yield
+        except ValueError as exc:
+            hist.append(('squelch', repr(exc)))
+            yield aspectlib.Return('squelched')
+
+    @aspectlib.Aspect
+    def twice(arg):
+        first = yield
+        second = yield aspectlib.Proceed(arg * 10)
+        hist.append(('twice', first, second))
+        yield aspectlib.Return((first, second))
+
+    @aspectlib.Aspect
+    def short(arg):
+        if arg == 'short':
+            yield aspectlib.Return('short-circuit')
+        yield
+
+    @aspectlib.Aspect(bind=True)
+    def bound(cutpoint, arg):
+        hist.append(('bound', cutpoint.__name__))
+        yield
+
+    return add_one, squelch, twice, short, bound
+
+
+@pytest.mark.parametrize(
+    'order',
+    [
+        (0, 1),
+        (1, 0),
+        (0, 2, 1),
+        (2, 0, 1, 4),
+        (3, 0),
+        (4, 2, 3),
+        (1, 2, 0, 4, 3),
+        (1, 3, 4),
+    ],
+)
+@pytest.mark.parametrize('arg', [1, 2, 5, 'short'])
+def test_aspect_chain_like_nested(order, arg):
+    def run(chained):
+        hist = []
+        aspects = [_make_chain_aspects(hist)[i] for i in order]
+
+        def func(arg):
+            hist.append(('func', arg))
+            if arg in (2, 20):
+                raise ValueError(arg)
+            return arg
+
+        if chained:
+            wrapper = aspectlib.AspectChain(aspects)(func)
+        else:
+            wrapper = func
+            for aspect in reversed(aspects):
+                wrapper = aspect(wrapper)
+        try:
+            result = wrapper(arg)
+        except Exception as exc:
+            result = repr(exc)
+        return result, hist
+
+    assert run(True) == run(False)
+
+
+def test_aspect_chain_generator():
+    hist = []
+
+    @aspectlib.Aspect
+    def outer(arg):
+        result = yield aspectlib.Proceed(arg + 1)
+        hist.append(('outer', result))
+
+    @aspectlib.Aspect
+    def inner(arg):
+        try:
+            result = yield
+        except RuntimeError:
+            hist.append('inner-error')
+            raise
+        hist.append(('inner', result))
+        yield aspectlib.Return(result * 2)
+
+    @aspectlib.AspectChain([outer, inner])
+    def func(arg):
+        yield arg
+        yield arg + 1
+        return arg
+
+    assert list(func(1)) == [2, 3]
+    assert hist == [('inner', 2), ('outer', 4)]
+
+    gen = func(1)
+    next(gen)
+    pytest.raises(RuntimeError, gen.throw, RuntimeError)
+    assert hist[2:] == ['inner-error']
+
+
+def test_aspect_chain_invalid():
+    pytest.raises(aspectlib.ExpectedAdvice, aspectlib.AspectChain, [mock('foo')])
+
+
+def test_weave_aspects_fused():
+    @aspectlib.Aspect
+    def aspect():
+        yield
+
+    def func():
+        return sys._getframe(1).f_code.co_name, sys._getframe(2).f_code.co_name
+
+    wrapper = aspectlib._checked_apply([aspect, aspect, aspect], func)
+    assert wrapper.__code__.co_name == 'advising_chain_function_wrapper'
+    assert wrapper() == ('advising_chain_function_wrapper', 'test_weave_aspects_fused')
+
+    with aspectlib.weave(module_func, [aspect, aspect, record]):
+        assert module_func.calls == []
+        assert module_func() is None
+        assert module_func.calls == [(None, (), {})]
+
+
+def test_aspect_specialize_signature():
+    calls = []
+
+    @aspectlib.Aspect(specialize=True)
+    def aspect(*args, **kwargs):
+        calls.append((args, kwargs))
+        yield
+
+    def func(a, b: int = 2, /, c=3, *args, d, e=5, **kwargs) -> tuple:
+        return a, b, c, args, d, e, kwargs
+
+    wrapper = aspect(func)
+    assert wrapper.__name__ == 'func'
+    assert str(inspect.signature(wrapper, follow_wrapped=False)) == str(inspect.signature(func))
+    assert wrapper(1, d=4) == (1, 2, 3, (), 4, 5, {})
+    assert wrapper(1, 6, 7, 8, d=4, f=9) == (1, 6, 7, (8,), 4, 5, {'f': 9})
+    assert calls == [
+        ((1, 2, 3), {'d': 4, 'e': 5}),
+        ((1, 6, 7, 8), {'d': 4, 'e': 5, 'f': 9}),
+    ]
+    pytest.raises(TypeError, wrapper, 1)
+    assert calls == [
+        ((1, 2, 3), {'d': 4, 'e': 5}),
+        ((1, 6, 7, 8), {'d': 4, 'e': 5, 'f': 9}),
+    ]
+
+
+def test_aspect_specialize_advices():
+    @aspectlib.Aspect(bind=True, specialize=True)
+    def aspect(cutpoint, a, b):
+        assert cutpoint.__name__ == 'func'
+        try:
+            yield aspectlib.Proceed(a, b=-1)
+        except ValueError:
+            result = yield aspectlib.Proceed(a, b)
+            yield aspectlib.Return(('retried', result))
+        yield aspectlib.Return('unexpected')
+
+    def func(a, b):
+        if b < 0:
+            raise ValueError(b)
+        return a + b
+
+    wrapper = aspect(func)
+    assert wrapper(1, b=2) == ('retried', 3)
+
+    @aspectlib.Aspect(specialize=True)
+    def bad():
+        yield 'crap'
+
+    pytest.raises(aspectlib.UnacceptableAdvice, bad(lambda: None))
+
+
+def test_aspect_specialize_generator():
+    @aspectlib.Aspect(specialize=True)
+    def aspect(n):
+        result = yield aspectlib.Proceed(n + 1)
+        yield aspectlib.Return(result * 10)
+
+    def gen(n):
+        yield from range(n)
+        return n
+
+    wrapper = aspect(gen)
+    assert inspect.isgeneratorfunction(wrapper)
+    assert str(inspect.signature(wrapper)) == '(n)'
+    items = []
+
+    def consume():
+        items.append((yield from wrapper(1)))
+
+    assert list(consume()) == [0, 1]
+    assert items == [20]
+
+
+def test_aspect_specialize_cached():
+    @aspectlib.Aspect(specialize=True)
+    def aspect(*args, **kwargs):
+        yield
+
+    def func1(a, b=1):
+        return a, b
+
+    def func2(x, y=2):
+        return x, y
+
+    def func3(a, b=1, *, c):
+        return a, b, c
+
+    assert aspect(func1).__code__ is not aspect(func3).__code__
+    assert aspect(func1).__code__.co_varnames[:2] == ('a', 'b')
+    assert aspect(func1).__code__ is aspect(func1).__code__
+    assert aspect(func2)(1) == (1, 2)
+
+
+def test_aspect_specialize_builtin_names():
+    @aspectlib.Aspect(specialize=True)
+    def aspect(*args, **kwargs):
+        result = yield aspectlib.Proceed
+        yield aspectlib.Return((args, result))
+
+    def page(cursor, next=None, isinstance=None):
+        return cursor, next, isinstance
+
+    wrapper = aspect(page)
+    assert wrapper.__code__.co_name == 'advising_specialized_wrapper'
+    assert str(inspect.signature(wrapper, follow_wrapped=False)) == '(cursor, next=None, isinstance=None)'
+    assert wrapper('a', next='b') == (('a', 'b', None), ('a', 'b', None))
+    assert wrapper('a', isinstance='c') == (('a', None, 'c'), ('a', None, 'c'))
+
+
+def test_aspect_specialize_fallback():
+    @aspectlib.Aspect(specialize=True)
+    def aspect(*args, **kwargs):
+        yield
+
+    wrapper = aspect(getattr)
+    assert wrapper.__code__.co_name == 'advising_function_wrapper'
+    assert wrapper(1, 'real') == 1
+
+
+def test_weave_class_specialize():
+    calls = []
+
+    @aspectlib.Aspect(specialize=True)
+    def aspect(self, a, b=2):
+        calls.append((a, b))
+        yield
+
+    class Klass:
+        def meth(self, a, b=2):
+            return a + b
+
+    with aspectlib.weave(Klass, aspect, methods=['meth']):
+        assert str(inspect.signature(Klass.meth)) == '(self, a, b=2)'
+        assert [Klass().meth(i) for i in range(3)] == [2, 3, 4]
+    assert calls == [(0, 2), (1, 2), (2, 2)]
+
+
+def test_items_on_generator():
+    calls = []
+
+    @aspectlib.Aspect
+    def aspect(n):
+        result = yield aspectlib.Items(lambda item: calls.append(('seen', item)), aspectlib.Proceed(n + 1))
+        calls.append(('result', result))
+
+    @aspect
+    def gen(n):
+        for i in range(n):
+            calls.append(('produce', i))
+            yield i
+        return n
+
+    items = []
+    for item in gen(1):
+        items.append(item)
+        calls.append(('consume', item))
+    assert items == [0, 1]
+    assert calls == [
+        ('produce', 0),
+        ('seen', 0),
+        ('consume', 0),
+        ('produce', 1),
+        ('seen', 1),
+        ('consume', 1),
+        ('result', 2),
+    ]
+
+
+def test_items_stride_batch():
+    seen = []
+
+    @aspectlib.Aspect
+    def strided(n):
+        yield aspectlib.Items(seen.append, stride=3)
+
+    @aspectlib.Aspect
+    def batched(n):
+        yield aspectlib.Items(seen.append, stride=2, batch=2)
+
+    def gen(n):
+        yield from range(n)
+
+    assert list(strided(gen)(8)) == list(range(8))
+    assert seen == [0, 3, 6]
+    del seen[:]
+    assert list(batched(gen)(7)) == list(range(7))
+    assert seen == [[0, 2], [4, 6]]
+    del seen[:]
+    assert list(batched(gen)(5)) == list(range(5))
+    assert seen == [[0, 2], [4]]
+
+    with pytest.raises(ValueError, match='stride must be a positive integer'):
+        aspectlib.Items(seen.append, stride=0)
+    with pytest.raises(ValueError, match='batch must be a positive integer'):
+        aspectlib.Items(seen.append, batch=0)
+
+
+def test_items_forwarding():
+    seen = []
+
+    @aspectlib.Aspect
+    def aspect():
+        try:
+            yield aspectlib.Items(seen.append, batch=10)
+        except GeneratorExit:
+            seen.append('closed')
+            raise
+
+    @aspect
+    def echo():
+        value = 'start'
+        while True:
+            try:
+                value = yield value
+            except KeyError as exc:
+                value = f'caught {exc.args[0]}'
+
+    gen = echo()
+    assert next(gen) == 'start'
+    assert gen.send('x') == 'x'
+    assert gen.throw(KeyError('y')) == 'caught y'
+    gen.close()
+    assert seen == [['start', 'x', 'caught y'], 'closed']
+
+
+def test_items_on_function():
+    @aspectlib.Aspect
+    def aspect():
+        yield aspectlib.Items(print)
+
+    pytest.raises(aspectlib.UnacceptableAdvice, aspect(lambda: None))
+    pytest.raises(aspectlib.UnacceptableAdvice, aspectlib.AspectChain([aspect, aspect])(lambda: None))
+
+
+def test_items_specialized():
+    seen = []
+
+    @aspectlib.Aspect(specialize=True)
+    def aspect(n):
+        yield aspectlib.Items(seen.append, aspectlib.Proceed(n + 1), batch=2)
+
+    @aspect
+    def gen(n):
+        yield from range(n)
+
+    assert list(gen(2)) == [0, 1, 2]
+    assert seen == [[0, 1], [2]]
+
+
+def _make_items_aspects(hist):
+    @aspectlib.Aspect
+    def observe(n):
+        result = yield aspectlib.Items(lambda item: hist.append(('observe', item)))
+        hist.append(('observe', 'result', result))
+
+    @aspectlib.Aspect
+    def batches(n):
+        yield aspectlib.Items(lambda batch: hist.append(('batches', batch)), aspectlib.Proceed(n + 1), batch=2)
+
+    @aspectlib.Aspect
+    def twice(n):
+        yield
+        result = yield aspectlib.Items(lambda item: hist.append(('twice', item)), stride=2)
+        yield aspectlib.Return(result)
+
+    @aspectlib.Aspect
+    def plain(n):
+        hist.append(('plain', n))
+        yield
+
+    return observe, batches, twice, plain
+
+
+@pytest.mark.parametrize('order', [(0, 1), (1, 0), (0, 2, 1), (2, 0, 3), (3, 1, 2, 0)])
+def test_items_chain_like_nested(order):
+    def run(chained):
+        hist = []
+        aspects = [_make_items_aspects(hist)[i] for i in order]
+
+        def gen(n):
+            for i in range(n):
+                hist.append(('produce', i))
+                yield i
+            return n
+
+        if chained:
+            wrapper = aspectlib.AspectChain(aspects)(gen)
+        else:
+            wrapper = gen
+            for aspect in reversed(aspects):
+                wrapper = aspect(wrapper)
+        return list(wrapper(2)), hist
+
+    assert run(True) == run(False)
+
+
+def test_proceed_in_executor():
+    calls = []
+
+    with ThreadPoolExecutor(1, thread_name_prefix='worker') as executor:
+
+        @aspectlib.Aspect
+        def aspect(arg):
+            try:
+                result = yield aspectlib.ProceedIn(executor, aspectlib.Proceed(arg + 1))
+            except ValueError as exc:
+                calls.append(('error', exc.args, threading.current_thread().name))
+                yield aspectlib.Return('failed')
+            calls.append(('result', result, threading.current_thread().name))
+
+        @aspect
+        def func(arg):
+            calls.append(('func', arg, threading.current_thread().name[:6]))
+            if arg > 5:
+                raise ValueError(arg)
+            return arg
+
+        main = threading.current_thread().name
+        assert func(1) == 2
+        assert func(5) == 'failed'
+        assert calls == [
+            ('func', 2, 'worker'),
+            ('result', 2, main),
+            ('func', 6, 'worker'),
+            ('error', (6,), main),
+        ]
+
+        @aspectlib.Aspect
+        def bad(arg):
+            yield aspectlib.ProceedIn(executor)
+
+        def gen(arg):
+            yield arg
+
+        pytest.raises(aspectlib.UnacceptableAdvice, list, bad(gen)(1))
+
+
+def test_proceed_in_process_pool():
+    with ProcessPoolExecutor(1) as executor:
+
+        @aspectlib.Aspect
+        def aspect(arg):
+            result, pid = yield aspectlib.ProceedIn(executor, aspectlib.Proceed(arg + 1))
+            assert pid != os.getpid()
+            yield aspectlib.Return(result)
+
+        @aspectlib.Aspect
+        def fanout(arg):
+            results = yield aspectlib.ProceedAll([aspectlib.Proceed, aspectlib.Proceed(arg + 1)], executor)
+            yield aspectlib.Return([result for result, _ in results])
+
+        with aspectlib.weave(module_square, aspect):
+            assert module_square(2) == 9
+        with aspectlib.weave(module_square, fanout):
+            assert module_square(2) == [4, 9]
+        with aspectlib.weave('test_aspectlib.module_square', aspect):
+            assert module_square(2) == 9
+        assert module_square(2) == (4, os.getpid())
+
+
+def test_proceed_in_process_pool_decorated(monkeypatch):
+    with ProcessPoolExecutor(1) as executor:
+
+        @aspectlib.Aspect
+        def aspect(arg):
+            yield aspectlib.ProceedIn(executor)
+
+        decorated = aspect(module_square)
+        monkeypatch.setattr(sys.modules[__name__], 'module_square', decorated)  # like a @aspect decorator would
+        with pytest.raises(aspectlib.UnacceptableAdvice, match='is not that function or a weave of it'):
+            decorated(2)
+        with pytest.raises(aspectlib.UnacceptableAdvice, match='is not that function or a weave of it'):
+            aspect(lambda arg: arg)(2)
+
+
+def test_proceed_in_executor_specialized():
+    with ThreadPoolExecutor(1, thread_name_prefix='worker') as executor:
+
+        @aspectlib.Aspect(specialize=True)
+        def aspect(arg):
+            yield aspectlib.ProceedIn(executor)
+
+        @aspect
+        def func(arg):
+            return arg, threading.current_thread().name[:6]
+
+        assert func(1) == (1, 'worker')
+
+
+def test_proceed_in_executor_chain_like_nested():
+    def run(chained):
+        hist = []
+
+        @aspectlib.Aspect
+        def outer(arg):
+            result = yield aspectlib.ProceedIn(executor, aspectlib.Proceed(arg + 1))
+            hist.append(('outer', result, threading.current_thread().name[:6]))
+
+        @aspectlib.Aspect
+        def inner(arg):
+            hist.append(('inner', arg, threading.current_thread().name[:6]))
+            result = yield
+            yield aspectlib.Return(result * 10)
+
+        def func(arg):
+            hist.append(('func', arg, threading.current_thread().name[:6]))
+            return arg
+
+        if chained:
+            wrapper = aspectlib.AspectChain([outer, inner])(func)
+        else:
+            wrapper = outer(inner(func))
+        return wrapper(1), hist
+
+    with ThreadPoolExecutor(1, thread_name_prefix='worker') as executor:
+        assert (
+            run(True)
+            == run(False)
+            == (
+                20,
+                [('inner', 2, 'worker'), ('func', 2, 'worker'), ('outer', 20, 'MainTh')],
+            )
+        )
+
+
+def test_proceed_all():
+    barrier = threading.Barrier(3, timeout=5)
+
+    @aspectlib.Aspect
+    def chunked(items):
+        results = yield aspectlib.ProceedAll([aspectlib.Proceed(items[:2]), aspectlib.Proceed(items[2:4]), aspectlib.Proceed(items[4:])])
+        yield aspectlib.Return([result for chunk in results for result in chunk])
+
+    @chunked
+    def lookup(items):
+        barrier.wait()
+        return [item * 10 for item in items]
+
+    assert lookup([1, 2, 3, 4, 5]) == [10, 20, 30, 40, 50]
+
+
+def test_proceed_all_errors():
+    seen = []
+
+    with ThreadPoolExecutor(8) as executor:
+
+        @aspectlib.Aspect
+        def aspect(arg):
+            try:
+                yield aspectlib.ProceedAll([aspectlib.Proceed, aspectlib.Proceed(-1), aspectlib.Proceed(-2)], executor)
+            except ValueError as exc:
+                seen.append(exc.args)
+                yield aspectlib.Return('failed')
+
+        @aspect
+        def func(arg):
+            if arg < 0:
+                raise ValueError(arg)
+            return arg
+
+        assert func(1) == 'failed'
+        assert seen == [(-1,)]
+        pytest.raises(aspectlib.ExpectedAdvice, aspectlib.ProceedAll, [1])
+
+        @aspectlib.Aspect(specialize=True)
+        def specialized(arg):
+            yield aspectlib.ProceedAll([aspectlib.Proceed, aspectlib.Proceed(arg + 1)], executor)
+
+        assert specialized(lambda arg: arg)(1) == [1, 2]
+        chained = aspectlib.AspectChain([specialized, aspect])(lambda arg: arg)
+        nested = specialized(aspect(lambda arg: arg))
+        assert chained(1) == nested(1) == [[1, -1, -2], [2, -1, -2]]
+
+
+def test_aspect_inlined():
+    calls = []
+
+    @aspectlib.Aspect
+    def aspect(*args, **kwargs):
+        calls.append(('before', args, kwargs))
+        result = yield
+        calls.append(('after', result))
+        result = 'ignored'
+
+    @aspect
+    def func(a, b=2):
+        if a < 0:
+            raise ValueError(a)
+        return a + b
+
+    assert func.__code__.co_name == ('advising_function_wrapper' if DEBUG else 'advising_inlined_function_wrapper')
+    assert func.__name__ == 'func'
+    assert func(1, b=3) == 4
+    with pytest.raises(ValueError, match='^-1$'):
+        func(-1)
+    assert calls == [('before', (1,), {'b': 3}), ('after', 4), ('before', (-1,), {})]
+
+
+def test_aspect_inlined_closure():
+    calls = []
+    counter = 0
+
+    @aspectlib.Aspect(bind=True)
+    def aspect(cutpoint, a, *, scale=10):
+        nonlocal counter
+        counter += 1
+        yield
+        calls.append((cutpoint.__name__, a, scale, counter))
+
+    @aspect
+    def func(a, *, scale=10):
+        return a * scale
+
+    assert func.__code__.co_name == ('advising_function_wrapper' if DEBUG else 'advising_inlined_function_wrapper')
+    assert func(1) == 10
+    assert func(2, scale=3) == 6
+    assert counter == 2
+    assert calls == [('func', 1, 10, 1), ('func', 2, 3, 2)]
+
+
+def test_aspect_inlined_generator():
+    calls = []
+
+    @aspectlib.Aspect
+    def aspect(n):
+        result = yield
+        calls.append(result)
+
+    @aspect
+    def gen(n):
+        yield from range(n)
+        return n
+
+    assert gen.__code__.co_name == ('advising_generator_wrapper_py35' if DEBUG else 'advising_inlined_generator_wrapper')
+    assert list(gen(3)) == [0, 1, 2]
+    assert calls == [3]
+
+
+def test_aspect_inlined_traceback():
+    @aspectlib.Aspect
+    def aspect():
+        yield
+        raise RuntimeError('after')
+
+    wrapper = aspect(lambda: None)
+    assert wrapper.__code__.co_name == ('advising_function_wrapper' if DEBUG else 'advising_inlined_function_wrapper')
+    with pytest.raises(RuntimeError) as excinfo:
+        wrapper()
+    assert excinfo.traceback[-1].frame.code.raw.co_filename == __file__
+    assert excinfo.traceback[-1].lineno + 1 == aspect.advising_function.__code__.co_firstlineno + 3
+
+
+def _not_inlined_loop():
+    for _ in range(1):
+        yield
+
+
+def _not_inlined_try():
+    try:
+        yield
+    finally:
+        pass
+
+
+def _not_inlined_twice():
+    yield
+    yield
+
+
+def _not_inlined_return(*args):
+    if args:
+        return
+    yield
+
+
+def _not_inlined_advice():
+    yield aspectlib.Proceed
+
+
+def _not_inlined_nested_target():
+    result = {}
+    result['value'] = yield
+
+
+@pytest.mark.parametrize(
+    'advising_function',
+    [_not_inlined_loop, _not_inlined_try, _not_inlined_twice, _not_inlined_return, _not_inlined_advice, _not_inlined_nested_target],
+)
+def test_aspect_not_inlined(advising_function):
+    wrapper = aspectlib.Aspect(advising_function)(lambda: 'result')
+    assert wrapper.__code__.co_name == 'advising_function_wrapper'
+    assert wrapper() == 'result'
+
+
+def test_aspect_not_inlined_stale_source(monkeypatch):
+    def advising_function():
+        yield
+
+    monkeypatch.setattr(aspectlib, 'getsource', lambda _: 'def advising_function():\n    print()\n    yield\n')
+    wrapper = aspectlib.Aspect(advising_function)(lambda: 'result')
+    assert wrapper.__code__.co_name == 'advising_function_wrapper'
+    assert wrapper() == 'result'
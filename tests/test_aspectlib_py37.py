@@ -1,9 +1,23 @@
+import asyncio
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
 import aspectlib
+from aspectlib.utils import DEBUG
 from test_aspectlib_py3 import consume
 
 
+async def module_coro(arg):
+    await asyncio.sleep(0)
+    return arg, os.getpid()
+
+
 def test_aspect_on_generator_result():
     result = []
 
@@ -152,3 +166,452 @@ def test_aspect_chain_on_generator_no_return():
 
     gen = func(0)
     assert consume(gen) is None
+
+
+def test_hooks_on_coroutine():
+    calls = []
+
+    @aspectlib.Hooks(before=lambda arg: calls.append(('before', arg)), after_returning=lambda result, arg: calls.append(result))
+    async def func(arg):
+        await asyncio.sleep(0)
+        return arg * 2
+
+    assert asyncio.run(func(2)) == 4
+    assert calls == [('before', 2), 4]
+
+
+def test_aspect_chain_on_coroutine():
+    @aspectlib.Aspect
+    def outer(arg):
+        result = yield aspectlib.Proceed(arg + 1)
+        yield aspectlib.Return(result * 2)
+
+    @aspectlib.Aspect(bind=True)
+    def inner(cutpoint, arg):
+        assert cutpoint.__name__ == 'func'
+        yield aspectlib.Proceed(arg * 10)
+
+    @aspectlib.AspectChain([outer, inner])
+    async def func(arg):
+        await asyncio.sleep(0)
+        return arg
+
+    assert asyncio.run(func(1)) == 40
+
+
+def test_aspect_specialize_on_coroutine():
+    @aspectlib.Aspect(specialize=True)
+    def aspect(arg, *, scale=1):
+        result = yield aspectlib.Proceed(arg + 1, scale=scale)
+        yield aspectlib.Return(result * 2)
+
+    @aspect
+    async def func(arg, *, scale=1):
+        await asyncio.sleep(0)
+        return arg * scale
+
+    assert inspect.iscoroutinefunction(func)
+    assert str(inspect.signature(func)) == '(arg, *, scale=1)'
+    assert asyncio.run(func(1, scale=3)) == 12
+
+
+def test_aspect_async_advice():
+    calls = []
+
+    @aspectlib.Aspect
+    async def aspect(arg):
+        await asyncio.sleep(0)
+        calls.append(('before', arg))
+        try:
+            result = yield aspectlib.Proceed(arg + 1)
+        except ValueError as exc:
+            await asyncio.sleep(0)
+            calls.append(('error', exc.args))
+            yield aspectlib.Return('failed')
+        await asyncio.sleep(0)
+        calls.append(('after', result))
+        yield aspectlib.Return(result * 10)
+
+    @aspect
+    async def func(arg):
+        await asyncio.sleep(0)
+        if arg > 5:
+            raise ValueError(arg)
+        return arg
+
+    assert inspect.iscoroutinefunction(func)
+    assert asyncio.run(func(1)) == 20
+    assert asyncio.run(func(5)) == 'failed'
+    assert calls == [('before', 1), ('after', 2), ('before', 5), ('error', (6,))]
+
+
+def test_aspect_async_advice_bind():
+    @aspectlib.Aspect(bind=True)
+    async def aspect(cutpoint, arg):
+        assert cutpoint.__name__ == 'func'
+        yield
+
+    @aspect
+    async def func(arg):
+        return arg
+
+    assert asyncio.run(func(1)) == 1
+
+
+def test_aspect_async_advice_not_coroutine():
+    @aspectlib.Aspect
+    async def aspect():
+        yield
+
+    def func():
+        pass
+
+    pytest.raises(aspectlib.ExpectedGeneratorFunction, aspect, func)
+
+
+def test_aspect_async_advice_chain():
+    calls = []
+
+    @aspectlib.Aspect
+    async def outer(arg):
+        result = yield aspectlib.Proceed(arg + 1)
+        calls.append(('outer', result))
+
+    @aspectlib.Aspect
+    def inner(arg):
+        result = yield
+        calls.append(('inner', result))
+
+    async def func(arg):
+        return arg
+
+    assert asyncio.run(aspectlib.AspectChain([outer, inner])(func)(1)) == 2
+    assert calls == [('inner', 2), ('outer', 2)]
+
+
+def _collect(agen):
+    async def collect():
+        return [item async for item in agen]
+
+    return asyncio.run(collect())
+
+
+def test_aspect_on_asyncgenerator():
+    calls = []
+
+    @aspectlib.Aspect
+    def aspect(n):
+        calls.append(('start', n))
+        try:
+            yield aspectlib.Items(calls.append, aspectlib.Proceed(n + 1))
+        except ValueError as exc:
+            calls.append(('error', exc.args))
+            raise
+        calls.append('done')
+
+    @aspect
+    async def stream(n):
+        for i in range(n):
+            calls.append(('produce', i))
+            yield i
+        if n > 3:
+            raise ValueError(n)
+
+    assert inspect.isasyncgenfunction(stream)
+    assert _collect(stream(1)) == [0, 1]
+    assert calls == [('start', 1), ('produce', 0), 0, ('produce', 1), 1, 'done']
+    del calls[:]
+    with pytest.raises(ValueError, match='^4$'):
+        _collect(stream(3))
+    assert calls[-1] == ('error', (4,))
+
+
+def test_aspect_on_asyncgenerator_forwarding():
+    calls = []
+
+    @aspectlib.Aspect
+    def aspect():
+        try:
+            yield
+        except GeneratorExit:
+            calls.append('closed')
+            raise
+
+    @aspect
+    async def echo():
+        value = 'start'
+        while True:
+            try:
+                value = yield value
+            except KeyError as exc:
+                value = f'caught {exc.args[0]}'
+
+    async def run():
+        agen = echo()
+        results = [await agen.__anext__(), await agen.asend('x'), await agen.athrow(KeyError('y')), await agen.__anext__()]
+        await agen.aclose()
+        return results
+
+    assert asyncio.run(run()) == ['start', 'x', 'caught y', None]
+    assert calls == ['closed']
+
+
+def test_aspect_on_asyncgenerator_return():
+    @aspectlib.Aspect
+    def retry():
+        yield
+        yield aspectlib.Proceed()
+        yield aspectlib.Return
+
+    @aspectlib.Aspect
+    def bad():
+        yield aspectlib.Return(1)
+
+    @retry
+    async def stream():
+        yield 1
+
+    assert _collect(stream()) == [1, 1]
+    pytest.raises(aspectlib.UnacceptableAdvice, _collect, bad(stream)())
+
+
+def test_hooks_on_asyncgenerator():
+    calls = []
+
+    @aspectlib.Hooks(
+        before=lambda n: calls.append(('before', n)),
+        after_returning=lambda result, n: calls.append(('after', result)),
+        after_raising=lambda exc, n: calls.append(('raised', exc.args)),
+    )
+    async def stream(n):
+        for i in range(n):
+            yield i
+        if n > 1:
+            raise ValueError(n)
+
+    assert _collect(stream(1)) == [0]
+    with pytest.raises(ValueError, match='^2$'):
+        _collect(stream(2))
+    assert calls == [('before', 1), ('after', None), ('before', 2), ('raised', (2,))]
+
+
+def test_items_stride_batch_on_asyncgenerator():
+    seen = []
+
+    @aspectlib.Aspect
+    def aspect(n):
+        yield aspectlib.Items(seen.append, stride=2, batch=2)
+
+    @aspect
+    async def stream(n):
+        for i in range(n):
+            yield i
+
+    assert _collect(stream(7)) == list(range(7))
+    assert seen == [[0, 2], [4, 6]]
+
+
+def test_proceed_in_executor_on_coroutine():
+    main = threading.get_ident()
+
+    async def raw(arg):
+        await asyncio.sleep(0)
+        time.sleep(0.01)
+        return arg, threading.get_ident() != main
+
+    async def check(func, arg):
+        ticked = []
+
+        async def ticker():
+            ticked.append(True)
+
+        task = asyncio.create_task(ticker())
+        result = await func(arg)
+        await task
+        return result, ticked
+
+    with ThreadPoolExecutor(2) as executor:
+
+        @aspectlib.Aspect
+        def aspect(arg):
+            result = yield aspectlib.ProceedIn(executor, aspectlib.Proceed(arg + 1))
+            yield aspectlib.Return(result)
+
+        @aspectlib.Aspect
+        async def async_aspect(arg):
+            yield aspectlib.ProceedIn(executor)
+
+        assert asyncio.run(check(aspect(raw), 1)) == ((2, True), [True])
+        assert asyncio.run(check(async_aspect(raw), 3)) == ((3, True), [True])
+        assert asyncio.run(check(aspectlib.AspectChain([aspect, aspect])(raw), 1)) == ((3, True), [True])
+
+
+def test_proceed_in_process_pool_on_coroutine():
+    with ProcessPoolExecutor(1) as executor:
+
+        @aspectlib.Aspect
+        def aspect(arg):
+            result, pid = yield aspectlib.ProceedIn(executor, aspectlib.Proceed(arg + 1))
+            yield aspectlib.Return((result, pid != os.getpid()))
+
+        with aspectlib.weave(module_coro, aspect):
+            assert asyncio.run(module_coro(1)) == (2, True)
+
+
+def test_proceed_all_on_coroutine():
+    running = []
+
+    @aspectlib.Aspect
+    def aspect(arg):
+        results = yield aspectlib.ProceedAll([aspectlib.Proceed(arg), aspectlib.Proceed(arg + 1), aspectlib.Proceed(arg + 2)])
+        yield aspectlib.Return((results, max(running)))
+
+    @aspect
+    async def func(arg):
+        running.append(len(running) + 1)
+        await asyncio.sleep(0.01)
+        return arg * 10
+
+    assert asyncio.run(func(1)) == ([10, 20, 30], 3)
+
+    with ThreadPoolExecutor(2) as executor:
+
+        @aspectlib.Aspect
+        async def in_threads(arg):
+            yield aspectlib.ProceedAll([aspectlib.Proceed, aspectlib.Proceed(arg + 1)], executor)
+
+        async def where(arg):
+            return arg, threading.current_thread().name[:18]
+
+        assert asyncio.run(in_threads(where)(1)) == [(1, 'ThreadPoolExecutor'), (2, 'ThreadPoolExecutor')]
+
+
+def test_proceed_all_on_coroutine_errors_in_order():
+    seen = []
+    finished = []
+
+    @aspectlib.Aspect
+    def aspect(arg):
+        try:
+            yield aspectlib.ProceedAll([aspectlib.Proceed(0), aspectlib.Proceed(1), aspectlib.Proceed(2)])
+        except Exception as exc:
+            seen.append(type(exc))
+            yield aspectlib.Return('failed')
+
+    @aspect
+    async def func(arg):
+        if arg == 0:
+            await asyncio.sleep(0.01)
+            raise ValueError(arg)
+        elif arg == 1:
+            raise KeyError(arg)
+        await asyncio.sleep(0.05)
+        finished.append(arg)
+
+    async def main():
+        result = await func(None)
+        await asyncio.sleep(0.1)
+        return result
+
+    assert asyncio.run(main()) == 'failed'
+    assert seen == [ValueError]
+    assert finished == []
+
+
+def test_aspect_inlined_on_coroutine():
+    calls = []
+
+    @aspectlib.Aspect
+    def aspect(arg):
+        calls.append(arg)
+        result = yield
+        calls.append(result)
+
+    @aspect
+    async def func(arg):
+        await asyncio.sleep(0)
+        return arg * 2
+
+    assert func.__code__.co_name == ('advising_asyncgenerator_wrapper_py35' if DEBUG else 'advising_inlined_coroutine_wrapper')
+    assert inspect.iscoroutinefunction(func)
+    assert asyncio.run(func(2)) == 4
+    assert calls == [2, 4]
+
+
+def test_switch_on_coroutine():
+    switch = aspectlib.Switch(aspectlib.Hooks(after_returning=lambda result, arg: calls.append(result)), enabled=False)
+    calls = []
+
+    @switch
+    async def func(arg):
+        await asyncio.sleep(0)
+        return arg * 2
+
+    assert inspect.iscoroutinefunction(func)
+    assert asyncio.run(func(1)) == 2
+    switch.enable()
+    assert asyncio.run(func(2)) == 4
+    assert calls == [4]
+
+
+def test_switch_on_asyncgenerator():
+    switch = aspectlib.Switch(aspectlib.Hooks(before=lambda arg: calls.append(arg)))
+    calls = []
+
+    @switch
+    async def func(arg):
+        for i in range(arg):
+            yield i
+
+    assert inspect.isasyncgenfunction(func)
+    assert _collect(func(3)) == [0, 1, 2]
+    switch.disable()
+    assert _collect(func(2)) == [0, 1]
+    assert calls == [3]
+
+
+def test_scoped_in_tasks():
+    scope = aspectlib.Scoped(aspectlib.Hooks(after_returning=lambda result, arg: calls.append(result)))
+    calls = []
+
+    @scope
+    async def func(arg):
+        await asyncio.sleep(0)
+        return arg
+
+    async def request(arg, traced):
+        if traced:
+            with aspectlib.active(scope):
+                return await func(arg)
+        else:
+            return await func(arg)
+
+    async def main():
+        return await asyncio.gather(*[request(i, i % 2) for i in range(6)])
+
+    assert asyncio.run(main()) == list(range(6))
+    assert sorted(calls) == [1, 3, 5]
+
+
+def test_weave_counters_async():
+    class Counted:
+        async def coro(self, fail):
+            if fail:
+                raise ValueError('fail')
+            return 'ok'
+
+        async def agen(self):
+            yield 1
+            yield 2
+
+    with aspectlib.weave(Counted, aspectlib.Hooks(), counters=True):
+        obj = Counted()
+        assert asyncio.run(obj.coro(False)) == 'ok'
+        with pytest.raises(ValueError, match='^fail$'):
+            asyncio.run(obj.coro(True))
+        assert _collect(obj.agen()) == [1, 2]
+        (entry,) = aspectlib.weaves()[-1:]
+        assert sorted((counter['name'], counter['calls'], counter['exceptions']) for counter in entry['counters']) == [
+            ('test_aspectlib_py37.test_weave_counters_async.<locals>.Counted.agen', 1, 0),
+            ('test_aspectlib_py37.test_weave_counters_async.<locals>.Counted.coro', 2, 1),
+        ]
@@ -1,3 +1,6 @@
+import gc
+import weakref
+
 import pytest
 
 from aspectlib.test import OrderedDict
@@ -39,6 +42,18 @@ def nfun(a, b=2):
     return a, b
 
 
+class Weakly:
+    def meth(self, a):
+        return a
+
+
+class Slotted:
+    __slots__ = ()
+
+    def meth(self, a):
+        return a
+
+
 def test_record():
     fun = record(nfun)
 
@@ -151,6 +166,25 @@ def test_record_as_context():
     assert history.calls == []
 
 
+def test_record_weak():
+    with record(Weakly.meth, weak=True) as history:
+        obj = Weakly()
+        assert obj.meth(1) == 1
+        (call,) = history.calls
+        assert call.self() is obj
+        assert call.args == (1,)
+        del obj
+        gc.collect()
+        assert call.self() is None
+
+
+def test_record_weak_fallback():
+    with record(Slotted.meth, weak=True) as history:
+        obj = Slotted()
+        obj.meth(1)
+    assert history.calls == [(obj, (1,), {})]
+
+
 def test_bad_mock():
     pytest.raises(TypeError, mock)
     pytest.raises(TypeError, mock, call=False)
@@ -595,6 +629,22 @@ def test_story_create():
     }
 
 
+def test_story_create_doesnt_keep_instances():
+    with Story(test_mod) as story:
+        for i in range(1000):
+            obj = test_mod.Stuff(i)
+            obj.meth(i) == 123  # noqa: B015
+            ref = weakref.ref(obj)
+            del obj
+            assert ref() is None
+            assert len(story._ids) == 0
+        obj = test_mod.Stuff('other')
+        obj.mix('other') == 'mixymix'  # noqa: B015
+        assert len(story._ids) == 1
+    assert story._calls[(None, 'test_pkg1.test_pkg2.test_mod.Stuff', "'other'", '')] == _Binds('stuff_1001')
+    assert story._calls[('stuff_1001', 'mix', "'other'", '')] == _Returns("'mixymix'")
+
+
 def xtest_story_empty_play_proxy_class_dependencies():
     with Story(test_mod).replay(recurse_lock=True, proxy=True, strict=False) as replay:
         obj = test_mod.Stuff(1, 2)